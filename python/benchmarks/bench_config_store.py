@@ -0,0 +1,299 @@
+"""
+Benchmarks for the cog config store and the DatabaseConfigurableCog lifecycle.
+
+Run from the python directory:
+
+    python -m benchmarks.bench_config_store --output results.json
+    python -m benchmarks.bench_config_store \
+        --db-url postgresql+psycopg://localhost/bench --sizes 10,1000
+
+Without --db-url a throwaway SQLite database is used. On any other database only
+the benchmark's own keys are touched, and they are deleted afterwards.
+
+Results are written as JSON, so runs of different releases can be diffed.
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import sqlalchemy
+from derpz_botlib.cog import DatabaseConfigurableCog
+from derpz_botlib.database.db import SqlAlchemyBase, create_engine_from_url
+from derpz_botlib.database.storage import (
+    AsyncSqlAlchemyKvJsonStore,
+    CogConfigStore,
+    CogConfiguration,
+    TTLCache,
+)
+from derpz_botlib.database.tables import cog_config_store
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+DEFAULT_SIZES = [10, 1_000, 10_000, 100_000]
+# Every key written by the benchmark belongs to a cog with this prefix
+BENCH_COG_PREFIX = "ConfigStoreBenchmark"
+STORE_KEY_SUFFIX = BENCH_COG_PREFIX + "Store"
+
+logger = logging.getLogger("bench_config_store")
+
+
+class BenchConfig(CogConfiguration):
+    members: set[int] = set()
+    channels: dict[int, int] = {}
+
+
+class ConfigStoreBenchmarkCog(DatabaseConfigurableCog[BenchConfig]):
+    def __init__(self, bot):
+        super().__init__(bot, BenchConfig)
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchGuild:
+    id: int
+    name: str
+
+
+class BenchBot:
+    """Just enough of a ConfigurableCogsBot for a DatabaseConfigurableCog"""
+
+    def __init__(self, cog_config_store: CogConfigStore, guild_count: int):
+        self.logger = logger.getChild("bot")
+        self.cog_config_store = cog_config_store
+        self.guilds = [BenchGuild(n, f"guild {n}") for n in range(guild_count)]
+        self._guilds_by_id = {guild.id: guild for guild in self.guilds}
+
+    def get_guild(self, guild_id: int) -> Optional[BenchGuild]:
+        return self._guilds_by_id.get(guild_id)
+
+    def is_ready(self) -> bool:
+        return True
+
+
+class Timings:
+    """Collects the timings of every benchmark run"""
+
+    def __init__(self):
+        self.results: dict[tuple[int, str], dict] = {}
+
+    def record(self, size: int, name: str, ops: int, seconds: float):
+        result = self.results.setdefault(
+            (size, name), dict(size=size, benchmark=name, ops=ops, runs=[])
+        )
+        result["runs"].append(seconds)
+
+    async def time(
+        self, size: int, name: str, ops: int, func: Callable[[], Awaitable]
+    ) -> None:
+        start = time.perf_counter()
+        await func()
+        self.record(size, name, ops, time.perf_counter() - start)
+
+    def to_json(self) -> list[dict]:
+        out = []
+        for result in self.results.values():
+            runs = result["runs"]
+            median = statistics.median(runs)
+            out.append(
+                dict(
+                    size=result["size"],
+                    benchmark=result["benchmark"],
+                    ops=result["ops"],
+                    seconds=dict(
+                        min=min(runs),
+                        median=median,
+                        mean=statistics.fmean(runs),
+                        max=max(runs),
+                    ),
+                    per_op_seconds=median / result["ops"],
+                    runs=runs,
+                )
+            )
+        return out
+
+
+async def delete_bench_keys(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.execute(
+            cog_config_store.delete().where(
+                cog_config_store.c.cog.like(f"{BENCH_COG_PREFIX}%")
+            )
+        )
+
+
+async def bench_store(
+    timings: Timings, store: AsyncSqlAlchemyKvJsonStore, size: int, samples: int
+):
+    key_value_map = {
+        f"{guild_id}.{STORE_KEY_SUFFIX}": {"members": [guild_id], "channels": {}}
+        for guild_id in range(size)
+    }
+    keys = list(key_value_map)
+    sample_keys = keys[:samples]
+
+    await timings.time(
+        size, "batch_set_insert", size, lambda: store.batch_set(key_value_map)
+    )
+    await timings.time(
+        size, "batch_set_update", size, lambda: store.batch_set(key_value_map)
+    )
+    await timings.time(size, "batch_get", size, lambda: store.batch_get(keys))
+
+    async def get_each():
+        for key in sample_keys:
+            await store.get(key)
+
+    async def set_each():
+        for key in sample_keys:
+            await store.set(key, key_value_map[key])
+
+    await timings.time(size, "get", len(sample_keys), get_each)
+    await timings.time(size, "set", len(sample_keys), set_each)
+
+
+async def bench_cog_lifecycle(
+    timings: Timings, cog_config_store: CogConfigStore, size: int, samples: int
+):
+    bot = BenchBot(cog_config_store, size)
+    cog = ConfigStoreBenchmarkCog(bot)
+    sample_guilds = bot.guilds[:samples]
+    # seed the configs the cog is going to load
+    await cog_config_store.batch_set_cog_config(
+        cog, {guild.id: BenchConfig(members={guild.id}) for guild in bot.guilds}
+    )
+
+    await timings.time(size, "cog_load", size, cog.cog_load)
+
+    async def hydrate():
+        # configs are parsed on their first access
+        for guild in bot.guilds:
+            cog.get_guild_config(guild)
+
+    await timings.time(size, "cog_hydrate", size, hydrate)
+    assert len(cog.config) == size
+
+    async def preload_and_cog_load():
+        await cog_config_store.preload([guild.id for guild in bot.guilds])
+        await cog.cog_load()
+        cog_config_store.release_snapshot()
+
+    await timings.time(size, "preload_cog_load", size, preload_and_cog_load)
+
+    async def edit():
+        for guild in sample_guilds:
+            config = cog.get_guild_config(guild)
+            config.channels[guild.id] = guild.id
+            await cog.save_guild_config(guild, config)
+
+    async def edit_partial():
+        for guild in sample_guilds:
+            await cog.add_to_guild_config_set(guild, "members", -guild.id)
+
+    await timings.time(size, "cog_edit", len(sample_guilds), edit)
+    await timings.time(size, "cog_edit_partial", len(sample_guilds), edit_partial)
+
+    async def unload():
+        # what the bot does for the cog on shutdown
+        cog_config_store.unsubscribe(cog, cog._on_config_invalidated)
+        await cog.flush_guild_configs()
+        await cog_config_store.close()
+
+    # every config is changed in memory without being saved, so all are dirty
+    for guild in bot.guilds:
+        cog.get_guild_config(guild).channels[-1] = -1
+    await timings.time(size, "cog_unload_flush", size, unload)
+
+
+async def run(args) -> dict:
+    engine = create_engine_from_url(args.db_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    timings = Timings()
+    try:
+        for size in args.sizes:
+            for run_number in range(args.repeat):
+                logger.info("size %s, run %s", size, run_number + 1)
+                cog_config_store = CogConfigStore(
+                    store,
+                    logger=logger.getChild("bot.cog_config_store"),
+                    write_behind=args.write_behind,
+                    cache=TTLCache(args.cache_size, 300) if args.cache_size else None,
+                )
+                await delete_bench_keys(engine)
+                await bench_store(timings, store, size, min(size, args.samples))
+                await bench_cog_lifecycle(
+                    timings, cog_config_store, size, min(size, args.samples)
+                )
+                await cog_config_store.close()
+    finally:
+        await delete_bench_keys(engine)
+        await engine.dispose()
+    return dict(
+        meta=dict(
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            dialect=engine.dialect.name,
+            driver=engine.dialect.driver,
+            python=platform.python_version(),
+            sqlalchemy=sqlalchemy.__version__,
+            platform=platform.platform(),
+            sizes=args.sizes,
+            repeat=args.repeat,
+            samples=args.samples,
+            write_behind=args.write_behind,
+            cache_size=args.cache_size,
+        ),
+        results=timings.to_json(),
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None):
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument(
+        "--db-url",
+        help="SQLAlchemy async URL to benchmark. Defaults to a temporary SQLite file",
+    )
+    argparser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_SIZES,
+        help="Comma separated numbers of guild keys",
+    )
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument(
+        "--samples",
+        type=int,
+        default=200,
+        help="Number of keys used by the benchmarks which do one key per call",
+    )
+    argparser.add_argument("--write-behind", action="store_true")
+    argparser.add_argument("--cache-size", type=int, default=0)
+    argparser.add_argument("--output", type=Path, help="Defaults to stdout")
+    return argparser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    logger.getChild("bot").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.db_url is None:
+            args.db_url = f"sqlite+aiosqlite:///{Path(tmp_dir) / 'bench.db'}"
+        report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
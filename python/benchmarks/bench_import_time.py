@@ -0,0 +1,170 @@
+"""
+Import time report of the plugins, from python -X importtime.
+
+Every module is imported in a fresh interpreter, so the numbers are what a
+cold start pays for it. The report lists the slowest dependencies of each
+module, and fails when a module pulls in a dependency which is meant to be
+imported lazily (see derpz_botlib.lazy), or takes longer than --max-ms.
+
+Run from the python directory:
+
+    python -m benchmarks.bench_import_time --output results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import pkgutil
+import platform
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+PYTHON_DIR = Path(__file__).resolve().parent.parent
+PLUGINS = [
+    f"math_tavern_bot_py.plugins.{module.name}"
+    for module in pkgutil.iter_modules([str(PYTHON_DIR / "math_tavern_bot_py/plugins")])
+]
+# Heavy dependencies the plugins only import on first use
+LAZY_DEPENDENCIES = ["dateparser", "libgen_api", "redis", "pkg_resources"]
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int, int]]:
+    """
+    Parses the output of -X importtime into (module, depth, self us,
+    cumulative us), in the order the imports finished
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # the header
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure(module: str) -> list[tuple[str, int, int, int]]:
+    """Imports the module in a fresh interpreter, see parse_importtime"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(PYTHON_DIR), *sys.path]))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PYTHON_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+    return parse_importtime(process.stderr)
+
+
+def run(args) -> dict:
+    results = []
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        # the fastest run has the least noise from the rest of the machine
+        imports = min(runs, key=lambda imports: imports[-1][3])
+        # what the module imported, without what the interpreter did on startup
+        start = len(imports) - 1
+        while start > 0 and imports[start - 1][1] > 0:
+            start -= 1
+        imports = imports[start:]
+        cumulative_ms = {name: cumulative / 1000 for name, _, _, cumulative in imports}
+        packages = [
+            name
+            for name in cumulative_ms
+            if "." not in name and name != module.split(".")[0]
+        ]
+        slowest = sorted(packages, key=cumulative_ms.get, reverse=True)[: args.top]
+        results.append(
+            dict(
+                module=module,
+                cumulative_ms=cumulative_ms[module],
+                modules_imported=len(imports),
+                slowest_dependencies={name: cumulative_ms[name] for name in slowest},
+                eager_lazy_dependencies=[
+                    name for name in args.lazy if name in cumulative_ms
+                ],
+            )
+        )
+    return dict(
+        meta=dict(
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            repeat=args.repeat,
+        ),
+        results=results,
+    )
+
+
+def regressions(report: dict, max_ms: Optional[float]) -> list[str]:
+    problems = []
+    for result in report["results"]:
+        if result["eager_lazy_dependencies"]:
+            problems.append(
+                f"{result['module']} imports {result['eager_lazy_dependencies']}"
+            )
+        if max_ms is not None and result["cumulative_ms"] > max_ms:
+            problems.append(
+                f"{result['module']} took {result['cumulative_ms']:.0f}ms"
+                f" to import, over {max_ms:.0f}ms"
+            )
+    return problems
+
+
+def parse_args(argv: Optional[list[str]] = None):
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument(
+        "--modules",
+        type=lambda value: value.split(","),
+        default=PLUGINS,
+        help="Comma separated modules to import. Defaults to every plugin",
+    )
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument(
+        "--top", type=int, default=5, help="Slowest dependencies listed per module"
+    )
+    argparser.add_argument(
+        "--lazy",
+        type=lambda value: value.split(","),
+        default=LAZY_DEPENDENCIES,
+        help="Comma separated dependencies which must not be imported eagerly",
+    )
+    argparser.add_argument(
+        "--max-ms", type=float, help="Fail when a module takes longer to import"
+    )
+    argparser.add_argument("--output", type=Path, help="Defaults to stdout")
+    return argparser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    for result in report["results"]:
+        print(
+            f"{result['module']}: {result['cumulative_ms']:.0f}ms, slowest: "
+            + ", ".join(
+                f"{name} {ms:.0f}ms"
+                for name, ms in result["slowest_dependencies"].items()
+            ),
+            file=sys.stderr,
+        )
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+    problems = regressions(report, args.max_ms)
+    for problem in problems:
+        print(f"Regression: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Microbenchmark of config serialization: the single-pass encoder against the
+json.loads(config.json()) round trip that was handed to the driver to encode
+again.
+
+Run from the python directory:
+
+    python -m benchmarks.bench_serialization --output results.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Optional
+
+from derpz_botlib.database import serialization
+from derpz_botlib.database.serialization import dumpb, encode_config, loads
+from derpz_botlib.database.storage import CogConfiguration
+from math_tavern_bot_py.plugins.plugin_auto_purge import AutoPurgeConfig
+from math_tavern_bot_py.plugins.plugin_tierlist import (
+    TierListChannelDetails,
+    TierListPluginConfiguration,
+)
+
+DEFAULT_SIZES = [10, 1_000, 10_000]
+
+
+def make_tierlist_config(size: int) -> TierListPluginConfiguration:
+    return TierListPluginConfiguration(
+        tier_list_category=1,
+        tier_lists={
+            channel_id: TierListChannelDetails(
+                name=f"Tier list {channel_id}",
+                owners=[channel_id, channel_id + 1, channel_id + 2],
+            )
+            for channel_id in range(size)
+        },
+    )
+
+
+def make_auto_purge_config(size: int) -> AutoPurgeConfig:
+    return AutoPurgeConfig(
+        channel_purge_interval={channel_id: 3600 for channel_id in range(size)}
+    )
+
+
+def legacy_encode(config: CogConfiguration) -> str:
+    # what set_cog_config did, followed by the driver's own encoding
+    return json.dumps(json.loads(config.json()))
+
+
+def legacy_decode(configclass, data: str) -> CogConfiguration:
+    return configclass.parse_obj(json.loads(data))
+
+
+def fast_encode(config: CogConfiguration) -> bytes:
+    return dumpb(encode_config(config))
+
+
+def fast_decode(configclass, data: bytes) -> CogConfiguration:
+    return configclass.parse_obj(loads(data))
+
+
+def measure(func: Callable[[], object], number: int, repeat: int) -> float:
+    """Best time of one call, in seconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def run(args) -> dict:
+    results = []
+    makers = {
+        "TierListPluginConfiguration": make_tierlist_config,
+        "AutoPurgeConfig": make_auto_purge_config,
+    }
+    for config_name, make_config in makers.items():
+        for size in args.sizes:
+            config = make_config(size)
+            configclass = type(config)
+            number = max(1, args.budget // max(size, 1))
+            legacy_data = legacy_encode(config)
+            fast_data = fast_encode(config)
+            assert json.loads(legacy_data) == loads(fast_data)
+            timings = dict(
+                encode_legacy=measure(
+                    lambda: legacy_encode(config), number, args.repeat
+                ),
+                encode=measure(lambda: fast_encode(config), number, args.repeat),
+                decode_legacy=measure(
+                    lambda: legacy_decode(configclass, legacy_data), number, args.repeat
+                ),
+                decode=measure(
+                    lambda: fast_decode(configclass, fast_data), number, args.repeat
+                ),
+            )
+            results.append(
+                dict(
+                    config=config_name,
+                    size=size,
+                    encoded_bytes=len(fast_data),
+                    seconds=timings,
+                    encode_speedup=timings["encode_legacy"] / timings["encode"],
+                    decode_speedup=timings["decode_legacy"] / timings["decode"],
+                )
+            )
+    return dict(
+        meta=dict(
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            orjson=serialization.orjson is not None,
+            sizes=args.sizes,
+            repeat=args.repeat,
+        ),
+        results=results,
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None):
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_SIZES,
+        help="Comma separated numbers of entries per config",
+    )
+    argparser.add_argument("--repeat", type=int, default=5)
+    argparser.add_argument(
+        "--budget",
+        type=int,
+        default=20_000,
+        help="Config entries processed per timing, spread over as many calls",
+    )
+    argparser.add_argument("--output", type=Path, help="Defaults to stdout")
+    return argparser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    report = run(args)
+    for result in report["results"]:
+        print(
+            f"{result['config']} ({result['size']} entries): "
+            f"encode x{result['encode_speedup']:.1f}, "
+            f"decode x{result['decode_speedup']:.1f}",
+            file=sys.stderr,
+        )
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Microbenchmark of AutoSullyPlugin.on_message: the sully index against
+looking the author up in the guild's config for every message.
+
+The messages are spread over --guilds guilds, a --sullied-guilds fraction of
+which sully --users-per-guild users each, and --match-rate of their messages
+are from a sullied user. The report gives the time per message, with and
+without what calling an empty listener costs, and what --rate messages per
+second would cost the event loop.
+
+Run from the python directory:
+
+    python -m benchmarks.bench_sully_index --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import sys
+import timeit
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+import disnake
+from derpz_botlib.bot_classes import ConfigurableCogsBot
+from derpz_botlib.database.db import create_engine_from_url
+from disnake.ext import commands
+from math_tavern_bot_py.plugins.plugin_autosully import (
+    AutoSullyConfig,
+    AutoSullyPlugin,
+)
+
+EMOJI_ID = 1
+
+
+async def add_reaction(emoji) -> None:
+    pass
+
+
+async def empty_listener(message) -> None:
+    # what calling any listener costs
+    pass
+
+
+async def legacy_on_message(plugin: AutoSullyPlugin, message) -> None:
+    # on_message before the index
+    if not message.guild:
+        return
+    guild_config = plugin.get_guild_config(message.guild)
+    if message.author.id in guild_config.sully_users:
+        if guild_config.sully_emoji is not None:
+            emoji = plugin.emoji_resolver.resolve(
+                message.guild.id, guild_config.sully_emoji
+            )
+            await message.add_reaction(emoji)
+
+
+def drive(coro) -> None:
+    """Runs a coroutine which never suspends, without an event loop"""
+    try:
+        coro.send(None)
+    except StopIteration:
+        pass
+    else:
+        raise RuntimeError("The coroutine suspended")
+
+
+def make_messages(plugin: AutoSullyPlugin, args) -> list:
+    rng = random.Random(0)
+    guilds = [SimpleNamespace(id=guild_id, name="") for guild_id in range(args.guilds)]
+    sullied = {}
+    for guild in rng.sample(guilds, int(args.guilds * args.sullied_guilds)):
+        users = [rng.randrange(10**6) for _ in range(args.users_per_guild)]
+        plugin.config[guild.id] = AutoSullyConfig(
+            sully_emoji=EMOJI_ID, sully_users=set(users)
+        )
+        sullied[guild.id] = users
+    messages = []
+    for _ in range(args.messages):
+        guild = rng.choice(guilds)
+        if guild.id in sullied and rng.random() < args.match_rate:
+            author_id = rng.choice(sullied[guild.id])
+        else:
+            # real user ids never collide with the sullied ones above
+            author_id = 10**6 + rng.randrange(10**6)
+        messages.append(
+            SimpleNamespace(
+                guild=guild,
+                author=SimpleNamespace(id=author_id),
+                add_reaction=add_reaction,
+            )
+        )
+    return messages
+
+
+async def run(args) -> dict:
+    bot = ConfigurableCogsBot(
+        command_prefix=commands.when_mentioned,
+        intents=disnake.Intents.none(),
+        engine=create_engine_from_url("sqlite+aiosqlite://"),
+    )
+    plugin = AutoSullyPlugin(bot)
+    messages = make_messages(plugin, args)
+    matches = sum(
+        message.author.id in plugin.get_guild_config(message.guild).sully_users
+        for message in messages
+    )
+
+    def dispatch():
+        for message in messages:
+            drive(empty_listener(message))
+
+    def legacy():
+        for message in messages:
+            drive(legacy_on_message(plugin, message))
+
+    def indexed():
+        for message in messages:
+            drive(plugin.on_message(message))
+
+    results = {}
+    for name, func in dict(dispatch=dispatch, legacy=legacy, indexed=indexed).items():
+        # the first pass parses the configs and builds the index
+        func()
+        seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        per_message = seconds / len(messages)
+        results[name] = dict(
+            seconds_per_message=per_message,
+            # without what calling the listener costs
+            listener_seconds_per_message=per_message
+            - results.get("dispatch", {}).get("seconds_per_message", per_message),
+            loop_share_at_rate=per_message * args.rate,
+        )
+    await bot.close()
+    return dict(
+        meta=dict(
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            guilds=args.guilds,
+            messages=args.messages,
+            matching_messages=matches,
+            rate=args.rate,
+            repeat=args.repeat,
+        ),
+        results=results,
+        speedup=results["legacy"]["seconds_per_message"]
+        / results["indexed"]["seconds_per_message"],
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None):
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument("--guilds", type=int, default=1_000)
+    argparser.add_argument("--messages", type=int, default=10_000)
+    argparser.add_argument(
+        "--rate", type=int, default=10_000, help="Messages per second to cost"
+    )
+    argparser.add_argument("--sullied-guilds", type=float, default=0.1)
+    argparser.add_argument("--users-per-guild", type=int, default=3)
+    argparser.add_argument("--match-rate", type=float, default=0.01)
+    argparser.add_argument("--repeat", type=int, default=5)
+    argparser.add_argument("--output", type=Path, help="Defaults to stdout")
+    return argparser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    for name, result in report["results"].items():
+        print(
+            f"{name}: {result['seconds_per_message'] * 1e9:.0f}ns per message "
+            f"({result['listener_seconds_per_message'] * 1e9:.0f}ns in the listener),"
+            f" {result['loop_share_at_rate']:.2%} of the loop at {args.rate}/s",
+            file=sys.stderr,
+        )
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
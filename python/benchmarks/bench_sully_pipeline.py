@@ -0,0 +1,161 @@
+"""
+Benchmark of the sully worker's reader loop, on an in-memory work queue.
+
+burst: how long --requests requests over --channels channels take to be
+reacted to, when every reaction takes --react-ms, handling them one at a time
+like the old reader did, or through a KeyedPipeline of --concurrency.
+
+idle: the CPU time and wake ups of --idle-seconds without requests, for the
+old loop (poll, then sleep 10ms) and for WorkQueue.consume().
+
+Run from the python directory:
+
+    python -m benchmarks.bench_sully_pipeline --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from derpz_botlib.pipeline import KeyedPipeline
+from derpz_botlib.work_queue import InMemoryStreams, InMemoryWorkQueue
+
+
+async def publish_burst(args) -> InMemoryWorkQueue:
+    queue = InMemoryWorkQueue(InMemoryStreams(), "sully", "worker-1")
+    # creates the group before the burst
+    await queue.read(block_seconds=0.001)
+    for n in range(args.requests):
+        await queue.publish(json.dumps(dict(channel_id=n % args.channels)))
+    return queue
+
+
+async def burst(args, concurrency: Optional[int]) -> float:
+    """Seconds until the burst is acked, one at a time if concurrency is None"""
+    queue = await publish_burst(args)
+    pipeline = KeyedPipeline(concurrency) if concurrency else None
+    acked = 0
+    done = asyncio.Event()
+
+    async def react(item):
+        nonlocal acked
+        await asyncio.sleep(args.react_ms / 1000)
+        await queue.ack(item.id)
+        acked += 1
+        if acked == args.requests:
+            done.set()
+
+    async def reader():
+        async for item in queue.consume(reclaim_idle_seconds=60):
+            if pipeline is None:
+                await react(item)
+            else:
+                channel_id = json.loads(item.payload)["channel_id"]
+                await pipeline.submit(channel_id, lambda item=item: react(item))
+
+    start = time.perf_counter()
+    task = asyncio.create_task(reader())
+    await done.wait()
+    seconds = time.perf_counter() - start
+    task.cancel()
+    return seconds
+
+
+async def idle(args, polling: bool) -> dict:
+    queue = InMemoryWorkQueue(InMemoryStreams(), "sully", "worker-1")
+    wake_ups = 0
+
+    async def poll():
+        while True:
+            await queue.read(block_seconds=0)
+            await asyncio.sleep(0.01)
+
+    async def consume():
+        async for _ in queue.consume(reclaim_idle_seconds=30):
+            pass
+
+    read = queue.read
+
+    async def counted_read(*read_args, **kwargs):
+        nonlocal wake_ups
+        wake_ups += 1
+        return await read(*read_args, **kwargs)
+
+    queue.read = counted_read
+    start = time.process_time()
+    task = asyncio.create_task(poll() if polling else consume())
+    await asyncio.sleep(args.idle_seconds)
+    task.cancel()
+    cpu_seconds = time.process_time() - start
+    return dict(
+        cpu_seconds=cpu_seconds,
+        cpu_share=cpu_seconds / args.idle_seconds,
+        wake_ups_per_second=wake_ups / args.idle_seconds,
+    )
+
+
+async def run(args) -> dict:
+    serial = await burst(args, None)
+    pipelined = await burst(args, args.concurrency)
+    return dict(
+        meta=dict(
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            requests=args.requests,
+            channels=args.channels,
+            react_ms=args.react_ms,
+            concurrency=args.concurrency,
+            idle_seconds=args.idle_seconds,
+        ),
+        burst=dict(
+            serial_seconds=serial,
+            pipeline_seconds=pipelined,
+            speedup=serial / pipelined,
+        ),
+        idle=dict(
+            polling=await idle(args, polling=True),
+            consume=await idle(args, polling=False),
+        ),
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None):
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument("--requests", type=int, default=200)
+    argparser.add_argument("--channels", type=int, default=20)
+    argparser.add_argument("--react-ms", type=float, default=50)
+    argparser.add_argument("--concurrency", type=int, default=8)
+    argparser.add_argument("--idle-seconds", type=float, default=5)
+    argparser.add_argument("--output", type=Path, help="Defaults to stdout")
+    return argparser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print(
+        f"burst: {report['burst']['serial_seconds']:.2f}s one at a time, "
+        f"{report['burst']['pipeline_seconds']:.2f}s pipelined",
+        file=sys.stderr,
+    )
+    for name, result in report["idle"].items():
+        print(
+            f"idle {name}: {result['cpu_share']:.2%} CPU, "
+            f"{result['wake_ups_per_second']:.1f} wake ups/s",
+            file=sys.stderr,
+        )
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Exports and imports the bot's cog configs and user data.
+
+    python config_cli.py export backup.ndjson.zst
+    python config_cli.py import backup.ndjson.zst --replace
+
+The database is taken from --db-url, or DATABASE_URL like the bot does.
+Backups whose name ends in .zst are zstd compressed.
+"""
+import argparse
+import asyncio
+import sys
+from os import getenv
+from pathlib import Path
+
+from derpz_botlib.database.backup import export_tables, import_tables, open_backup
+from derpz_botlib.database.db import SqlAlchemyBase, create_engine_from_url
+from derpz_botlib.database.storage import migrate_json_config_store
+from derpz_botlib.database.tables import cog_config_store
+from dotenv import load_dotenv
+from math_tavern_bot_py.plugins.plugin_goal_setting import Goal
+from math_tavern_bot_py.plugins.plugin_remind_me import Reminder
+from math_tavern_bot_py.plugins.plugin_sticky_roles import UserRoleCache
+
+BACKUP_TABLES = {
+    table.name: table
+    for table in [
+        cog_config_store,
+        Reminder.__table__,
+        Goal.__table__,
+        UserRoleCache.__table__,
+    ]
+}
+
+
+async def run(args) -> dict[str, int]:
+    engine = create_engine_from_url(args.db_url)
+    tables = [BACKUP_TABLES[name] for name in args.tables]
+    try:
+        # Like the bot does on startup: tables of plugins which never ran are
+        # created, and configs still in the legacy table are migrated
+        async with engine.begin() as conn:
+            await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+        await migrate_json_config_store(engine)
+        if args.command == "export":
+            with open_backup(args.path, "wb") as fp:
+                return await export_tables(engine, tables, fp)
+        with open_backup(args.path, "rb") as fp:
+            return await import_tables(engine, tables, fp, replace=args.replace)
+    finally:
+        await engine.dispose()
+
+
+def parse_args(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument("command", choices=["export", "import"])
+    argparser.add_argument("path", type=Path)
+    argparser.add_argument("--db-url", default=getenv("DATABASE_URL"))
+    argparser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=list(BACKUP_TABLES),
+        default=list(BACKUP_TABLES),
+    )
+    argparser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Empty the tables before importing, instead of merging into them",
+    )
+    return argparser.parse_args(argv)
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    if not args.db_url:
+        raise ValueError("No DATABASE_URL found in environment variables.")
+    counts = asyncio.run(run(args))
+    for name, count in counts.items():
+        print(f"{args.command}ed {count} rows of {name}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ TODO: Extract this out into some kind of pip package
 - `rich`
 - `sqlalchemy`
 - `psycopg`
+- `aiosqlite` (for the SQLite backend)
 - `pydantic`
 - `disnake`
 - `sentry_sdk`
@@ -1,11 +1,26 @@
+import asyncio
+import dataclasses
 import logging
 import os
+import time
+import types
 from collections import deque
+from typing import Optional, Union
 
 import rich
 from derpz_botlib.database.db import SqlAlchemyBase
+from derpz_botlib.database.instrumentation import instrument_engine, set_db_cog
 from derpz_botlib.database.storage import (AsyncSqlAlchemyKvJsonStore,
-                                           CogConfigStore)
+                                           CogConfigStore, ConfigChangeListener,
+                                           KvJsonStore, TTLCache,
+                                           install_config_change_trigger,
+                                           migrate_json_config_store)
+from derpz_botlib.command_metrics import (CommandMetrics,
+                                          resolve_application_command)
+from derpz_botlib.listener_profiler import ListenerProfiler, SteppedCoroutine
+from derpz_botlib.metrics import MetricsRegistry, serve_prometheus
+from derpz_botlib.startup import (DEFAULT_COG_LOAD_TIMEOUT, CogLoadReport,
+                                  overrides_cog_load, run_cog_loads)
 from disnake import ApplicationCommandInteraction
 from disnake.ext import commands
 from disnake.ext.commands import errors
@@ -13,6 +28,21 @@ from rich.logging import RichHandler
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 
+@dataclasses.dataclass
+class ConfigFlushReport:
+    """
+    What the shutdown flush wrote and what it dropped, in configs per cog.
+    The write-behind queue of the config store is reported as a cog of its own.
+    """
+
+    flushed: dict[str, int] = dataclasses.field(default_factory=dict)
+    dropped: dict[str, int] = dataclasses.field(default_factory=dict)
+    seconds: float = 0.0
+
+
+WRITE_BEHIND_QUEUE = "write-behind queue"
+
+
 def get_log_level_from_env() -> int:
     """
     Gets the log level from the environment.
@@ -24,14 +54,47 @@ def get_log_level_from_env() -> int:
 
 
 class LoggedBot(commands.Bot):
-    """A bot with logging and sentry configured"""
+    """
+    A bot with logging, sentry and a metrics registry configured.
+
+    Every command and event listener is timed into the registry, see
+    derpz_botlib.command_metrics. Set METRICS_PORT to serve the registry to
+    Prometheus on http://METRICS_HOST:METRICS_PORT/metrics (METRICS_HOST
+    defaults to 127.0.0.1). LISTENER_PROFILE_SAMPLE_RATE of the listener calls,
+    and those slower than LISTENER_SLOW_SECONDS, are profiled in detail, see
+    derpz_botlib.listener_profiler.
+
+    Extensions loaded through load_extensions_concurrently() have the cog_load
+    of their cogs run concurrently, each within COG_LOAD_TIMEOUT seconds unless
+    the cog sets its own cog_load_timeout. cogs_ready is set once they finished.
+    hot_reload_extension() reloads one extension while keeping its cogs' state.
+    """
 
     def __init__(self, *args, **options):
         super().__init__(*args, **options)
         # This gets the name of the inherited class so the logger name is correct
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.metrics = MetricsRegistry()
+        self.command_metrics = CommandMetrics(
+            self.metrics, max_guild_buckets=int(os.getenv("METRICS_GUILD_BUCKETS", 20))
+        )
+        self._metrics_server = None
+        self.listener_profiler = ListenerProfiler(
+            self.command_metrics,
+            sample_rate=float(os.getenv("LISTENER_PROFILE_SAMPLE_RATE", 0.01)),
+            slow_seconds=float(os.getenv("LISTENER_SLOW_SECONDS", 0.25)),
+        )
         self._configure_logging()
         self._configure_sentry()
+        self.cog_load_timeout = float(
+            os.getenv("COG_LOAD_TIMEOUT", DEFAULT_COG_LOAD_TIMEOUT)
+        )
+        self.cogs_ready = asyncio.Event()
+        self.cog_load_report: Optional[CogLoadReport] = None
+        # Cogs added by the extensions being loaded, whose cog_load is deferred
+        self._deferred_cog_loads: Optional[list[commands.Cog]] = None
+        self._extension_startup: Optional[asyncio.Future] = None
+        self._hot_reload_lock = asyncio.Lock()
 
     def _configure_logging(self):
         # TODO: Allow user configuration for this
@@ -43,6 +106,238 @@ class LoggedBot(commands.Bot):
         # TODO: Add logstash handler
         self.logger.addHandler(rh)
 
+    async def start(self, *args, **kwargs):
+        await self.start_metrics_server()
+        await super().start(*args, **kwargs)
+
+    async def start_metrics_server(self):
+        port = os.getenv("METRICS_PORT")
+        if port is None or self._metrics_server is not None:
+            return
+        host = os.getenv("METRICS_HOST", "127.0.0.1")
+        self._metrics_server = await serve_prometheus(self.metrics, host, int(port))
+        self.logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self) -> None:
+        if self._metrics_server is not None:
+            await self._metrics_server.cleanup()
+            self._metrics_server = None
+        await super().close()
+
+    async def invoke(self, ctx: commands.Context) -> None:
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+        metrics = self.command_metrics.command(
+            ctx.command, ctx.guild.id if ctx.guild is not None else None
+        )
+        metrics.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            metrics.latency.observe(time.perf_counter() - start)
+            metrics.in_flight.dec()
+            if ctx.command_failed:
+                metrics.errors.inc()
+
+    async def process_application_commands(
+        self, interaction: ApplicationCommandInteraction
+    ) -> None:
+        command = resolve_application_command(self, interaction)
+        if command is None:
+            await super().process_application_commands(interaction)
+            return
+        metrics = self.command_metrics.command(command, interaction.guild_id)
+        metrics.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await super().process_application_commands(interaction)
+        finally:
+            metrics.latency.observe(time.perf_counter() - start)
+            metrics.in_flight.dec()
+            if interaction.command_failed:
+                metrics.errors.inc()
+
+    async def _run_event(self, coro, event_name: str, *args, **kwargs) -> None:
+        # Client._run_event, timed and sometimes profiled
+        metrics = self.command_metrics.listener(coro, event_name)
+        stepped = None
+        metrics.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            if self.listener_profiler.should_sample():
+                stepped = SteppedCoroutine(coro(*args, **kwargs))
+                await stepped
+            else:
+                await coro(*args, **kwargs)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            metrics.errors.inc()
+            try:
+                await self.on_error(event_name, *args, **kwargs)
+            except asyncio.CancelledError:
+                pass
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.latency.observe(seconds)
+            metrics.in_flight.dec()
+            if stepped is not None:
+                self.listener_profiler.record(
+                    metrics, seconds, stepped.loop_seconds, args
+                )
+            elif seconds >= self.listener_profiler.slow_seconds:
+                self.listener_profiler.record(metrics, seconds, None, args)
+
+    def add_cog(self, cog: commands.Cog, *, override: bool = False) -> None:
+        if self._deferred_cog_loads is None or not overrides_cog_load(cog):
+            super().add_cog(cog, override=override)
+            return
+        # disnake would start cog_load right away in a task of its own,
+        # it runs along with the cog_load of the other extensions instead
+        cog.cog_load = types.MethodType(commands.Cog.cog_load, cog)
+        try:
+            super().add_cog(cog, override=override)
+        finally:
+            del cog.cog_load
+        self._deferred_cog_loads.append(cog)
+
+    async def load_extensions_concurrently(self, names: list[str]) -> CogLoadReport:
+        """
+        Loads the extensions one by one, then runs the cog_load of their cogs
+        concurrently, see derpz_botlib.startup.
+        Extensions which are loaded already are skipped, and a call made while
+        another one runs waits for that one, so this is safe to call from every
+        on_ready. Failures are logged and reported, not raised.
+        """
+        if self._extension_startup is None:
+            self._extension_startup = asyncio.ensure_future(
+                self._load_extensions_concurrently(names)
+            )
+            self._extension_startup.add_done_callback(self._extension_startup_done)
+        return await asyncio.shield(self._extension_startup)
+
+    def _extension_startup_done(self, future: asyncio.Future) -> None:
+        self._extension_startup = None
+        self.cogs_ready.set()
+
+    async def _load_extensions_concurrently(self, names: list[str]) -> CogLoadReport:
+        start = time.perf_counter()
+        failed = {}
+        self._deferred_cog_loads = []
+        try:
+            for name in names:
+                if name in self.extensions:
+                    continue
+                try:
+                    self.load_extension(name)
+                except commands.ExtensionError as e:
+                    self.logger.exception("Failed to load %s", name, exc_info=e)
+                    failed[name] = repr(e)
+        finally:
+            cogs, self._deferred_cog_loads = self._deferred_cog_loads, None
+        report = await run_cog_loads(
+            cogs,
+            loaded=self.cogs.keys() - {cog.qualified_name for cog in cogs},
+            timeout=self.cog_load_timeout,
+            logger=self.logger.getChild("startup"),
+        )
+        report.failed.update(failed)
+        report.seconds = time.perf_counter() - start
+        cog_load_seconds = self.metrics.gauge(
+            "cog_load_seconds", "How long the cog_load of each cog took", ("cog",)
+        )
+        for cog_name, seconds in report.loaded.items():
+            cog_load_seconds.set(seconds, cog=cog_name)
+        self.logger.info(
+            "Loaded %s cogs in %.2fs", len(report.loaded), report.seconds
+        )
+        if report.failed:
+            self.logger.error("Failed to load: %s", report.failed)
+        self.cog_load_report = report
+        return report
+
+    def extension_cogs(self, name: str) -> dict[str, commands.Cog]:
+        """The cogs added by an extension or its submodules, by name"""
+        return {
+            cog_name: cog
+            for cog_name, cog in self.cogs.items()
+            if cog.__module__ == name or cog.__module__.startswith(f"{name}.")
+        }
+
+    async def hot_reload_extension(self, name: str) -> CogLoadReport:
+        """
+        Reloads an extension, handing the in-memory state of its cogs over
+        to their new instances (see LoggedCog.hand_over_state): nothing is
+        written back or read again from the database.
+        The work in flight of the old cogs is drained first, then the
+        extension is reloaded and the cog_load of the new cogs runs like on
+        startup. If the new code fails to load, the old code is loaded again
+        and takes the state back. Failures are logged and reported.
+        """
+        if self._extension_startup is not None:
+            await asyncio.shield(self._extension_startup)
+        async with self._hot_reload_lock:
+            return await self._hot_reload_extension(name)
+
+    async def _hot_reload_extension(self, name: str) -> CogLoadReport:
+        start = time.perf_counter()
+        old_cogs = self.extension_cogs(name)
+        await asyncio.gather(
+            *(
+                cog.drain_pending_work()
+                for cog in old_cogs.values()
+                if hasattr(cog, "drain_pending_work")
+            )
+        )
+        # no awaiting from here until the new cogs took the state over,
+        # the old cogs must not change it after handing it over
+        states = {
+            cog_name: cog.hand_over_state()
+            for cog_name, cog in old_cogs.items()
+            if hasattr(cog, "hand_over_state")
+        }
+        failed = {}
+        self._deferred_cog_loads = []
+        try:
+            self.reload_extension(name)
+        except commands.ExtensionError as e:
+            self.logger.exception("Failed to reload %s", name, exc_info=e)
+            failed[name] = repr(e)
+        finally:
+            cogs, self._deferred_cog_loads = self._deferred_cog_loads, None
+        # cogs added by a setup which failed half-way were removed again
+        cogs = [cog for cog in cogs if self.cogs.get(cog.qualified_name) is cog]
+        for cog in cogs:
+            state = states.pop(cog.qualified_name, None)
+            if state is not None and hasattr(cog, "take_over_state"):
+                cog.take_over_state(state)
+        for cog_name, state in states.items():
+            # the cog is gone from the new code, unload it for real
+            self.logger.warning("%s was removed by the reload of %s", cog_name, name)
+            old_cogs[cog_name].take_over_state(state)
+            old_cogs[cog_name].cog_unload()
+        report = await run_cog_loads(
+            cogs,
+            loaded=self.cogs.keys() - {cog.qualified_name for cog in cogs},
+            timeout=self.cog_load_timeout,
+            logger=self.logger.getChild("startup"),
+        )
+        report.failed.update(failed)
+        report.seconds = time.perf_counter() - start
+        self.metrics.gauge(
+            "hot_reload_seconds", "How long the last hot reload took", ("extension",)
+        ).set(report.seconds, extension=name)
+        self.logger.info("Hot reloaded %s in %.2fs", name, report.seconds)
+        if report.failed:
+            self.logger.error("Failed to reload: %s", report.failed)
+        return report
+
+    async def wait_until_cogs_ready(self) -> None:
+        """Waits until the first load_extensions_concurrently() finished"""
+        await self.cogs_ready.wait()
+
     def _configure_sentry(self):
         sentry_dsn = os.getenv("SENTRY_DSN")
         if sentry_dsn is None:
@@ -126,13 +421,32 @@ class LoggedBot(commands.Bot):
 
 
 class DatabasedBot(LoggedBot):
-    """A bot with a database connection attached"""
+    """
+    A bot with a database connection attached.
+    The engine is instrumented into the bot's metrics; statements run by
+    commands are labelled with the command's cog.
+    """
 
     def __init__(self, *args, engine: AsyncEngine, **options):
         super().__init__(*args, **options)
         # TODO: Create a sync engine too
         self.engine = engine
         self.engine_logger = self.logger.getChild("database")
+        instrument_engine(self.engine, self.metrics)
+        self.before_invoke(self._label_db_calls)
+        self.before_slash_command_invoke(self._label_db_calls)
+        self.before_user_command_invoke(self._label_db_calls)
+        self.before_message_command_invoke(self._label_db_calls)
+
+    @staticmethod
+    async def _label_db_calls(
+        ctx: Union[commands.Context, ApplicationCommandInteraction]
+    ):
+        if isinstance(ctx, commands.Context):
+            cog = ctx.cog
+        else:
+            cog = ctx.application_command.cog
+        set_db_cog(cog.qualified_name if cog is not None else "")
 
     async def start(self, *args, **kwargs):
         await self._init_db()
@@ -149,9 +463,190 @@ class DatabasedBot(LoggedBot):
 
 
 class ConfigurableCogsBot(DatabasedBot):
-    def __init__(self, *args, engine: AsyncEngine, **options):
+    """
+    A bot which stores per-guild cog configuration in the database.
+    Pass a kv_store to keep the configuration somewhere else, e.g. in memory.
+
+    Set CONFIG_WRITE_BEHIND=1 to queue config writes and flush them in batches.
+    CONFIG_FLUSH_INTERVAL (seconds) and CONFIG_FLUSH_MAX_PENDING tune when
+    the queue gets flushed.
+
+    Configs are cached in memory (CONFIG_CACHE_SIZE entries for
+    CONFIG_CACHE_TTL seconds). On Postgres, changes made by other processes
+    invalidate the cache through LISTEN/NOTIFY.
+
+    Await preload_cog_configs() before loading the extensions, so that all the
+    cogs hydrate from one query instead of one query each. The snapshot is
+    dropped after CONFIG_SNAPSHOT_TTL seconds.
+
+    On close, the dirty configs of every cog and the write-behind queue are
+    flushed concurrently. Whatever is not written within
+    CONFIG_SHUTDOWN_TIMEOUT seconds is dropped, see flush_cog_configs().
+    """
+
+    def __init__(
+        self,
+        *args,
+        engine: AsyncEngine,
+        kv_store: Optional[KvJsonStore] = None,
+        **options,
+    ):
         super().__init__(*args, engine=engine, **options)
-        self.kv_store = AsyncSqlAlchemyKvJsonStore(self.engine)
+        self.kv_store = kv_store or AsyncSqlAlchemyKvJsonStore(self.engine)
         self.cog_config_store = CogConfigStore(
-            self.kv_store, logger=self.logger.getChild("cog_config_store")
+            self.kv_store,
+            logger=self.logger.getChild("cog_config_store"),
+            write_behind=os.getenv("CONFIG_WRITE_BEHIND", "0") == "1",
+            flush_interval=float(os.getenv("CONFIG_FLUSH_INTERVAL", 1.0)),
+            max_pending=int(os.getenv("CONFIG_FLUSH_MAX_PENDING", 100)),
+            cache=TTLCache(
+                maxsize=int(os.getenv("CONFIG_CACHE_SIZE", 10_000)),
+                ttl=float(os.getenv("CONFIG_CACHE_TTL", 300)),
+            ),
+        )
+        self.config_change_listener: Optional[ConfigChangeListener] = None
+        self._release_snapshot_handle: Optional[asyncio.TimerHandle] = None
+        self.config_shutdown_timeout = float(os.getenv("CONFIG_SHUTDOWN_TIMEOUT", 10))
+        # Flushes of unloaded cogs, with the cog name and number of configs
+        self._config_flushes: dict[asyncio.Task, tuple[str, int]] = {}
+        self._configs_flushed_on_close = False
+        self.config_flush_report: Optional[ConfigFlushReport] = None
+
+    async def _init_db(self):
+        await super()._init_db()
+        migrated = await migrate_json_config_store(self.engine)
+        if migrated:
+            self.engine_logger.info(
+                "Migrated %s configs from json_config_store to cog_config_store",
+                migrated,
+            )
+        if self.engine.dialect.name != "postgresql":
+            return
+        async with self.engine.begin() as conn:
+            await install_config_change_trigger(conn)
+        self.config_change_listener = ConfigChangeListener(
+            self.engine,
+            self.cog_config_store,
+            logger=self.engine_logger.getChild("config_listener"),
+        )
+        self.config_change_listener.start()
+
+    async def preload_cog_configs(self):
+        """Loads the config of every cog for every guild the bot is in"""
+        await self.cog_config_store.preload([guild.id for guild in self.guilds])
+        if self._release_snapshot_handle is not None:
+            self._release_snapshot_handle.cancel()
+        # Cogs loaded much later should not hydrate from an old snapshot
+        self._release_snapshot_handle = self.loop.call_later(
+            float(os.getenv("CONFIG_SNAPSHOT_TTL", 60)),
+            self.cog_config_store.release_snapshot,
         )
+
+    def schedule_config_flush(self, cog) -> None:
+        """
+        Flushes the dirty configs of a cog in the background,
+        e.g. when it is unloaded. close() waits for scheduled flushes.
+        """
+        if self._configs_flushed_on_close:
+            return
+        dirty = cog.dirty_guild_configs()
+        if not dirty:
+            return
+        task = asyncio.create_task(cog.flush_guild_configs(dirty))
+        self._config_flushes[task] = (cog.qualified_name, len(dirty))
+        task.add_done_callback(self._config_flush_done)
+
+    def _config_flush_done(self, task: asyncio.Task) -> None:
+        cog_name, count = self._config_flushes.pop(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(
+                "Failed to flush %s configs of %s",
+                count,
+                cog_name,
+                exc_info=task.exception(),
+            )
+
+    async def flush_cog_configs(
+        self, timeout: Optional[float] = None
+    ) -> ConfigFlushReport:
+        """
+        Flushes the dirty configs of every cog and the flushes scheduled by
+        unloaded cogs, all concurrently, then the write-behind queue they fill.
+        Flushes which are not done after timeout seconds (CONFIG_SHUTDOWN_TIMEOUT
+        by default) are cancelled, and reported as dropped along with the ones
+        which failed.
+        """
+        if timeout is None:
+            timeout = self.config_shutdown_timeout
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        flushes = dict(self._config_flushes)
+        for cog in list(self.cogs.values()):
+            dirty_guild_configs = getattr(cog, "dirty_guild_configs", None)
+            if dirty_guild_configs is None:
+                continue
+            dirty = dirty_guild_configs()
+            if dirty:
+                task = asyncio.create_task(cog.flush_guild_configs(dirty))
+                flushes[task] = (cog.qualified_name, len(dirty))
+            # encoding the dirty configs takes a while, keep the heartbeat going
+            await asyncio.sleep(0)
+
+        async def wait(tasks) -> set[asyncio.Task]:
+            """Waits for tasks until the timeout, and cancels those not done"""
+            if not tasks:
+                return set()
+            remaining = max(0.0, timeout - (loop.time() - start))
+            _, not_done = await asyncio.wait(tasks, timeout=remaining)
+            for task in not_done:
+                task.cancel()
+            return not_done
+
+        not_done = await wait(flushes)
+        # the queue is only closed once the cogs are done adding to it
+        if self.cog_config_store.write_behind:
+            task = asyncio.create_task(self.cog_config_store.close())
+            flushes[task] = (WRITE_BEHIND_QUEUE, self.cog_config_store.pending_count)
+            not_done |= await wait([task])
+
+        report = ConfigFlushReport()
+        for task, (cog_name, count) in flushes.items():
+            if count == 0:
+                continue
+            if task in not_done:
+                report.dropped[cog_name] = report.dropped.get(cog_name, 0) + count
+            elif task.exception() is not None:
+                self.logger.error(
+                    "Failed to flush %s configs of %s",
+                    count,
+                    cog_name,
+                    exc_info=task.exception(),
+                )
+                report.dropped[cog_name] = report.dropped.get(cog_name, 0) + count
+            else:
+                report.flushed[cog_name] = report.flushed.get(cog_name, 0) + count
+        report.seconds = loop.time() - start
+        self.logger.info(
+            "Flushed %s configs in %.2fs: %s",
+            sum(report.flushed.values()),
+            report.seconds,
+            report.flushed,
+        )
+        if report.dropped:
+            self.logger.warning(
+                "Dropped %s configs which could not be flushed in time: %s",
+                sum(report.dropped.values()),
+                report.dropped,
+            )
+        return report
+
+    async def close(self) -> None:
+        if self._release_snapshot_handle is not None:
+            self._release_snapshot_handle.cancel()
+        if self.config_change_listener is not None:
+            await self.config_change_listener.stop()
+        # Flush before the cogs are unloaded, which then have nothing to flush
+        if not self._configs_flushed_on_close:
+            self._configs_flushed_on_close = True
+            self.config_flush_report = await self.flush_cog_configs()
+        await super().close()
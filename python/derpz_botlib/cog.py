@@ -1,10 +1,21 @@
+import asyncio
+import contextlib
+import copy
 import typing
+from typing import Optional
 
 import disnake
+import pydantic
 import sqlalchemy
 from derpz_botlib.bot_classes import (ConfigurableCogsBot, DatabasedBot,
                                       LoggedBot)
-from derpz_botlib.database.storage import CogConfiguration
+from derpz_botlib.database.instrumentation import set_db_cog
+from derpz_botlib.database.serialization import (RawJson, decode, dumpb,
+                                                 encode_config, loads)
+from derpz_botlib.database.storage import (UNKNOWN_VERSION, CogConfiguration,
+                                           json_dict_delete, json_dict_set,
+                                           json_set_add, json_set_remove,
+                                           merge_configs)
 from disnake.ext import commands
 from psycopg import DataError
 from sqlalchemy.exc import SQLAlchemyError
@@ -12,14 +23,52 @@ from sqlalchemy.exc import SQLAlchemyError
 T = typing.TypeVar("T", bound=CogConfiguration)
 
 
+class _OwnStoredConfig(dict):
+    """
+    A stored config which no one else holds a reference to, unlike those read
+    from the config store's cache, so partial updates can change it in place
+    """
+
+
 class LoggedCog(commands.Cog):
     """
     A cog which can utilize the logger.
     """
 
+    # When extensions are loaded concurrently: the names of the cogs whose
+    # cog_load must finish before this cog's starts, and how many seconds
+    # cog_load may take (defaults to the bot's cog_load_timeout)
+    cog_load_after: tuple[str, ...] = ()
+    cog_load_timeout: Optional[float] = None
+
     def __init__(self, bot: LoggedBot):
         self.bot = bot
         self.logger = self.bot.logger.getChild(self.__class__.__cog_name__)
+        # Whether this cog replaced another instance in a hot reload
+        self.took_over_state = False
+
+    async def drain_pending_work(self) -> None:
+        """
+        Waits for the work in flight which must not be cut short, before the
+        cog's state is handed over in a hot reload
+        """
+
+    def hand_over_state(self) -> dict:
+        """
+        Hands the in-memory state (caches, connections, running tasks) over to
+        the instance replacing this one when its extension is hot reloaded,
+        see LoggedBot.hot_reload_extension.
+        Whatever is handed over must be detached from this instance, so that
+        its cog_unload leaves it alone.
+        """
+        return {}
+
+    def take_over_state(self, state: dict) -> None:
+        """
+        Takes over the state handed over by the instance this one replaces.
+        Called before cog_load.
+        """
+        self.took_over_state = True
 
     async def cog_slash_command_error(
         self, inter: disnake.ApplicationCommandInteraction, error: Exception
@@ -51,32 +100,334 @@ class DatabaseConfigurableCog(typing.Generic[T], LoggedCog):
     Loads and saves configuration from the database.
 
     Author's Notes:
-    This will load the configuration of all the guilds the bot is in
-    when the cog is loaded.
+    This will load the stored configuration of all the guilds the bot is in
+    when the cog is loaded, from the bot's preloaded snapshot if there is one.
+    Configs are kept as they were stored and only parsed on first access, so
+    guilds which never use the cog cost no more than their stored config.
+    Guilds the bot joins are loaded, and guilds it leaves are forgotten.
+    Configs changed by other processes are reloaded
+    when the config store invalidates them.
+
+    Writes to one guild's config are serialized by a per guild lock. Unless the
+    store is write-behind, save_guild_config is a compare-and-swap: changes
+    made concurrently by other processes are merged in rather than overwritten.
+
+    Configs changed in memory without being saved are dirty (see
+    CogConfiguration.dirty). The bot flushes them on shutdown, and unloading
+    the cog schedules a flush of its own, unless a hot reload handed the
+    configs over to the cog's new instance.
     """
 
-    config: dict[disnake.Guild, T]
+    # The configs which were accessed, by guild id
+    config: dict[int, T]
     bot: ConfigurableCogsBot
 
     def __init__(self, bot: ConfigurableCogsBot, configclass: typing.Type[T]):
         super().__init__(bot)
         self.config = {}
         self._configclass = configclass
+        self._background_tasks: set[asyncio.Task] = set()
+        self._config_locks: dict[int, asyncio.Lock] = {}
+        # What the store held when each guild's config was last read or written
+        # and at which version, to merge in concurrent changes on save.
+        # Guilds without a stored config are left out.
+        self._stored_configs: dict[int, typing.Union[dict, RawJson]] = {}
+        self._config_versions: dict[int, Optional[int]] = {}
 
-    def get_guild_config(self, guild: disnake.Guild) -> T:
+    def get_guild_config(self, guild: typing.Union[disnake.Guild, int]) -> T:
         """
-        Get the configuration for a guild.
-        If no configuration exists, a new one is created.
+        Get the configuration for a guild, or guild id.
+        The stored configuration is parsed on first access. If no configuration
+        exists, a new one is created, and kept for the next access.
         """
-        return self.config.get(guild, self._configclass())
+        guild_id = guild if isinstance(guild, int) else guild.id
+        config = self.config.get(guild_id)
+        if config is None:
+            stored = self._stored_configs.get(guild_id)
+            if stored is None:
+                config = self._configclass()
+            else:
+                config = self._configclass.parse_obj(decode(stored))
+            # a new config is only worth storing once it was changed
+            config.mark_clean()
+            self.config[guild_id] = config
+        return config
+
+    def iter_guild_configs(self) -> typing.Iterator[tuple[int, T]]:
+        """
+        Iterates over the guild ids and configurations of the guilds which have
+        a configuration, parsing the ones which were not accessed yet
+        """
+        for guild_id in list(self._stored_configs.keys() | self.config.keys()):
+            yield guild_id, self.get_guild_config(guild_id)
+
+    def evict_guild_config(self, guild_id: int):
+        """Forgets the configuration of a guild, until it is loaded again"""
+        self.config.pop(guild_id, None)
+        self._stored_configs.pop(guild_id, None)
+        self._config_versions.pop(guild_id, None)
+        self._config_locks.pop(guild_id, None)
+        self.guild_config_changed(guild_id)
+
+    def guild_config_changed(self, guild_id: int) -> None:
+        """
+        Called after a guild's configuration was saved, updated, reloaded or
+        forgotten. Override it to drop whatever the cog derived from it.
+        Changes made in memory are only seen once they are saved.
+        """
+
+    async def drain_pending_work(self) -> None:
+        """Waits for the config reloads and writes in flight"""
+        await super().drain_pending_work()
+        if self._background_tasks:
+            await asyncio.wait(list(self._background_tasks))
+        for lock in list(self._config_locks.values()):
+            async with lock:
+                pass
+
+    def hand_over_state(self) -> dict:
+        """Hands over the configs, parsed or not, without writing them"""
+        state = super().hand_over_state()
+        state.update(
+            config=self.config,
+            stored_configs=self._stored_configs,
+            config_versions=self._config_versions,
+        )
+        # so that unloading this instance has nothing to flush
+        self.config, self._stored_configs, self._config_versions = {}, {}, {}
+        return state
+
+    def take_over_state(self, state: dict) -> None:
+        """
+        Takes over the configs of the instance this one replaces.
+        The reloaded module defines the config class anew, so the parsed
+        configs are converted; dirty ones stay dirty. Configs which do not fit
+        the new class are parsed from their stored copy again instead.
+        """
+        super().take_over_state(state)
+        self._stored_configs = state.get("stored_configs", {})
+        self._config_versions = state.get("config_versions", {})
+        for guild_id, config in state.get("config", {}).items():
+            try:
+                converted = self._configclass.parse_obj(config.dict())
+            except pydantic.ValidationError as e:
+                self.logger.warning(
+                    "Config of guild %s does not fit %s anymore, dropped: %s",
+                    guild_id,
+                    self._configclass.__name__,
+                    e,
+                )
+                continue
+            if not config.dirty:
+                converted.mark_clean()
+            self.config[guild_id] = converted
+
+    def _guild_config_lock(
+        self, guild: typing.Union[disnake.Guild, int]
+    ) -> asyncio.Lock:
+        guild_id = guild if isinstance(guild, int) else guild.id
+        return self._config_locks.setdefault(guild_id, asyncio.Lock())
 
     async def save_guild_config(self, guild: disnake.Guild, config: T):
         """
         Save the configuration for a guild to the database.
-        This will also update the in-memory configuration.
+        This will also update the in-memory configuration, including any changes
+        merged in from concurrent writers.
+        """
+        store = self.bot.cog_config_store
+        async with self._guild_config_lock(guild):
+            self.config[guild.id] = config
+            if store.write_behind:
+                generation = config.generation
+                persisted_config = encode_config(config)
+                await store.set_cog_config(self, guild, persisted_config)
+                # queued writes are flushed by the store, they are not dirty
+                config.mark_clean(generation)
+                self._stored_configs[guild.id] = persisted_config
+                self.guild_config_changed(guild.id)
+                return
+            written, version = await store.compare_and_set_cog_config(
+                self,
+                guild,
+                config,
+                base=self._stored_configs.get(guild.id),
+                version=self._config_versions.get(guild.id, UNKNOWN_VERSION),
+            )
+            if not isinstance(written, RawJson):
+                # changes made by someone else were merged in
+                self.config[guild.id] = self._configclass.parse_obj(written)
+            self._stored_configs[guild.id] = written
+            self._config_versions[guild.id] = version
+            self.guild_config_changed(guild.id)
+
+    def dirty_guild_configs(self) -> dict[int, RawJson]:
+        """
+        The configs which were changed in memory since they were last read from
+        or written to the store, encoded, by guild id.
+        Only the dirty configs are encoded.
         """
-        self.config[guild] = config
-        await self.bot.cog_config_store.set_cog_config(self, guild, self.config[guild])
+        return {
+            guild_id: encode_config(config)
+            for guild_id, config in self.config.items()
+            if config.dirty
+        }
+
+    async def flush_guild_configs(
+        self, dirty: Optional[dict[int, RawJson]] = None
+    ) -> int:
+        """
+        Writes the dirty configs to the store in one batch.
+        Returns how many configs were written.
+        """
+        set_db_cog(self.qualified_name)
+        if dirty is None:
+            dirty = self.dirty_guild_configs()
+        if not dirty:
+            return 0
+        generations = {
+            guild_id: self.config[guild_id].generation
+            for guild_id in dirty
+            if guild_id in self.config
+        }
+        await self.bot.cog_config_store.batch_set_cog_config(self, dirty)
+        for guild_id, persisted_config in dirty.items():
+            if guild_id in generations:
+                self.config[guild_id].mark_clean(generations[guild_id])
+            self._stored_configs[guild_id] = persisted_config
+            # the batch write bumped the version
+            self._config_versions.pop(guild_id, None)
+        return len(dirty)
+
+    def _forget_guild_config_version(
+        self,
+        guild: disnake.Guild,
+        update: typing.Callable[[dict], typing.Any],
+        generation: int,
+        was_clean: bool,
+    ):
+        """
+        Called after a partial update, which changes the stored version.
+        update applies the same change to our copy of the stored config: the
+        next save reads the new version and merges against that copy, in which
+        other fields changed in memory are still not stored. The config is only
+        marked clean if the partial update, made at generation, was its only
+        change.
+        """
+        config = self.config[guild.id]
+        stored = self._stored_configs.get(guild.id)
+        if not isinstance(stored, _OwnStoredConfig):
+            # copied once, then updated in place
+            if isinstance(stored, RawJson):
+                stored = decode(stored)
+            else:
+                stored = copy.deepcopy(stored or {})
+            stored = self._stored_configs[guild.id] = _OwnStoredConfig(stored)
+        update(stored)
+        if was_clean:
+            config.mark_clean(generation)
+        self._config_versions.pop(guild.id, None)
+        self.guild_config_changed(guild.id)
+
+    async def add_to_guild_config_set(
+        self, guild: disnake.Guild, field: str, member: typing.Any
+    ):
+        """
+        Adds a member to a set field of the guild's configuration.
+        Only the change is sent to the database, not the whole configuration.
+        """
+        async with self._guild_config_lock(guild):
+            config = self.get_guild_config(guild)
+            was_clean = not config.dirty
+            getattr(config, field).add(member)
+            generation = config.generation
+            self.config[guild.id] = config
+            await self.bot.cog_config_store.add_to_cog_config_set(
+                self, guild, field, member
+            )
+            member = loads(dumpb(member))
+            self._forget_guild_config_version(
+                guild,
+                lambda stored: json_set_add(stored, field, member),
+                generation,
+                was_clean,
+            )
+
+    async def discard_from_guild_config_set(
+        self, guild: disnake.Guild, field: str, member: typing.Any
+    ):
+        """
+        Removes a member, if present, from a set field of the guild's
+        configuration.
+        Only the change is sent to the database, not the whole configuration.
+        """
+        async with self._guild_config_lock(guild):
+            config = self.get_guild_config(guild)
+            was_clean = not config.dirty
+            getattr(config, field).discard(member)
+            generation = config.generation
+            self.config[guild.id] = config
+            await self.bot.cog_config_store.remove_from_cog_config_set(
+                self, guild, field, member
+            )
+            member = loads(dumpb(member))
+            self._forget_guild_config_version(
+                guild,
+                lambda stored: json_set_remove(stored, field, member),
+                generation,
+                was_clean,
+            )
+
+    async def set_guild_config_dict_entry(
+        self,
+        guild: disnake.Guild,
+        field: str,
+        key: typing.Any,
+        value: typing.Any,
+    ):
+        """
+        Sets an entry of a dict field of the guild's configuration.
+        Only the change is sent to the database, not the whole configuration.
+        """
+        async with self._guild_config_lock(guild):
+            config = self.get_guild_config(guild)
+            was_clean = not config.dirty
+            getattr(config, field)[key] = value
+            generation = config.generation
+            self.config[guild.id] = config
+            await self.bot.cog_config_store.set_cog_config_dict_entry(
+                self, guild, field, key, value
+            )
+            value = loads(dumpb(value))
+            self._forget_guild_config_version(
+                guild,
+                lambda stored: json_dict_set(stored, field, str(key), value),
+                generation,
+                was_clean,
+            )
+
+    async def delete_guild_config_dict_entry(
+        self, guild: disnake.Guild, field: str, key: typing.Any
+    ):
+        """
+        Deletes an entry, if present, from a dict field of the guild's
+        configuration.
+        Only the change is sent to the database, not the whole configuration.
+        """
+        async with self._guild_config_lock(guild):
+            config = self.get_guild_config(guild)
+            was_clean = not config.dirty
+            getattr(config, field).pop(key, None)
+            generation = config.generation
+            self.config[guild.id] = config
+            await self.bot.cog_config_store.delete_cog_config_dict_entry(
+                self, guild, field, key
+            )
+            self._forget_guild_config_version(
+                guild,
+                lambda stored: json_dict_delete(stored, field, str(key)),
+                generation,
+                was_clean,
+            )
 
     async def cog_slash_command_error(
         self, inter: disnake.ApplicationCommandInteraction, error: Exception
@@ -94,7 +445,9 @@ class DatabaseConfigurableCog(typing.Generic[T], LoggedCog):
 
     async def cog_load(self):
         """Load config from DB when cog is loaded"""
+        set_db_cog(self.qualified_name)
         self.logger.info(f"Initializing {self.__class__.__cog_name__}")
+        self.bot.cog_config_store.subscribe(self, self._on_config_invalidated)
         if len(self.bot.guilds) == 0:
             self.logger.warning("No guilds found. Skipping config load.")
             if not self.bot.is_ready():
@@ -103,26 +456,103 @@ class DatabaseConfigurableCog(typing.Generic[T], LoggedCog):
                     "Make sure you load the cog in on_ready"
                 )
             return
+        if self.took_over_state:
+            # the configs were handed over by the instance this one replaced
+            return
         # load config from DB
-        guilds = list(map(lambda x: x.id, self.bot.guilds))
-        config = await self.bot.cog_config_store.get_cog_config(guilds, self)
-        if config:
-            self.config = dict(
-                map(
-                    lambda x: (
-                        self.bot.get_guild(x[0]),
-                        self._configclass.parse_obj(x[1]),
-                    ),
-                    config.items(),
-                )
-            )
-        else:
-            # self.logger.warning("No config found in DB")
-            pass
+        await self.reload_guild_configs()
         self.logger.info(f"Initialized {self.__class__.__cog_name__}")
 
+    async def reload_guild_configs(self, guild_ids: Optional[list[int]] = None):
+        """
+        (Re)loads the configuration of the given guilds from the database.
+        Defaults to all the guilds the bot is in.
+        The configs are parsed again on their next access, except dirty ones:
+        what was reloaded is merged into them, and they stay dirty.
+        Holds the guilds' config locks, so saves wait for the reload.
+        """
+        set_db_cog(self.qualified_name)
+        if guild_ids is None:
+            guild_ids = list(map(lambda x: x.id, self.bot.guilds))
+        guild_ids = [
+            guild_id
+            for guild_id in guild_ids
+            if self.bot.get_guild(guild_id) is not None
+        ]
+        async with contextlib.AsyncExitStack() as locks:
+            for guild_id in sorted(guild_ids):
+                await locks.enter_async_context(self._guild_config_lock(guild_id))
+            store = self.bot.cog_config_store
+            config = await store.get_cog_config(guild_ids, self) or {}
+            for guild_id in guild_ids:
+                self._reload_guild_config(guild_id, config.get(guild_id))
+
+    def _reload_guild_config(
+        self, guild_id: int, stored: typing.Union[dict, RawJson, None]
+    ) -> None:
+        config = self.config.get(guild_id)
+        if config is not None and config.dirty:
+            if not self._merge_into_dirty_config(guild_id, config, stored):
+                # left as it was; the next save merges against the store
+                self._config_versions.pop(guild_id, None)
+                return
+        else:
+            self.config.pop(guild_id, None)
+        if stored is not None:
+            self._stored_configs[guild_id] = stored
+        else:
+            self._stored_configs.pop(guild_id, None)
+        # the version is read again on the next save
+        self._config_versions.pop(guild_id, None)
+        self.guild_config_changed(guild_id)
+
+    def _merge_into_dirty_config(
+        self, guild_id: int, config: T, stored: typing.Union[dict, RawJson, None]
+    ) -> bool:
+        """
+        Three-way merges the unsaved changes of a config with what is stored
+        now, in place, so that whoever holds the config sees the merge.
+        Returns False if the merge does not fit the config class.
+        """
+        merged = merge_configs(
+            decode(self._stored_configs.get(guild_id)),
+            decode(encode_config(config)),
+            decode(stored),
+            config.set_fields(),
+        )
+        try:
+            merged_config = self._configclass.parse_obj(merged)
+        except pydantic.ValidationError as e:
+            self.logger.warning(
+                "Could not merge the reloaded config of guild %s: %s", guild_id, e
+            )
+            return False
+        for name in merged_config.__fields__:
+            value = getattr(merged_config, name)
+            if getattr(config, name) != value:
+                setattr(config, name, value)
+        return True
+
+    def _on_config_invalidated(self, guild_id: Optional[int]) -> None:
+        """Reloads configs which were changed outside this process"""
+        task = asyncio.create_task(
+            self.reload_guild_configs(None if guild_id is None else [guild_id])
+        )
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: disnake.Guild):
+        """Loads the configuration of a guild the bot joined"""
+        await self.reload_guild_configs([guild.id])
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: disnake.Guild):
+        """Forgets the configuration of a guild the bot left"""
+        self.evict_guild_config(guild.id)
+
     def cog_unload(self):
-        """Flush config to DB when cog is unloaded"""
-        self.logger.info(f"Flushing config to DB {self.__class__.__cog_name__}")
-        self.bot.cog_config_store.batch_set_cog_config_sync(self, self.config)
+        """Schedule a flush of the dirty configs when cog is unloaded"""
+        self.bot.cog_config_store.unsubscribe(self, self._on_config_invalidated)
+        self.bot.schedule_config_flush(self)
         self.logger.info(f"Unload of {self.__class__.__cog_name__} complete")
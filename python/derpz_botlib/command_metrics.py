@@ -0,0 +1,156 @@
+"""
+Latency, error and in-flight metrics of commands and event listeners.
+
+LoggedBot times every prefix command, application command and listener it runs
+through CommandMetrics. The metrics are labelled with the command and a guild
+bucket: the first max_guild_buckets guilds get a bucket of their own, the
+others share "other", and commands run outside of a guild are "dm". That keeps
+the number of series bounded however many guilds the bot is in.
+
+The metrics of each command and bucket, and of each listener and event, are
+bound once and cached by the command object or listener function, so recording
+a call only allocates its sample. The cache holds them weakly: the commands and
+listeners of unloaded extensions are dropped from it along with them.
+"""
+import weakref
+from typing import Any, Optional
+
+from derpz_botlib.metrics import BoundMetric, MetricsRegistry
+from disnake import ApplicationCommandInteraction, ApplicationCommandType
+from disnake.ext import commands
+
+DM_BUCKET = "dm"
+OTHER_BUCKET = "other"
+SLASH_COMMAND_TYPES = (
+    commands.InvokableSlashCommand,
+    commands.SubCommandGroup,
+    commands.SubCommand,
+)
+
+
+class BoundCommandMetrics:
+    """The metrics of one command, or listener, in one guild bucket"""
+
+    __slots__ = ("latency", "errors", "in_flight")
+
+    def __init__(
+        self, latency: BoundMetric, errors: BoundMetric, in_flight: BoundMetric
+    ):
+        self.latency = latency
+        self.errors = errors
+        self.in_flight = in_flight
+
+
+class CommandMetrics:
+    """The command and listener metrics of a registry, bound per label set"""
+
+    def __init__(self, registry: MetricsRegistry, max_guild_buckets: int = 20):
+        self.max_guild_buckets = max_guild_buckets
+        self.command_latency = registry.histogram(
+            "command_latency_seconds",
+            "How long commands took end to end",
+            ("command", "guild"),
+        )
+        self.command_errors = registry.counter(
+            "command_errors", "Commands which failed", ("command", "guild")
+        )
+        self.commands_in_flight = registry.gauge(
+            "commands_in_flight", "Commands running right now", ("command", "guild")
+        )
+        self.listener_latency = registry.histogram(
+            "listener_latency_seconds",
+            "How long event listeners took",
+            ("listener", "event"),
+        )
+        self.listener_errors = registry.counter(
+            "listener_errors", "Event listeners which raised", ("listener", "event")
+        )
+        self.listeners_in_flight = registry.gauge(
+            "listeners_in_flight",
+            "Event listeners running right now",
+            ("listener", "event"),
+        )
+        self._guild_buckets: dict[Optional[int], str] = {None: DM_BUCKET}
+        self._commands: weakref.WeakKeyDictionary[
+            Any, dict[str, BoundCommandMetrics]
+        ] = weakref.WeakKeyDictionary()
+        self._listeners: weakref.WeakKeyDictionary[
+            Any, dict[str, BoundCommandMetrics]
+        ] = weakref.WeakKeyDictionary()
+
+    def guild_bucket(self, guild_id: Optional[int]) -> str:
+        bucket = self._guild_buckets.get(guild_id)
+        if bucket is None:
+            if len(self._guild_buckets) > self.max_guild_buckets:
+                return OTHER_BUCKET
+            bucket = self._guild_buckets[guild_id] = str(guild_id)
+        return bucket
+
+    def command(self, command: Any, guild_id: Optional[int]) -> BoundCommandMetrics:
+        """
+        The metrics of a prefix command, or of an application command,
+        sub command or sub command group, in the guild's bucket
+        """
+        bucket = self.guild_bucket(guild_id)
+        by_bucket = self._commands.get(command)
+        if by_bucket is None:
+            by_bucket = self._commands[command] = {}
+        metrics = by_bucket.get(bucket)
+        if metrics is None:
+            name = command.qualified_name
+            if isinstance(command, SLASH_COMMAND_TYPES):
+                name = f"/{name}"
+            labels = dict(command=name, guild=bucket)
+            metrics = by_bucket[bucket] = BoundCommandMetrics(
+                self.command_latency.bind(**labels),
+                self.command_errors.bind(**labels),
+                self.commands_in_flight.bind(**labels),
+            )
+        return metrics
+
+    def listener(self, coro: Any, event_name: str) -> BoundCommandMetrics:
+        """The metrics of an event listener, by its function"""
+        # listeners are bound methods, made anew on every dispatch
+        function = getattr(coro, "__func__", coro)
+        by_event = self._listeners.get(function)
+        if by_event is None:
+            by_event = self._listeners[function] = {}
+        metrics = by_event.get(event_name)
+        if metrics is None:
+            labels = dict(
+                listener=getattr(function, "__qualname__", repr(function)),
+                event=event_name,
+            )
+            metrics = by_event[event_name] = BoundCommandMetrics(
+                self.listener_latency.bind(**labels),
+                self.listener_errors.bind(**labels),
+                self.listeners_in_flight.bind(**labels),
+            )
+        return metrics
+
+
+def resolve_application_command(
+    bot: commands.Bot, interaction: ApplicationCommandInteraction
+) -> Optional[commands.InvokableApplicationCommand]:
+    """
+    The command an interaction invokes, down to the sub command, like
+    process_application_commands finds it
+    """
+    data = interaction.data
+    if data.type is ApplicationCommandType.chat_input:
+        command = bot.all_slash_commands.get(data.name)
+    elif data.type is ApplicationCommandType.user:
+        return bot.all_user_commands.get(data.name)
+    elif data.type is ApplicationCommandType.message:
+        return bot.all_message_commands.get(data.name)
+    else:
+        return None
+    options = data.options
+    # sub commands and groups are options without a value
+    while command is not None and options and options[0].value is None:
+        children = getattr(command, "children", None)
+        if not children or options[0].name not in children:
+            break
+        command = children[options[0].name]
+        options = options[0].options
+    return command
@@ -0,0 +1,216 @@
+"""
+Streamed backups of database tables, as newline-delimited JSON.
+
+The first line is a header naming the tables, every other line is one row:
+
+    {"backup": 1, "tables": ["cog_config_store", "user_reminders"]}
+    {"table": "cog_config_store", "row": {"guild_id": 1, "cog": "Cog", ...}}
+
+Exports read through a server-side cursor and imports insert in batches, so
+memory use does not grow with the number of rows. Files whose name ends in .zst
+are zstd compressed, which needs the zstandard package.
+"""
+import contextlib
+import datetime
+import io
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator, Union
+
+import sqlalchemy
+from derpz_botlib.database.serialization import dumpb, loads
+from derpz_botlib.database.storage import _UPSERT_INSERTS
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+BACKUP_FORMAT_VERSION = 1
+# Rows fetched per round trip on export, and inserted per statement on import
+BACKUP_BATCH_SIZE = 1_000
+
+
+class BackupError(Exception):
+    """A backup which cannot be read or imported"""
+
+
+@contextlib.contextmanager
+def open_backup(path: Union[str, Path], mode: str) -> Iterator[BinaryIO]:
+    """
+    Opens a backup file for reading ("rb") or writing ("wb").
+    Files whose name ends in .zst are (de)compressed on the fly.
+    """
+    if mode not in ("rb", "wb"):
+        raise ValueError(f"Backups are opened with 'rb' or 'wb', not {mode!r}")
+    if Path(path).suffix != ".zst":
+        with open(path, mode) as fp:
+            yield fp
+        return
+    try:
+        import zstandard
+    except ImportError as e:
+        raise BackupError("zstd compressed backups need the zstandard package") from e
+    with open(path, mode) as raw:
+        if mode == "rb":
+            with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                yield io.BufferedReader(reader)
+        else:
+            with zstandard.ZstdCompressor().stream_writer(raw) as writer:
+                yield writer
+
+
+async def export_tables(
+    engine: AsyncEngine,
+    tables: list[sqlalchemy.Table],
+    fp: BinaryIO,
+    *,
+    batch_size: int = BACKUP_BATCH_SIZE,
+) -> dict[str, int]:
+    """
+    Writes every row of the given tables to fp.
+    On Postgres all the tables are read from one consistent snapshot.
+    :return: The number of rows exported per table
+    """
+    header = dict(backup=BACKUP_FORMAT_VERSION, tables=[table.name for table in tables])
+    fp.write(dumpb(header) + b"\n")
+    counts = {}
+    async with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execution_options(isolation_level="REPEATABLE READ")
+        for table in tables:
+            count = 0
+            result = await conn.stream(
+                sqlalchemy.select(table)
+                .order_by(*table.primary_key.columns)
+                .execution_options(yield_per=batch_size)
+            )
+            async for rows in result.mappings().partitions():
+                fp.write(
+                    b"".join(
+                        dumpb(dict(table=table.name, row=dict(row))) + b"\n"
+                        for row in rows
+                    )
+                )
+                count += len(rows)
+            counts[table.name] = count
+    return counts
+
+
+def _row_converter(table: sqlalchemy.Table) -> Callable[[dict], dict]:
+    """Converts a row read from JSON back to the types of the table's columns"""
+    datetime_columns = [
+        column.name
+        for column in table.columns
+        if isinstance(column.type, sqlalchemy.DateTime)
+    ]
+
+    def convert(row: dict) -> dict:
+        unknown = row.keys() - table.columns.keys()
+        if unknown:
+            raise BackupError(f"{table.name} has no columns {sorted(unknown)}")
+        for name in datetime_columns:
+            if isinstance(row.get(name), str):
+                row[name] = datetime.datetime.fromisoformat(row[name])
+        return row
+
+    return convert
+
+
+async def _insert_rows(
+    conn: AsyncConnection, table: sqlalchemy.Table, rows: list[dict]
+) -> None:
+    """Inserts rows, replacing the rows which have the same primary key"""
+    primary_key = list(table.primary_key.columns)
+    dialect_name = conn.dialect.name
+    if dialect_name in _UPSERT_INSERTS:
+        stmt = _UPSERT_INSERTS[dialect_name](table).values(rows)
+        updated = [name for name in rows[0] if name not in table.primary_key.columns]
+        if updated:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=primary_key,
+                set_={name: stmt.excluded[name] for name in updated},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=primary_key)
+        await conn.execute(stmt)
+        return
+    await conn.execute(
+        table.delete().where(
+            sqlalchemy.tuple_(*primary_key).in_(
+                [tuple(row[column.name] for column in primary_key) for row in rows]
+            )
+        )
+    )
+    await conn.execute(table.insert().values(rows))
+
+
+async def _reset_sequence(conn: AsyncConnection, table: sqlalchemy.Table) -> None:
+    """Moves a serial primary key past the imported ids, on Postgres"""
+    column = table.autoincrement_column
+    if conn.dialect.name != "postgresql" or column is None:
+        return
+    await conn.execute(
+        sqlalchemy.select(
+            sqlalchemy.func.setval(
+                sqlalchemy.func.pg_get_serial_sequence(table.name, column.name),
+                sqlalchemy.func.coalesce(sqlalchemy.func.max(column), 0) + 1,
+                False,
+            )
+        ).select_from(table)
+    )
+
+
+async def import_tables(
+    engine: AsyncEngine,
+    tables: list[sqlalchemy.Table],
+    fp: BinaryIO,
+    *,
+    replace: bool = False,
+    batch_size: int = BACKUP_BATCH_SIZE,
+) -> dict[str, int]:
+    """
+    Reads a backup from fp into the given tables, in one transaction.
+    Rows replace the rows with the same primary key. With replace, the tables
+    named in the backup are emptied first, so they end up exactly like the
+    backup. Rows of tables which were not given are skipped.
+    :return: The number of rows imported per table
+    """
+    tables_by_name = {table.name: table for table in tables}
+    try:
+        header = loads(fp.readline())
+    except ValueError as e:
+        raise BackupError("Not a backup: the header is not JSON") from e
+    if not isinstance(header, dict) or header.get("backup") != BACKUP_FORMAT_VERSION:
+        raise BackupError(f"Unsupported backup header: {header!r}")
+    imported = [name for name in header["tables"] if name in tables_by_name]
+    counts = dict.fromkeys(imported, 0)
+    converters = {name: _row_converter(tables_by_name[name]) for name in imported}
+
+    async with engine.begin() as conn:
+        if replace:
+            # children first, in case of foreign keys
+            for name in reversed(imported):
+                await conn.execute(tables_by_name[name].delete())
+        batch_table = None
+        batch: list[dict] = []
+
+        async def flush_batch():
+            if batch:
+                await _insert_rows(conn, tables_by_name[batch_table], batch)
+                counts[batch_table] += len(batch)
+                batch.clear()
+
+        for line_number, line in enumerate(fp, start=2):
+            if not line.strip():
+                continue
+            try:
+                entry: dict[str, Any] = loads(line)
+                name, row = entry["table"], entry["row"]
+            except (ValueError, KeyError, TypeError) as e:
+                raise BackupError(f"Line {line_number} is not a row") from e
+            if name not in counts:
+                continue
+            if name != batch_table or len(batch) >= batch_size:
+                await flush_batch()
+                batch_table = name
+            batch.append(converters[name](row))
+        await flush_batch()
+        for name in imported:
+            await _reset_sequence(conn, tables_by_name[name])
+    return counts
@@ -2,9 +2,13 @@ import datetime
 from typing import Annotated
 
 import sqlalchemy
+from derpz_botlib.database import serialization
 from sqlalchemy import MetaData, func
 from sqlalchemy.dialects.postgresql import TIMESTAMP
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, mapped_column
+from sqlalchemy.pool import StaticPool
 
 sqlalchemy_metadata = MetaData()
 
@@ -26,3 +30,49 @@ required_str = Annotated[str, mapped_column(nullable=False)]
 required_int = Annotated[int, mapped_column(nullable=False)]
 
 required_bigint = Annotated[int, mapped_column(sqlalchemy.BIGINT, nullable=False)]
+
+
+def create_engine_from_url(db_url: str, **kwargs) -> AsyncEngine:
+    """
+    Creates an async engine for the given database URL.
+
+    Besides Postgres, this supports SQLite as an embedded backend:
+    - `sqlite+aiosqlite:///path/to/bot.db` is a file, opened in WAL mode
+    - `sqlite+aiosqlite://` is an in-memory database that lives as long as the
+      engine does
+
+    JSON columns are encoded with derpz_botlib.database.serialization, so
+    pre-encoded RawJson values go to the driver untouched.
+    """
+    url = make_url(db_url)
+    # psycopg takes the encoded bytes as they are, sqlite3 wants text
+    kwargs.setdefault(
+        "json_serializer",
+        serialization.dumpb
+        if url.get_backend_name() == "postgresql"
+        else serialization.dumps,
+    )
+    kwargs.setdefault("json_deserializer", serialization.loads)
+    if url.get_backend_name() != "sqlite":
+        return create_async_engine(url, **kwargs)
+
+    if url.drivername == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    in_memory = url.database in (None, "", ":memory:")
+    if in_memory:
+        # Every connection would get its own empty database otherwise
+        kwargs.setdefault("poolclass", StaticPool)
+        kwargs.setdefault("connect_args", {"check_same_thread": False})
+    engine = create_async_engine(url, **kwargs)
+
+    @sqlalchemy.event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not in_memory:
+            # Readers do not block the writer, and commits only fsync the WAL
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return engine
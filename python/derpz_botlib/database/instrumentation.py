@@ -0,0 +1,150 @@
+"""
+Instrumentation for SQLAlchemy engines.
+
+instrument_engine() records into a MetricsRegistry:
+- db_statement_seconds: latency of every statement, labelled by the cog and the
+  manager method which issued it
+- db_statement_errors_total: statements which raised
+- db_pool_checkout_seconds: time spent getting a connection from the pool,
+  including opening a new one
+- db_pool_connect_seconds: time spent opening new connections
+- db_pool_size, db_pool_checked_out, db_pool_overflow: the state of the pool
+
+The labels come from context variables, so they follow the asyncio task which
+set them. Commands set the cog, and methods decorated with @instrumented set the
+method.
+"""
+import functools
+import time
+import weakref
+from contextvars import ContextVar
+from typing import Awaitable, Callable, TypeVar
+
+import sqlalchemy
+from derpz_botlib.metrics import Histogram, MetricsRegistry
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import Pool
+
+F = TypeVar("F", bound=Callable[..., Awaitable])
+
+_db_cog: ContextVar[str] = ContextVar("db_cog", default="")
+_db_method: ContextVar[str] = ContextVar("db_method", default="")
+_instrumented_engines: "weakref.WeakSet[sqlalchemy.Engine]" = weakref.WeakSet()
+
+
+def set_db_cog(cog_name: str) -> None:
+    """Labels the statements issued by the current task with a cog"""
+    _db_cog.set(cog_name)
+
+
+def instrumented(func: F) -> F:
+    """
+    Labels the statements issued by an async method with its name,
+    e.g. ReminderManager.get_reminders
+    """
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        token = _db_method.set(f"{type(self).__name__}.{func.__name__}")
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            _db_method.reset(token)
+
+    return wrapper
+
+
+def _call_site() -> dict[str, str]:
+    return dict(cog=_db_cog.get() or "none", method=_db_method.get() or "none")
+
+
+def _pool_stat(engine: sqlalchemy.Engine, name: str) -> Callable[[], float]:
+    # Only QueuePool keeps these statistics; StaticPool and NullPool do not
+    def read() -> float:
+        stat = getattr(engine.pool, name, None)
+        return stat() if stat is not None else 0
+
+    return read
+
+
+def _instrument_pool(pool: Pool, checkout_seconds: Histogram) -> None:
+    # The pool has no event which fires before a checkout, so the time spent
+    # waiting for a connection is measured around Pool.connect itself
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            checkout_seconds.observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+
+
+def instrument_engine(engine: AsyncEngine, registry: MetricsRegistry) -> None:
+    """Records the metrics of an engine into the registry. Safe to call twice"""
+    sync_engine = engine.sync_engine
+    if sync_engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(sync_engine)
+
+    statement_seconds = registry.histogram(
+        "db_statement_seconds",
+        "Latency of database statements",
+        ("cog", "method"),
+    )
+    statement_errors = registry.counter(
+        "db_statement_errors",
+        "Database statements which raised an error",
+        ("cog", "method"),
+    )
+    checkout_seconds = registry.histogram(
+        "db_pool_checkout_seconds",
+        "Time spent getting a connection from the pool",
+    )
+    connect_seconds = registry.histogram(
+        "db_pool_connect_seconds", "Time spent opening new database connections"
+    )
+    registry.gauge(
+        "db_pool_size",
+        "Connections the pool keeps open",
+        callback=_pool_stat(sync_engine, "size"),
+    )
+    registry.gauge(
+        "db_pool_checked_out",
+        "Connections currently checked out of the pool",
+        callback=_pool_stat(sync_engine, "checkedout"),
+    )
+    registry.gauge(
+        "db_pool_overflow",
+        "Connections opened beyond the pool size",
+        callback=_pool_stat(sync_engine, "overflow"),
+    )
+
+    @sqlalchemy.event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @sqlalchemy.event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, params, context, executemany):
+        start = conn.info["query_start_time"].pop()
+        statement_seconds.observe(time.perf_counter() - start, **_call_site())
+
+    @sqlalchemy.event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+        statement_errors.inc(**_call_site())
+
+    @sqlalchemy.event.listens_for(sync_engine.pool, "connect")
+    def connect(dbapi_connection, connection_record):
+        connect_seconds.observe(time.time() - connection_record.starttime)
+
+    @sqlalchemy.event.listens_for(sync_engine, "engine_disposed")
+    def engine_disposed(disposed_engine):
+        # dispose() replaces the pool; events carry over but the timer does not
+        _instrument_pool(disposed_engine.pool, checkout_seconds)
+
+    _instrument_pool(sync_engine.pool, checkout_seconds)
@@ -0,0 +1,89 @@
+"""
+JSON encoding for the values kept in the database.
+
+Configs are encoded exactly once, straight to the bytes the driver sends, and
+wrapped in RawJson so that the engine's serializer passes them through instead of
+encoding them again. Sets are written as sorted lists.
+
+orjson is used when it is installed, the standard library otherwise.
+"""
+import json
+from typing import Any, Union
+
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+class RawJson:
+    """A value which is already encoded as JSON"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"RawJson({self.data!r})"
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, RawJson) and self.data == other.data
+
+    __hash__ = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (set, frozenset)):
+        try:
+            return sorted(obj)
+        except TypeError:
+            return list(obj)
+    return pydantic_encoder(obj)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _encode(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+
+    def _encode(value: Any) -> bytes:
+        return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+def dumpb(value: Any) -> bytes:
+    """Encodes a value as JSON bytes. RawJson is passed through as is"""
+    if isinstance(value, RawJson):
+        return value.data
+    return _encode(value)
+
+
+def dumps(value: Any) -> str:
+    """Encodes a value as a JSON string. RawJson is passed through as is"""
+    return dumpb(value).decode()
+
+
+def encode_config(config: Union[BaseModel, RawJson]) -> RawJson:
+    """
+    Encodes a config, ready to be handed to the database driver.
+    Configs which are encoded already are returned as is
+    """
+    if isinstance(config, RawJson):
+        return config
+    return RawJson(_encode(config.dict()))
+
+
+def decode(value: Any) -> Any:
+    """Decodes RawJson, anything else is returned as is"""
+    if isinstance(value, RawJson):
+        return loads(value.data)
+    return value
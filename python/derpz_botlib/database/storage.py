@@ -1,15 +1,484 @@
+import abc
+import asyncio
+import copy
 import json
 import logging
-from typing import Optional
+import time
+from collections import OrderedDict, defaultdict
+from typing import (
+    AbstractSet,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Optional,
+    Union,
+)
 
 import disnake
-from derpz_botlib.database.tables import json_config_store
+import sqlalchemy
+from derpz_botlib.database.instrumentation import instrumented
+from derpz_botlib.database.serialization import (
+    RawJson,
+    decode,
+    dumpb,
+    dumps,
+    encode_config,
+    loads,
+)
+from derpz_botlib.database.tables import (
+    cog_config_store,
+    json_config_store,
+    schema_migrations,
+)
 from disnake.ext.commands import Cog
-from pydantic import BaseModel
-from sqlalchemy.ext.asyncio import AsyncEngine
+from pydantic import BaseModel, PrivateAttr
+from pydantic.fields import (
+    MAPPING_LIKE_SHAPES,
+    SHAPE_FROZENSET,
+    SHAPE_SET,
+    SHAPE_SINGLETON,
+    ModelField,
+)
+from sqlalchemy import Executable
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# Keeps a single upsert under the bind parameter limits of both Postgres
+# (65535) and SQLite (32766), as every row takes three parameters.
+UPSERT_CHUNK_SIZE = 10_000
+# Keys looked up per SELECT; psycopg allows at most 65535 bind parameters
+SELECT_CHUNK_SIZE = 10_000
+# Rows fetched per round trip when streaming the whole store
+SCAN_BATCH_SIZE = 1_000
+
+# Dialects with a native INSERT ... ON CONFLICT construct
+_UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+# Channel the cog_config_store trigger sends change notifications on
+CONFIG_CHANGED_CHANNEL = "cog_config_store_changed"
+# The schema_migrations row of migrate_json_config_store
+JSON_CONFIG_STORE_MIGRATION = "json_config_store_to_cog_config_store"
+
+_MISSING = object()
+# The version of a config whose version was never read; versions start at 0
+UNKNOWN_VERSION = -1
+
+
+# Server side partial updates of cog_config_store values. They bump the version
+# of the row like any other write.
+# :member and :entry_value are JSON encoded and cast to jsonb. Every parameter is
+# cast explicitly as the jsonb operators are overloaded for text and int.
+_ADD_TO_SET_SQL = """
+INSERT INTO cog_config_store (guild_id, cog, data)
+VALUES (
+    :guild_id,
+    :cog,
+    jsonb_build_object(
+        CAST(:field AS text), jsonb_build_array(CAST(:member AS jsonb))
+    )
+)
+ON CONFLICT (cog, guild_id) DO UPDATE SET data = jsonb_set(
+    COALESCE(cog_config_store.data, '{}'),
+    ARRAY[CAST(:field AS text)],
+    CASE
+        WHEN cog_config_store.data -> CAST(:field AS text)
+            @> jsonb_build_array(CAST(:member AS jsonb))
+        THEN cog_config_store.data -> CAST(:field AS text)
+        ELSE COALESCE(cog_config_store.data -> CAST(:field AS text), '[]')
+            || jsonb_build_array(CAST(:member AS jsonb))
+    END
+), version = cog_config_store.version + 1, updated_at = now()
+"""
+_REMOVE_FROM_SET_SQL = """
+UPDATE cog_config_store SET data = jsonb_set(
+    data,
+    ARRAY[CAST(:field AS text)],
+    COALESCE(
+        (
+            SELECT jsonb_agg(element)
+            FROM jsonb_array_elements(data -> CAST(:field AS text)) AS element
+            WHERE element <> CAST(:member AS jsonb)
+        ),
+        '[]'
+    )
+), version = version + 1, updated_at = now()
+WHERE cog = :cog AND guild_id = :guild_id
+    AND data -> CAST(:field AS text) @> jsonb_build_array(CAST(:member AS jsonb))
+"""
+_SET_DICT_ENTRY_SQL = """
+INSERT INTO cog_config_store (guild_id, cog, data)
+VALUES (
+    :guild_id,
+    :cog,
+    jsonb_build_object(
+        CAST(:field AS text),
+        jsonb_build_object(CAST(:entry_key AS text), CAST(:entry_value AS jsonb))
+    )
+)
+ON CONFLICT (cog, guild_id) DO UPDATE SET data = jsonb_set(
+    COALESCE(cog_config_store.data, '{}'),
+    ARRAY[CAST(:field AS text)],
+    COALESCE(cog_config_store.data -> CAST(:field AS text), '{}')
+        || jsonb_build_object(CAST(:entry_key AS text), CAST(:entry_value AS jsonb))
+), version = cog_config_store.version + 1, updated_at = now()
+"""
+_DELETE_DICT_ENTRY_SQL = """
+UPDATE cog_config_store
+SET data = data #- ARRAY[CAST(:field AS text), CAST(:entry_key AS text)],
+    version = version + 1,
+    updated_at = now()
+WHERE cog = :cog AND guild_id = :guild_id
+    AND data -> CAST(:field AS text) -> CAST(:entry_key AS text) IS NOT NULL
+"""
+
+
+def build_config_key(guild_id: int, cog_name: str) -> str:
+    """The key of a cog's config for a guild in a KvJsonStore"""
+    return f"{guild_id}.{cog_name}"
+
+
+def split_config_key(key: str) -> tuple[int, str]:
+    """Splits a config key into the guild id and the cog name"""
+    guild_id, _, cog_name = key.partition(".")
+    if not cog_name:
+        raise ValueError(f"{key!r} is not a config key")
+    return int(guild_id), cog_name
+
+
+# The partial updates of a JSON config, as the stores without JSON operators
+# apply them. Members, keys and values must be in their JSON form already.
+def json_set_add(data: dict, field: str, member: Any) -> None:
+    members = data.setdefault(field, [])
+    if member not in members:
+        members.append(member)
+
+
+def json_set_remove(data: dict, field: str, member: Any) -> bool:
+    """Returns whether the member was there"""
+    if member in data.get(field, []):
+        data[field].remove(member)
+        return True
+    return False
+
+
+def json_dict_set(data: dict, field: str, entry_key: str, entry_value: Any) -> None:
+    data.setdefault(field, {})[entry_key] = entry_value
+
+
+def json_dict_delete(data: dict, field: str, entry_key: str) -> bool:
+    """Returns whether the entry was there"""
+    return data.get(field, {}).pop(entry_key, _MISSING) is not _MISSING
+
+
+def _nested_set_fields(set_fields: AbstractSet[str], field: str) -> frozenset[str]:
+    """The set_fields of the dict held by field"""
+    nested = []
+    for path in set_fields:
+        head, dot, rest = path.partition(".")
+        if dot and head in (field, "*"):
+            nested.append(rest)
+    return frozenset(nested)
+
+
+def merge_configs(
+    base: Optional[dict],
+    ours: dict,
+    theirs: Optional[dict],
+    set_fields: AbstractSet[str] = frozenset(),
+) -> dict:
+    """
+    Three-way merges two JSON configs which were both changed from base.
+
+    Fields changed on one side only keep that change. Fields changed on both
+    sides are merged when they are dicts (recursively) or set_fields, which
+    are stored as lists: members added by either side are kept and members
+    removed by either side are dropped. Any other conflicting field, plain
+    lists included, takes our value.
+    set_fields are paths like those of CogConfiguration.set_fields(): nested
+    fields are joined by dots, and "*" stands for every key of a dict.
+    Without a base, e.g. when ours was never stored, nothing is known to be
+    changed by us: set_fields get the members of both sides and any other
+    conflicting field takes their value.
+    """
+    if theirs is None:
+        return dict(ours)
+    merged = {}
+    for field in {**theirs, **ours}:
+        base_value = _MISSING if base is None else base.get(field, _MISSING)
+        our_value = ours.get(field, _MISSING)
+        their_value = theirs.get(field, _MISSING)
+        if our_value == their_value or (base is not None and their_value == base_value):
+            value = our_value
+        elif base is not None and our_value == base_value:
+            value = their_value
+        elif isinstance(our_value, dict) and isinstance(their_value, dict):
+            value = merge_configs(
+                base_value if isinstance(base_value, dict) else None,
+                our_value,
+                their_value,
+                _nested_set_fields(set_fields, field),
+            )
+        elif (
+            (field in set_fields or "*" in set_fields)
+            and isinstance(our_value, list)
+            and isinstance(their_value, list)
+        ):
+            base_members = base_value if isinstance(base_value, list) else []
+            value = [
+                member
+                for member in our_value
+                if member in their_value or member not in base_members
+            ] + [
+                member
+                for member in their_value
+                if member not in our_value and member not in base_members
+            ]
+        elif base is None and their_value is not _MISSING:
+            value = their_value
+        else:
+            value = our_value
+        if value is not _MISSING:
+            merged[field] = value
+    return merged
+    merged = {}
+    for field in {**theirs, **ours}:
+        base_value = base.get(field, _MISSING)
+        our_value = ours.get(field, _MISSING)
+        their_value = theirs.get(field, _MISSING)
+        if our_value == their_value or their_value == base_value:
+            value = our_value
+        elif our_value == base_value:
+            value = their_value
+        elif isinstance(our_value, dict) and isinstance(their_value, dict):
+            value = merge_configs(
+                base_value if isinstance(base_value, dict) else None,
+                our_value,
+                their_value,
+            )
+        elif (
+            field in set_fields
+            and isinstance(our_value, list)
+            and isinstance(their_value, list)
+        ):
+            base_members = base_value if isinstance(base_value, list) else []
+            value = [
+                member
+                for member in our_value
+                if member in their_value or member not in base_members
+            ] + [
+                member
+                for member in their_value
+                if member not in our_value and member not in base_members
+            ]
+        else:
+            value = our_value
+        if value is not _MISSING:
+            merged[field] = value
+    return merged
+
+
+class ConfigConflictError(Exception):
+    """A config kept being changed by someone else while we tried to write it"""
+
+
+class TTLCache:
+    """
+    A LRU cache whose entries also expire after ttl seconds.
+    get and set are O(1).
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Retrieves an entry, or default if it is missing or has expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+def _tracked_method(method: Callable) -> Callable:
+    def tracked(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if self._owner is not None:
+            self._owner._changed()
+        return result
+
+    tracked.__name__ = method.__name__
+    return tracked
+
+
+class _TrackedSet(set):
+    """A set field of a CogConfiguration, which tells it when it is changed"""
+
+    _owner: Optional["CogConfiguration"] = None
+
+    def __reduce__(self):
+        # copies are plain sets, tracked again by the config they end up in
+        return set, (list(self),)
+
+    def __repr__(self) -> str:
+        return repr(set(self))
+
+
+class _TrackedDict(dict):
+    """A dict field of a CogConfiguration, which tells it when it is changed"""
+
+    _owner: Optional["CogConfiguration"] = None
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+for _name in [
+    "add",
+    "discard",
+    "remove",
+    "pop",
+    "clear",
+    "update",
+    "difference_update",
+    "intersection_update",
+    "symmetric_difference_update",
+    "__ior__",
+    "__iand__",
+    "__isub__",
+    "__ixor__",
+]:
+    setattr(_TrackedSet, _name, _tracked_method(getattr(set, _name)))
+for _name in [
+    "__setitem__",
+    "__delitem__",
+    "pop",
+    "popitem",
+    "clear",
+    "update",
+    "setdefault",
+    "__ior__",
+]:
+    setattr(_TrackedDict, _name, _tracked_method(getattr(dict, _name)))
+
+
+def _track(value: Any, owner: "CogConfiguration") -> Any:
+    """Wraps a set or dict field value so that changes to it reach owner"""
+    for plain, tracked_type in ((set, _TrackedSet), (dict, _TrackedDict)):
+        if type(value) is plain or (
+            type(value) is tracked_type and value._owner is not owner
+        ):
+            tracked = tracked_type(value)
+            tracked._owner = owner
+            return tracked
+    return value
 
 
 class CogConfiguration(BaseModel):
+    """
+    The configuration of a cog for one guild.
+
+    Every change bumps the config's generation: assigning a field, and changing
+    a set or dict field in place. Changes inside other values, like models
+    nested in a dict, are not seen; assign the value again instead.
+    A config is dirty from the moment it is changed until it is marked clean,
+    which is done once it is written to the store. New configs are dirty, as
+    no store holds them yet.
+    """
+
+    _generation: int = PrivateAttr(1)
+    _clean_generation: int = PrivateAttr(0)
+
+    def __init__(self, **data: Any):
+        super().__init__(**data)
+        self._track_fields()
+
+    def _copy_and_set_values(self, *args, **kwargs):
+        # the copy gets sets and dicts of its own, rather than sharing ours
+        copy = super()._copy_and_set_values(*args, **kwargs)
+        copy._track_fields()
+        return copy
+
+    def __setstate__(self, state):
+        # copy.deepcopy and pickle
+        super().__setstate__(state)
+        self._track_fields()
+
+    def _track_fields(self) -> None:
+        for name, value in self.__dict__.items():
+            self.__dict__[name] = _track(value, self)
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        if name in self.__fields__:
+            self.__dict__[name] = _track(self.__dict__[name], self)
+            self._changed()
+
+    def _changed(self) -> None:
+        object.__setattr__(self, "_generation", self._generation + 1)
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every change"""
+        return self._generation
+
+    @property
+    def dirty(self) -> bool:
+        """Whether the config was changed since it was last marked clean"""
+        return self._generation != self._clean_generation
+
+    def mark_clean(self, generation: Optional[int] = None) -> None:
+        """
+        Marks the config as stored, as it was at the given generation.
+        Defaults to the current one.
+        """
+        if generation is None:
+            generation = self._generation
+        object.__setattr__(self, "_clean_generation", generation)
+
+    @classmethod
+    def set_fields(cls) -> frozenset[str]:
+        """
+        The paths of the fields holding sets, which merge_configs merges member
+        by member, including those nested in dicts ("field.*") and models
+        """
+        return frozenset(_set_paths(cls.__fields__, ""))
+
     def to_embed(self) -> disnake.Embed:
         """Super rudimentary way to dump out the config as an embed."""
         return disnake.Embed(
@@ -17,11 +486,268 @@ class CogConfiguration(BaseModel):
         )
 
 
-class AsyncSqlAlchemyKvJsonStore:
+def _set_paths(fields: dict[str, ModelField], prefix: str) -> Iterator[str]:
+    for name, field in fields.items():
+        yield from _field_set_paths(field, prefix + name)
+
+
+def _field_set_paths(field: ModelField, path: str) -> Iterator[str]:
+    if field.shape in (SHAPE_SET, SHAPE_FROZENSET):
+        yield path
+    elif field.shape in MAPPING_LIKE_SHAPES and field.sub_fields:
+        # the field of the values
+        yield from _field_set_paths(field.sub_fields[0], f"{path}.*")
+    elif (
+        field.shape == SHAPE_SINGLETON
+        and isinstance(field.type_, type)
+        and issubclass(field.type_, BaseModel)
+    ):
+        yield from _set_paths(field.type_.__fields__, f"{path}.")
+
+
+def _generations(
+    configs: Iterable[Union[CogConfiguration, RawJson]]
+) -> list[tuple[CogConfiguration, int]]:
+    """The generation of every config which is not encoded already"""
+    return [
+        (config, config.generation)
+        for config in configs
+        if isinstance(config, CogConfiguration)
+    ]
+
+
+def _dirty_configs(
+    guild_config_map: dict[int, Union[CogConfiguration, RawJson]]
+) -> dict[int, Union[CogConfiguration, RawJson]]:
+    return {
+        guild_id: config
+        for guild_id, config in guild_config_map.items()
+        if not isinstance(config, CogConfiguration) or config.dirty
+    }
+
+
+def _mark_clean(generations: list[tuple[CogConfiguration, int]]) -> None:
+    """Marks configs clean once they were written as they were at generation"""
+    for config, generation in generations:
+        config.mark_clean(generation)
+
+
+class KvJsonStore(abc.ABC):
     """
     A key-value store where the keys are strings and the values are JSON objects.
-    This only works with the Postgres engine for now.
-    TODO: Check if it can work with other engines
+    This is the interface CogConfigStore is written against.
+
+    The keys are config keys (see build_config_key), so that the configs of one
+    guild or of one cog can be read as a range.
+    """
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    def get_sync(self, key: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def batch_get(self, keys: list[str]) -> Optional[dict[str, dict]]:
+        ...
+
+    @abc.abstractmethod
+    def batch_get_sync(self, keys: list[str]) -> Optional[dict[str, dict]]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def set_sync(self, key: str, value: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def batch_set(self, key_value_map: dict[str, dict]) -> None:
+        ...
+
+    @abc.abstractmethod
+    def batch_set_sync(self, key_value_map: dict[str, dict]) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def add_to_set(self, key: str, field: str, member: Any) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def remove_from_set(self, key: str, field: str, member: Any) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def set_dict_entry(
+        self, key: str, field: str, entry_key: Any, entry_value: Any
+    ) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete_dict_entry(self, key: str, field: str, entry_key: Any) -> None:
+        ...
+
+    @abc.abstractmethod
+    def scan(self) -> AsyncIterator[tuple[str, dict]]:
+        """Yields every key and value in the store"""
+        ...
+
+    @abc.abstractmethod
+    async def get_guild(self, guild_id: int) -> dict[str, dict]:
+        """Returns every key and value of a guild"""
+        ...
+
+    @abc.abstractmethod
+    async def get_cog(self, cog_name: str) -> dict[str, dict]:
+        """Returns every key and value of a cog"""
+        ...
+
+    @abc.abstractmethod
+    async def delete_guild(self, guild_id: int) -> list[str]:
+        """Deletes every value of a guild and returns the deleted keys"""
+        ...
+
+    @abc.abstractmethod
+    async def get_versioned(self, key: str) -> tuple[Optional[dict], Optional[int]]:
+        """Returns a value with its version, or (None, None) if there is none"""
+        ...
+
+    @abc.abstractmethod
+    async def compare_and_set(
+        self, key: str, value: dict, expected_version: Optional[int]
+    ) -> Optional[int]:
+        """
+        Sets a value only if its version is still expected_version, where None
+        means that the key must not exist yet.
+        :return: The new version, or None if the value was changed in between
+        """
+        ...
+
+
+class InMemoryKvJsonStore(KvJsonStore):
+    """
+    A KvJsonStore which lives in a dict. Nothing is persisted.
+    Values are round-tripped through JSON, so they come back exactly like they
+    would from a database. Useful for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.data: dict[str, dict] = {}
+        self.versions: dict[str, int] = {}
+
+    def _bump_version(self, key: str) -> None:
+        self.versions[key] = self.versions[key] + 1 if key in self.versions else 0
+
+    @staticmethod
+    def _to_json(value: Any) -> Any:
+        return loads(dumpb(value))
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self.get_sync(key)
+
+    def get_sync(self, key: str) -> Optional[dict]:
+        value = self.data.get(key)
+        return None if value is None else self._to_json(value)
+
+    async def batch_get(self, keys: list[str]) -> Optional[dict[str, dict]]:
+        return self.batch_get_sync(keys)
+
+    def batch_get_sync(self, keys: list[str]) -> Optional[dict[str, dict]]:
+        found = {key: self.data[key] for key in keys if key in self.data}
+        return self._to_json(found) or None
+
+    async def set(self, key: str, value: dict) -> None:
+        self.set_sync(key, value)
+
+    def set_sync(self, key: str, value: dict) -> None:
+        self.data[key] = self._to_json(value)
+        self._bump_version(key)
+
+    async def batch_set(self, key_value_map: dict[str, dict]) -> None:
+        self.batch_set_sync(key_value_map)
+
+    def batch_set_sync(self, key_value_map: dict[str, dict]) -> None:
+        self.data.update(self._to_json(key_value_map))
+        for key in key_value_map:
+            self._bump_version(key)
+
+    async def add_to_set(self, key: str, field: str, member: Any) -> None:
+        json_set_add(self.data.setdefault(key, {}), field, self._to_json(member))
+        self._bump_version(key)
+
+    async def remove_from_set(self, key: str, field: str, member: Any) -> None:
+        # like an update which matches no row, removing nothing changes nothing
+        if key in self.data and json_set_remove(
+            self.data[key], field, self._to_json(member)
+        ):
+            self._bump_version(key)
+
+    async def set_dict_entry(
+        self, key: str, field: str, entry_key: Any, entry_value: Any
+    ) -> None:
+        json_dict_set(
+            self.data.setdefault(key, {}),
+            field,
+            str(entry_key),
+            self._to_json(entry_value),
+        )
+        self._bump_version(key)
+
+    async def delete_dict_entry(self, key: str, field: str, entry_key: Any) -> None:
+        if key in self.data and json_dict_delete(
+            self.data[key], field, str(entry_key)
+        ):
+            self._bump_version(key)
+
+    async def scan(self) -> AsyncIterator[tuple[str, dict]]:
+        for key, value in list(self.data.items()):
+            yield key, self._to_json(value)
+
+    def _select(self, predicate: Callable[[int, str], bool]) -> dict[str, dict]:
+        return self._to_json(
+            {
+                key: value
+                for key, value in self.data.items()
+                if predicate(*split_config_key(key))
+            }
+        )
+
+    async def get_guild(self, guild_id: int) -> dict[str, dict]:
+        return self._select(lambda key_guild_id, _: key_guild_id == guild_id)
+
+    async def get_cog(self, cog_name: str) -> dict[str, dict]:
+        return self._select(lambda _, key_cog_name: key_cog_name == cog_name)
+
+    async def delete_guild(self, guild_id: int) -> list[str]:
+        deleted = list(await self.get_guild(guild_id))
+        for key in deleted:
+            del self.data[key]
+            self.versions.pop(key, None)
+        return deleted
+
+    async def get_versioned(self, key: str) -> tuple[Optional[dict], Optional[int]]:
+        return self.get_sync(key), self.versions.get(key)
+
+    async def compare_and_set(
+        self, key: str, value: dict, expected_version: Optional[int]
+    ) -> Optional[int]:
+        if self.versions.get(key) != expected_version:
+            return None
+        self.set_sync(key, value)
+        return self.versions[key]
+
+
+class AsyncSqlAlchemyKvJsonStore(KvJsonStore):
+    """
+    A KvJsonStore backed by the cog_config_store table.
+    Config keys are stored as the (cog, guild_id) primary key, so the configs of
+    one cog or one guild are read with an index range scan rather than a LIKE.
+    Writes are native upserts on Postgres and SQLite. Other engines fall back to
+    delete + insert.
 
     TODO: Loads of duplication between this and the sync version.
     """
@@ -29,6 +755,33 @@ class AsyncSqlAlchemyKvJsonStore:
     def __init__(self, engine: AsyncEngine):
         self.engine = engine
 
+    @staticmethod
+    def _where_key(key: str) -> sqlalchemy.ColumnElement[bool]:
+        guild_id, cog_name = split_config_key(key)
+        return sqlalchemy.and_(
+            cog_config_store.c.cog == cog_name,
+            cog_config_store.c.guild_id == guild_id,
+        )
+
+    @staticmethod
+    def _select_keys(keys: list[str]) -> Iterator[Executable]:
+        """
+        Selects the given keys, SELECT_CHUNK_SIZE guilds of one cog at a time,
+        which keeps every statement under the drivers' bind parameter limits.
+        """
+        guild_ids_by_cog: defaultdict[str, list[int]] = defaultdict(list)
+        for key in keys:
+            guild_id, cog_name = split_config_key(key)
+            guild_ids_by_cog[cog_name].append(guild_id)
+        for cog_name, guild_ids in guild_ids_by_cog.items():
+            for start in range(0, len(guild_ids), SELECT_CHUNK_SIZE):
+                yield _select_rows().where(
+                    cog_config_store.c.cog == cog_name,
+                    cog_config_store.c.guild_id.in_(
+                        guild_ids[start : start + SELECT_CHUNK_SIZE]
+                    ),
+                )
+
     async def get(self, key: str) -> Optional[dict]:
         """
         Retrieves a value from the store
@@ -37,12 +790,9 @@ class AsyncSqlAlchemyKvJsonStore:
         """
         async with self.engine.connect() as conn:
             result = await conn.execute(
-                json_config_store.select().where(json_config_store.c.id == key)
+                sqlalchemy.select(cog_config_store.c.data).where(self._where_key(key))
             )
-            row = result.first()
-            if row is None:
-                return None
-            return row[1]
+            return result.scalar_one_or_none()
 
     def get_sync(self, key: str) -> Optional[dict]:
         """
@@ -52,40 +802,39 @@ class AsyncSqlAlchemyKvJsonStore:
         """
         with self.engine.sync_engine.connect() as conn:
             result = conn.execute(
-                json_config_store.select().where(json_config_store.c.id == key)
+                sqlalchemy.select(cog_config_store.c.data).where(self._where_key(key))
             )
-            row = result.first()
-            if row is None:
-                return None
-            return row[1]
+            return result.scalar_one_or_none()
 
     async def batch_get(self, keys: list[str]) -> Optional[dict[str, dict]]:
         """
-        Batch retrieves values from the store
+        Batch retrieves values from the store, with one statement per cog and
+        SELECT_CHUNK_SIZE keys.
         :param keys: The keys to retrieve
         :return: A dictionary of keys to values or None if no keys were found
         """
+        found = {}
         async with self.engine.connect() as conn:
-            result = await conn.execute(
-                json_config_store.select().where(json_config_store.c.id.in_(keys))
-            )
-            if result.rowcount == 0:
-                return None
-            return {row[0]: row[1] for row in result}
+            for stmt in self._select_keys(keys):
+                result = await conn.execute(stmt)
+                # rowcount is not reliable for SELECTs on every driver
+                found.update(_rows_to_dict(result))
+        return found or None
 
     def batch_get_sync(self, keys: list[str]) -> Optional[dict[str, dict]]:
         """
-        Batch retrieves values from the store
+        Batch retrieves values from the store, with one statement per cog and
+        SELECT_CHUNK_SIZE keys.
         :param keys: The keys to retrieve
         :return: A dictionary of keys to values or None if no keys were found
         """
+        found = {}
         with self.engine.sync_engine.connect() as conn:
-            result = conn.execute(
-                json_config_store.select().where(json_config_store.c.id.in_(keys))
-            )
-            if result.rowcount == 0:
-                return None
-            return {row[0]: row[1] for row in result}
+            for stmt in self._select_keys(keys):
+                result = conn.execute(stmt)
+                # rowcount is not reliable for SELECTs on every driver
+                found.update(_rows_to_dict(result))
+        return found or None
 
     async def set(self, key: str, value: dict) -> None:
         """
@@ -93,21 +842,7 @@ class AsyncSqlAlchemyKvJsonStore:
         :param key: The key to set
         :param value: The value to set
         """
-        async with self.engine.connect() as conn:
-            maybe_row = await conn.execute(
-                json_config_store.select().where(json_config_store.c.id == key)
-            )
-            if maybe_row.rowcount == 0:
-                await conn.execute(
-                    json_config_store.insert().values(id=key, data=value)
-                )
-            else:
-                await conn.execute(
-                    json_config_store.update()
-                    .where(json_config_store.c.id == key)
-                    .values(data=value)
-                )
-            await conn.commit()
+        await self.batch_set({key: value})
 
     def set_sync(self, key: str, value: dict) -> None:
         """
@@ -115,94 +850,365 @@ class AsyncSqlAlchemyKvJsonStore:
         :param key: The key to set
         :param value: The value to set
         """
-        with self.engine.sync_engine.connect() as conn:
-            maybe_row = conn.execute(
-                json_config_store.select().where(json_config_store.c.id == key)
-            )
-            if maybe_row.rowcount == 0:
-                conn.execute(json_config_store.insert().values(id=key, data=value))
-            else:
-                conn.execute(
-                    json_config_store.update()
-                    .where(json_config_store.c.id == key)
-                    .values(data=value)
-                )
-            conn.commit()
+        self.batch_set_sync({key: value})
 
     async def batch_set(self, key_value_map: dict[str, dict]) -> None:
         """
-        Batch sets values in the store
+        Batch sets values in the store.
+        Every chunk of up to UPSERT_CHUNK_SIZE keys is written with a single
+        statement.
+        :param key_value_map: A dictionary of keys to values
+        """
+        if not key_value_map:
+            return
+        async with self.engine.begin() as conn:
+            for stmt in self._build_upserts(conn.dialect.name, key_value_map):
+                await conn.execute(stmt)
+
+    def batch_set_sync(self, key_value_map: dict[str, dict]) -> None:
+        """
+        Batch sets values in the store.
+        Every chunk of up to UPSERT_CHUNK_SIZE keys is written with a single
+        statement.
         :param key_value_map: A dictionary of keys to values
         """
+        if not key_value_map:
+            return
+        with self.engine.sync_engine.begin() as conn:
+            for stmt in self._build_upserts(conn.dialect.name, key_value_map):
+                conn.execute(stmt)
+
+    @staticmethod
+    def _build_upserts(
+        dialect_name: str, key_value_map: dict[str, dict]
+    ) -> Iterator[Executable]:
+        """
+        Builds the statements needed to upsert the given keys.
+
+        Postgres and SQLite get a multi-row ``INSERT ... ON CONFLICT (cog,
+        guild_id) DO UPDATE`` which bumps the version of existing rows. Other
+        engines fall back to deleting the keys and inserting them again, which
+        is two statements but still runs in one transaction, and resets the
+        versions.
+        """
+        rows = []
+        for key, value in key_value_map.items():
+            guild_id, cog_name = split_config_key(key)
+            rows.append(dict(guild_id=guild_id, cog=cog_name, data=value))
+        for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            chunk = rows[i : i + UPSERT_CHUNK_SIZE]
+            if dialect_name in _UPSERT_INSERTS:
+                stmt = _UPSERT_INSERTS[dialect_name](cog_config_store).values(chunk)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[
+                        cog_config_store.c.cog,
+                        cog_config_store.c.guild_id,
+                    ],
+                    set_=dict(
+                        data=stmt.excluded.data,
+                        version=cog_config_store.c.version + 1,
+                        updated_at=sqlalchemy.func.now(),
+                    ),
+                )
+                yield stmt
+            else:
+                yield cog_config_store.delete().where(
+                    sqlalchemy.tuple_(
+                        cog_config_store.c.cog, cog_config_store.c.guild_id
+                    ).in_([(row["cog"], row["guild_id"]) for row in chunk])
+                )
+                yield cog_config_store.insert().values(chunk)
+
+    async def add_to_set(self, key: str, field: str, member: Any) -> None:
+        """
+        Adds a member to a set-valued (JSON array) field of a value,
+        without rewriting the rest of the value.
+        The value is created if it does not exist yet.
+        """
+        await self._mutate(
+            key,
+            _ADD_TO_SET_SQL,
+            dict(field=field, member=dumps(member)),
+            lambda data: json_set_add(data, field, member),
+        )
+
+    async def remove_from_set(self, key: str, field: str, member: Any) -> None:
+        """
+        Removes a member from a set-valued (JSON array) field of a value,
+        without rewriting the rest of the value.
+        """
+        await self._mutate(
+            key,
+            _REMOVE_FROM_SET_SQL,
+            dict(field=field, member=dumps(member)),
+            lambda data: json_set_remove(data, field, member),
+        )
+
+    async def set_dict_entry(
+        self, key: str, field: str, entry_key: Any, entry_value: Any
+    ) -> None:
+        """
+        Sets an entry of a dict-valued field of a value,
+        without rewriting the rest of the value.
+        The value is created if it does not exist yet.
+        """
+        await self._mutate(
+            key,
+            _SET_DICT_ENTRY_SQL,
+            dict(
+                field=field,
+                entry_key=str(entry_key),
+                entry_value=dumps(entry_value),
+            ),
+            lambda data: json_dict_set(
+                data,
+                field,
+                str(entry_key),
+                loads(dumps(entry_value)),
+            ),
+        )
+
+    async def delete_dict_entry(self, key: str, field: str, entry_key: Any) -> None:
+        """
+        Deletes an entry of a dict-valued field of a value,
+        without rewriting the rest of the value.
+        """
+        await self._mutate(
+            key,
+            _DELETE_DICT_ENTRY_SQL,
+            dict(field=field, entry_key=str(entry_key)),
+            lambda data: json_dict_delete(data, field, str(entry_key)),
+        )
+
+    async def scan(self) -> AsyncIterator[tuple[str, dict]]:
+        """
+        Streams every row of the store with a single query.
+        Rows are fetched SCAN_BATCH_SIZE at a time, so the whole table is never
+        held in memory by the driver.
+        """
+        async with self.engine.connect() as conn:
+            result = await conn.stream(
+                _select_rows().execution_options(yield_per=SCAN_BATCH_SIZE)
+            )
+            async for guild_id, cog_name, data in result:
+                yield build_config_key(guild_id, cog_name), data
+
+    async def get_guild(self, guild_id: int) -> dict[str, dict]:
+        """
+        Retrieves every value of a guild, through the guild_id index
+        :param guild_id: The guild to retrieve
+        :return: A dictionary of keys to values
+        """
         async with self.engine.connect() as conn:
-            # fetch the row first and see if it exists
-            # if it does, update it
-            # if it doesn't, insert it
-            row = await conn.execute(
-                json_config_store.select().where(
-                    json_config_store.c.id.in_(key_value_map.keys())
+            result = await conn.execute(
+                _select_rows().where(cog_config_store.c.guild_id == guild_id)
+            )
+            return _rows_to_dict(result)
+
+    async def get_cog(self, cog_name: str) -> dict[str, dict]:
+        """
+        Retrieves every value of a cog, through the primary key
+        :param cog_name: The cog to retrieve
+        :return: A dictionary of keys to values
+        """
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                _select_rows().where(cog_config_store.c.cog == cog_name)
+            )
+            return _rows_to_dict(result)
+
+    async def delete_guild(self, guild_id: int) -> list[str]:
+        """
+        Deletes every value of a guild, through the guild_id index
+        :param guild_id: The guild to delete
+        :return: The deleted keys
+        """
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                sqlalchemy.select(cog_config_store.c.cog).where(
+                    cog_config_store.c.guild_id == guild_id
                 )
             )
-            if row.rowcount() > 0:
-                for row in row:
-                    key = row[0]
-                    value = row[1]
-                    if key in key_value_map:
-                        await conn.execute(
-                            json_config_store.update()
-                            .where(json_config_store.c.id == key)
-                            .values(data=key_value_map[key])
+            deleted = [
+                build_config_key(guild_id, cog_name) for cog_name in result.scalars()
+            ]
+            await conn.execute(
+                cog_config_store.delete().where(cog_config_store.c.guild_id == guild_id)
+            )
+            return deleted
+
+    async def get_versioned(self, key: str) -> tuple[Optional[dict], Optional[int]]:
+        """
+        Retrieves a value from the store along with its version
+        :param key: The key to retrieve
+        :return: The value and version, or (None, None) if not found
+        """
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                sqlalchemy.select(
+                    cog_config_store.c.data, cog_config_store.c.version
+                ).where(self._where_key(key))
+            )
+            row = result.first()
+            if row is None:
+                return None, None
+            return row[0], row[1]
+
+    async def compare_and_set(
+        self, key: str, value: dict, expected_version: Optional[int]
+    ) -> Optional[int]:
+        """
+        Sets a value only if nobody else wrote it since expected_version was
+        read. None as the expected version means that the key must not exist.
+        :param key: The key to set
+        :param value: The value to set
+        :param expected_version: The version the value was read at
+        :return: The new version, or None if the value was changed in between
+        """
+        guild_id, cog_name = split_config_key(key)
+        async with self.engine.begin() as conn:
+            if expected_version is None:
+                row = dict(guild_id=guild_id, cog=cog_name, data=value)
+                dialect_name = conn.dialect.name
+                if dialect_name in _UPSERT_INSERTS:
+                    stmt = (
+                        _UPSERT_INSERTS[dialect_name](cog_config_store)
+                        .values(row)
+                        .on_conflict_do_nothing(
+                            index_elements=[
+                                cog_config_store.c.cog,
+                                cog_config_store.c.guild_id,
+                            ]
                         )
-                        del key_value_map[key]
-            # insert the remaining keys
-            if len(key_value_map) > 0:
-                await conn.execute(
-                    json_config_store.insert(),
-                    [dict(id=key, data=value) for key, value in key_value_map.items()],
+                        .returning(cog_config_store.c.version)
+                    )
+                    result = await conn.execute(stmt)
+                    # nothing is returned when the key existed
+                    return result.scalar_one_or_none()
+                try:
+                    async with conn.begin_nested():
+                        await conn.execute(cog_config_store.insert().values(row))
+                except sqlalchemy.exc.IntegrityError:
+                    return None
+                return 0
+            result = await conn.execute(
+                cog_config_store.update()
+                .where(
+                    self._where_key(key),
+                    cog_config_store.c.version == expected_version,
+                )
+                .values(
+                    data=value,
+                    version=cog_config_store.c.version + 1,
+                    updated_at=sqlalchemy.func.now(),
                 )
-            await conn.commit()
+            )
+            return expected_version + 1 if result.rowcount == 1 else None
 
-    def batch_set_sync(self, key_value_map: dict[str, dict]) -> None:
+    async def _mutate(
+        self,
+        key: str,
+        postgres_sql: str,
+        params: dict,
+        mutate: Callable[[dict], None],
+    ) -> None:
         """
-        Batch sets values in the store
-        :param key_value_map: A dictionary of keys to values
+        Partially updates a value.
+        Postgres does it server side with a single statement, other engines read,
+        mutate and write the value back within one transaction. Like on
+        Postgres, a mutation which changes nothing writes nothing, so the
+        version is left alone.
         """
-        with self.engine.sync_engine.connect() as conn:
-            # fetch the row first and see if it exists
-            # if it does, update it
-            # if it doesn't, insert it
-            row = conn.execute(
-                json_config_store.select().where(
-                    json_config_store.c.id.in_(key_value_map.keys())
+        async with self.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                guild_id, cog_name = split_config_key(key)
+                await conn.execute(
+                    sqlalchemy.text(postgres_sql),
+                    dict(guild_id=guild_id, cog=cog_name, **params),
                 )
+                return
+            result = await conn.execute(
+                sqlalchemy.select(cog_config_store.c.data).where(self._where_key(key))
             )
-            if row.rowcount() > 0:
-                for row in row:
-                    key = row[0]
-                    value = row[1]
-                    if key in key_value_map:
-                        conn.execute(
-                            json_config_store.update()
-                            .where(json_config_store.c.id == key)
-                            .values(data=key_value_map[key])
-                        )
-                        del key_value_map[key]
-            # insert the remaining keys
-            if len(key_value_map) > 0:
-                conn.execute(
-                    json_config_store.insert(),
-                    [dict(id=key, data=value) for key, value in key_value_map.items()],
-                )
-            conn.commit()
+            data = copy.deepcopy(result.scalar_one_or_none() or {})
+            before = copy.deepcopy(data)
+            mutate(data)
+            if data == before:
+                return
+            for stmt in self._build_upserts(conn.dialect.name, {key: data}):
+                await conn.execute(stmt)
+
+
+def _select_rows() -> sqlalchemy.Select:
+    return sqlalchemy.select(
+        cog_config_store.c.guild_id, cog_config_store.c.cog, cog_config_store.c.data
+    )
+
+
+def _rows_to_dict(rows) -> dict[str, dict]:
+    return {
+        build_config_key(guild_id, cog_name): data for guild_id, cog_name, data in rows
+    }
 
 
 class CogConfigStore:
-    """KV store backed Cog Configuration"""
+    """
+    KV store backed Cog Configuration
+
+    In write-behind mode, set_cog_config only queues the config in memory.
+    Queued configs are coalesced per (guild, cog) key and written with a single
+    batch_set once max_pending keys are dirty or flush_interval seconds have
+    passed, whichever comes first. Await flush() when a write has to be durable,
+    and close() on shutdown.
+
+    When given a cache, reads go through it and writes update it. Stale entries
+    are dropped with invalidate(), which also tells the cogs that subscribed to
+    the changed cog so that they can reload their in-memory copy.
+
+    preload() reads every config of the given guilds with one streamed query.
+    get_cog_config then serves each key from that snapshot once, so the cogs
+    loading at startup do not each query the store. Keys written or
+    invalidated after the preload are read from the store as usual.
+    """
 
-    def __init__(self, store: AsyncSqlAlchemyKvJsonStore, *, logger: logging.Logger):
+    def __init__(
+        self,
+        store: KvJsonStore,
+        *,
+        logger: logging.Logger,
+        write_behind: bool = False,
+        flush_interval: float = 1.0,
+        max_pending: int = 100,
+        cache: Optional[TTLCache] = None,
+    ):
         self.store = store
         self.sep = "."
         self.logger = logger
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: dict[str, dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_now = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Number of configs being written by the flush in progress
+        self._flushing = 0
+        self.cache = cache
+        self._subscribers: defaultdict[
+            str, list[Callable[[Optional[int]], None]]
+        ] = defaultdict(list)
+        # Configs loaded by preload(), keyed like the store. Keys which are not
+        # in the snapshot had no row at the time; consumed or stale keys are
+        # marked _MISSING.
+        self._snapshot: Optional[dict[str, Any]] = None
+        self._snapshot_guilds: frozenset[int] = frozenset()
+        self._snapshot_releases = 0
+        # The keys forgotten while a preload runs
+        self._preload_forgotten: Optional[set[str]] = None
+        # Bumped whenever cached configs are dropped. A read which started
+        # before only caches what it read if this did not change meanwhile, as
+        # it may have read a row from before the change.
+        self._cache_generation = 0
 
     def build_key(self, parts: list[str]) -> str:
         return self.sep.join(parts)
@@ -211,12 +1217,12 @@ class CogConfigStore:
         return key.split(self.sep)
 
     def build_cog_key(self, guild_id: int, cog: Cog) -> str:
-        return self.build_key([str(guild_id), cog.qualified_name])
+        return build_config_key(guild_id, cog.qualified_name)
 
     def split_cog_key(self, key: str) -> tuple[int, str]:
-        parts = self.split_key(key)
-        return int(parts[0]), parts[1]
+        return split_config_key(key)
 
+    @instrumented
     async def get_cog_config(
         self, guilds: list[int], cog: Cog
     ) -> Optional[dict[int, dict]]:
@@ -224,17 +1230,48 @@ class CogConfigStore:
         desired_configs = list(
             map(lambda guild_id: self.build_cog_key(guild_id, cog), guilds)
         )
-        cog_config = await self.store.batch_get(desired_configs)
+        cog_config = {}
+        if self.cache is not None:
+            misses = []
+            for key in desired_configs:
+                value = self.cache.get(key, _MISSING)
+                if value is _MISSING:
+                    misses.append(key)
+                elif value is not None:
+                    # our own writes are cached as they were encoded
+                    cog_config[key] = decode(value)
+            desired_configs = misses
+        if self._snapshot is not None:
+            misses = []
+            for key in desired_configs:
+                value = self._take_from_snapshot(key)
+                if value is _MISSING:
+                    misses.append(key)
+                    continue
+                if self.cache is not None:
+                    self.cache.set(key, value)
+                if value is not None:
+                    cog_config[key] = value
+            desired_configs = misses
+        if desired_configs:
+            generation = self._cache_generation
+            fetched = await self.store.batch_get(desired_configs) or {}
+            if self.cache is not None and generation == self._cache_generation:
+                # keys without a row are cached too, so they are not queried again
+                for key in desired_configs:
+                    self.cache.set(key, fetched.get(key))
+            cog_config.update(fetched)
         self.logger.debug("Cog config for %s: %s", cog.qualified_name, cog_config)
-        if cog_config is None:
+        if not cog_config:
             return None
         # now we need to strip the guild id from the key
         return {self.split_cog_key(key)[0]: value for key, value in cog_config.items()}
 
+    @instrumented
     async def set_cog_config(
-        self, cog: Cog, guild: disnake.Guild, config: CogConfiguration
+        self, cog: Cog, guild: disnake.Guild, config: Union[CogConfiguration, RawJson]
     ):
-        """Set the configuration for a cog"""
+        """Set the configuration for a cog. The config may be encoded already"""
         self.logger.info(
             "updating Cog %s config for guild %s (id: %s)",
             cog.qualified_name,
@@ -243,42 +1280,699 @@ class CogConfigStore:
         )
         self.logger.debug("%s", config)
         key = self.build_cog_key(guild.id, cog)
-        persisted_config = json.loads(config.json())
+        generations = _generations([config])
+        persisted_config = encode_config(config)
         self.logger.debug("Persisted config: %s", persisted_config)
-        await self.store.set(key, persisted_config)
+        self._cache_set({key: persisted_config})
+        if self.write_behind:
+            self._queue_write(key, persisted_config)
+        else:
+            await self.store.set(key, persisted_config)
+        _mark_clean(generations)
+
+    @instrumented
+    async def get_cog_config_versioned(
+        self, guild_id: int, cog: Cog
+    ) -> tuple[Optional[dict], Optional[int]]:
+        """
+        Reads a cog config straight from the store, with the version needed for
+        compare_and_set_cog_config. (None, None) if there is no config yet.
+        """
+        key = self.build_cog_key(guild_id, cog)
+        generation = self._cache_generation
+        value, version = await self.store.get_versioned(key)
+        self._cache_read({key: value}, generation)
+        return value, version
 
+    @instrumented
+    async def get_guild_configs(self, guild_id: int) -> dict[str, dict]:
+        """
+        Reads the config of every cog for one guild straight from the store,
+        keyed by cog name
+        """
+        await self._flush_pending_keys(
+            lambda key: self.split_cog_key(key)[0] == guild_id
+        )
+        generation = self._cache_generation
+        configs = await self.store.get_guild(guild_id)
+        self._cache_read(configs, generation)
+        return {self.split_cog_key(key)[1]: value for key, value in configs.items()}
+
+    @instrumented
+    async def get_all_cog_configs(self, cog: Cog) -> dict[int, dict]:
+        """
+        Reads the config of one cog for every guild straight from the store,
+        keyed by guild id
+        """
+        await self._flush_pending_keys(
+            lambda key: self.split_cog_key(key)[1] == cog.qualified_name
+        )
+        generation = self._cache_generation
+        configs = await self.store.get_cog(cog.qualified_name)
+        self._cache_read(configs, generation)
+        return {self.split_cog_key(key)[0]: value for key, value in configs.items()}
+
+    @instrumented
+    async def delete_guild_configs(self, guild_id: int) -> list[str]:
+        """
+        Deletes the config of every cog for a guild, e.g. one the bot left.
+        The cogs which subscribed are told, like for any other change.
+        :return: The names of the cogs which had a config
+        """
+        for key in list(self._pending):
+            if self.split_cog_key(key)[0] == guild_id:
+                del self._pending[key]
+        deleted = await self.store.delete_guild(guild_id)
+        for key in deleted:
+            self.invalidate(key)
+        self.logger.info("Deleted %s cog configs of guild %s", len(deleted), guild_id)
+        return [self.split_cog_key(key)[1] for key in deleted]
+
+    @instrumented
+    async def compare_and_set_cog_config(
+        self,
+        cog: Cog,
+        guild: disnake.Guild,
+        config: CogConfiguration,
+        *,
+        base: Union[dict, RawJson, None],
+        version: Optional[int],
+        max_retries: int = 5,
+    ) -> tuple[Union[dict, RawJson], int]:
+        """
+        Writes a config which was derived from base, read at version.
+
+        If someone else wrote the config since, their version is read back and
+        three-way merged with ours (see merge_configs), and the write is retried.
+        With UNKNOWN_VERSION, the current version is read and merged first.
+        :return: What was written and its version. What was written is a dict
+        only when concurrent changes were merged in; otherwise it is our config,
+        encoded as RawJson
+        :raises ConfigConflictError: if the config kept changing under us
+        """
+        self.logger.info(
+            "updating Cog %s config for guild %s (id: %s) at version %s",
+            cog.qualified_name,
+            guild.name,
+            guild.id,
+            version,
+        )
+        key = self.build_cog_key(guild.id, cog)
+        generation = config.generation
+        ours = encode_config(config)
+        set_fields = config.set_fields()
+        # A queued full write would otherwise land after, and undo, this update
+        if key in self._pending:
+            await self.flush()
+        if version == UNKNOWN_VERSION:
+            theirs, version = await self.store.get_versioned(key)
+            if theirs != decode(base):
+                ours = merge_configs(decode(base), decode(ours), theirs, set_fields)
+            base = theirs
+        for _ in range(max_retries):
+            new_version = await self.store.compare_and_set(key, ours, version)
+            if new_version is not None:
+                self._cache_set({key: ours})
+                config.mark_clean(generation)
+                return ours, new_version
+            theirs, version = await self.store.get_versioned(key)
+            self.logger.info(
+                "Cog %s config for guild %s changed concurrently, merging",
+                cog.qualified_name,
+                guild.id,
+            )
+            ours = merge_configs(decode(base), decode(ours), theirs, set_fields)
+            base = theirs
+        # Let the cogs reload what is in the store now
+        self.invalidate(key)
+        raise ConfigConflictError(
+            f"Cog {cog.qualified_name} config for guild {guild.id} kept changing"
+        )
+
+    @instrumented
     async def batch_set_cog_config(
-        self, cog: Cog, guild_config_map: dict[disnake.Guild, CogConfiguration]
+        self,
+        cog: Cog,
+        guild_config_map: dict[int, Union[CogConfiguration, RawJson]],
     ):
         """
-        Batch set the configuration for a cog. Useful for flushing all the config
-        to the store at once.
+        Batch set the configuration for a cog, keyed by guild id. Useful for
+        flushing all the config to the store at once. The configs may be encoded
+        already; configs which are not and are not dirty are skipped.
         """
+        guild_config_map = _dirty_configs(guild_config_map)
         self.logger.debug(
             "Updating Cog %s config for %s guilds",
             cog.qualified_name,
             len(guild_config_map),
         )
+        generations = _generations(guild_config_map.values())
         key_value_map = {
-            self.build_cog_key(guild.id, cog): json.loads(config.json())
-            for guild, config in guild_config_map.items()
+            self.build_cog_key(guild_id, cog): encode_config(config)
+            for guild_id, config in guild_config_map.items()
         }
+        self._discard_pending(key_value_map)
+        self._cache_set(key_value_map)
         await self.store.batch_set(key_value_map)
+        _mark_clean(generations)
 
     def batch_set_cog_config_sync(
-        self, cog: Cog, guild_config_map: dict[disnake.Guild, CogConfiguration]
+        self,
+        cog: Cog,
+        guild_config_map: dict[int, Union[CogConfiguration, RawJson]],
     ):
         """
-        Batch set the configuration for a cog. Useful for flushing all the config
-        to the store at once.
+        Batch set the configuration for a cog, keyed by guild id. Useful for
+        flushing all the config to the store at once. The configs may be encoded
+        already; configs which are not and are not dirty are skipped.
         """
+        guild_config_map = _dirty_configs(guild_config_map)
         self.logger.debug(
             "Updating Cog %s config for %s guilds",
             cog.qualified_name,
             len(guild_config_map),
         )
+        generations = _generations(guild_config_map.values())
         key_value_map = {
-            self.build_cog_key(guild.id, cog): json.loads(config.json())
-            for guild, config in guild_config_map.items()
+            self.build_cog_key(guild_id, cog): encode_config(config)
+            for guild_id, config in guild_config_map.items()
         }
+        self._discard_pending(key_value_map)
+        self._cache_set(key_value_map)
         self.store.batch_set_sync(key_value_map)
+        _mark_clean(generations)
+
+    def subscribe(self, cog: Cog, callback: Callable[[Optional[int]], None]) -> None:
+        """
+        Registers a callback which is called with the guild id whenever the
+        config of the cog is invalidated, or with None when every guild is.
+        """
+        self._subscribers[cog.qualified_name].append(callback)
+
+    def unsubscribe(self, cog: Cog, callback: Callable[[Optional[int]], None]) -> None:
+        callbacks = self._subscribers[cog.qualified_name]
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    @instrumented
+    async def preload(self, guild_ids: list[int]) -> None:
+        """
+        Loads the configs of every cog for the given guilds with a single
+        streamed query, replacing any earlier snapshot.
+        Configs written or invalidated during the query are left out, as what
+        it read of them may be stale, and if the snapshot was released during
+        the query, the new one is not kept either.
+        """
+        guilds = frozenset(guild_ids)
+        snapshot = {}
+        releases = self._snapshot_releases
+        forgotten = self._preload_forgotten = set()
+        try:
+            async for key, value in self.store.scan():
+                try:
+                    guild_id, _ = self.split_cog_key(key)
+                except (IndexError, ValueError):
+                    continue
+                if guild_id in guilds:
+                    snapshot[key] = value
+        finally:
+            self._preload_forgotten = None
+        if releases != self._snapshot_releases:
+            return
+        for key in forgotten:
+            snapshot[key] = _MISSING
+        self._snapshot = snapshot
+        self._snapshot_guilds = guilds
+        self.logger.info(
+            "Preloaded %s cog configs for %s guilds", len(snapshot), len(guilds)
+        )
+
+    def release_snapshot(self) -> None:
+        """Drops what is left of the preloaded snapshot"""
+        self._snapshot = None
+        self._snapshot_guilds = frozenset()
+        self._snapshot_releases += 1
+
+    def _take_from_snapshot(self, key: str) -> Any:
+        """
+        Returns the preloaded value of a key (None if it had no row) and marks
+        it consumed, or _MISSING if the snapshot cannot answer for the key.
+        """
+        guild_id, _ = self.split_cog_key(key)
+        if guild_id not in self._snapshot_guilds:
+            return _MISSING
+        value = self._snapshot.get(key)
+        self._snapshot[key] = _MISSING
+        return value
+
+    def _forget_snapshot(self, key: str) -> None:
+        if self._snapshot is not None:
+            self._snapshot[key] = _MISSING
+        if self._preload_forgotten is not None:
+            self._preload_forgotten.add(key)
+
+    def _forget_cached(self, key: str) -> None:
+        """Drops the cached and preloaded copies of a key"""
+        if self.cache is not None:
+            self.cache.invalidate(key)
+        self._forget_snapshot(key)
+        self._cache_generation += 1
+
+    def invalidate(self, key: str) -> None:
+        """Drops a cog config key that was changed behind our back"""
+        self._forget_cached(key)
+        guild_id, cog_name = self.split_cog_key(key)
+        self.logger.debug("Config of %s for guild %s invalidated", cog_name, guild_id)
+        for callback in self._subscribers.get(cog_name, []):
+            callback(guild_id)
+
+    def invalidate_all(self) -> None:
+        """Drops every cached cog config, and the snapshot"""
+        self.release_snapshot()
+        self._invalidate_cache()
+
+    async def resync(self) -> None:
+        """
+        Invalidates every cached cog config, after changes may have been
+        missed. A snapshot is preloaded again rather than dropped, so that the
+        cogs still reload from a single query.
+        """
+        if self._snapshot is None:
+            self.invalidate_all()
+            return
+        await self.preload(list(self._snapshot_guilds))
+        self._invalidate_cache()
+
+    def _invalidate_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.clear()
+        self._cache_generation += 1
+        for callbacks in self._subscribers.values():
+            for callback in callbacks:
+                callback(None)
+
+    def _cache_set(self, key_value_map: dict[str, dict]) -> None:
+        for key in key_value_map:
+            self._forget_snapshot(key)
+        if self.cache is None:
+            return
+        for key, value in key_value_map.items():
+            self.cache.set(key, value)
+
+    def _cache_read(self, key_value_map: dict[str, dict], generation: int) -> None:
+        """
+        Caches what a read which started at the given cache generation
+        returned, unless something was dropped from the cache since
+        """
+        if generation == self._cache_generation:
+            self._cache_set(key_value_map)
+        else:
+            for key in key_value_map:
+                self._forget_snapshot(key)
+
+    @instrumented
+    async def add_to_cog_config_set(
+        self, cog: Cog, guild: disnake.Guild, field: str, member: Any
+    ):
+        """Add a member to a set field of a cog config, leaving the rest alone"""
+        await self._partial_update(
+            cog, guild, field, lambda key: self.store.add_to_set(key, field, member)
+        )
+
+    @instrumented
+    async def remove_from_cog_config_set(
+        self, cog: Cog, guild: disnake.Guild, field: str, member: Any
+    ):
+        """Remove a member from a set field of a cog config, leaving the rest alone"""
+        await self._partial_update(
+            cog,
+            guild,
+            field,
+            lambda key: self.store.remove_from_set(key, field, member),
+        )
+
+    @instrumented
+    async def set_cog_config_dict_entry(
+        self, cog: Cog, guild: disnake.Guild, field: str, entry_key: Any, value: Any
+    ):
+        """Set an entry of a dict field of a cog config, leaving the rest alone"""
+        await self._partial_update(
+            cog,
+            guild,
+            field,
+            lambda key: self.store.set_dict_entry(key, field, entry_key, value),
+        )
+
+    @instrumented
+    async def delete_cog_config_dict_entry(
+        self, cog: Cog, guild: disnake.Guild, field: str, entry_key: Any
+    ):
+        """Delete an entry of a dict field of a cog config, leaving the rest alone"""
+        await self._partial_update(
+            cog,
+            guild,
+            field,
+            lambda key: self.store.delete_dict_entry(key, field, entry_key),
+        )
+
+    async def _partial_update(
+        self,
+        cog: Cog,
+        guild: disnake.Guild,
+        field: str,
+        write: Callable[[str], Awaitable[None]],
+    ) -> None:
+        self.logger.info(
+            "updating %s of Cog %s config for guild %s (id: %s)",
+            field,
+            cog.qualified_name,
+            guild.name,
+            guild.id,
+        )
+        key = self.build_cog_key(guild.id, cog)
+        # A queued full write would otherwise land after, and undo, this update
+        if key in self._pending:
+            await self.flush()
+        try:
+            await write(key)
+        finally:
+            # only once the write committed, so that no read in between can
+            # cache the row from before it again
+            self._forget_cached(key)
+
+    @instrumented
+    async def flush(self) -> None:
+        """
+        Writes every queued config to the store.
+        Await this when a write-behind config has to be durable.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._flushing = len(pending)
+            try:
+                await self.store.batch_set(pending)
+            except Exception:
+                # Requeue whatever has not been superseded while we were writing
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+                raise
+            finally:
+                self._flushing = 0
+            self.logger.debug("Flushed %s queued configs", len(pending))
+
+    @property
+    def pending_count(self) -> int:
+        """Number of queued configs which are not written yet"""
+        return len(self._pending) + self._flushing
+
+    async def close(self) -> None:
+        """Performs a final flush of the queued configs"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_now.set()
+            await self._flush_task
+        await self.flush()
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+
+    async def _flush_pending_keys(self, predicate: Callable[[str], bool]) -> None:
+        """Flushes the queue if any queued key matches, before a range read"""
+        if any(predicate(key) for key in self._pending):
+            await self.flush()
+
+    def _queue_write(self, key: str, value: dict) -> None:
+        self._pending[key] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+        if len(self._pending) >= self.max_pending:
+            self._flush_now.set()
+
+    def _discard_pending(self, key_value_map: dict[str, dict]) -> None:
+        """Drops queued writes that are superseded by a direct write"""
+        for key in key_value_map:
+            self._pending.pop(key, None)
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._flush_now.clear()
+        try:
+            await self.flush()
+        except Exception:
+            self.logger.exception("Failed to flush queued configs, will retry")
+        if self._pending:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+
+class ConfigChangeListener:
+    """
+    Keeps a CogConfigStore coherent across processes sharing one Postgres
+    database.
+
+    Every write to cog_config_store fires a trigger that NOTIFYs the changed key
+    (see install_config_change_trigger). This LISTENs on a dedicated connection
+    and invalidates the changed keys, ignoring changes made through the
+    connections of our own engine. When the connection drops, the whole cache is
+    resynced once it is back, since notifications may have been missed.
+
+    Requires the psycopg driver.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        cog_config_store: CogConfigStore,
+        *,
+        logger: logging.Logger,
+        reconnect_delay: float = 5.0,
+    ):
+        self.engine = engine
+        self.cog_config_store = cog_config_store
+        self.logger = logger
+        self.reconnect_delay = reconnect_delay
+        self._own_backend_pids: set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        sqlalchemy.event.listen(engine.sync_engine, "connect", self._track_backend)
+        sqlalchemy.event.listen(engine.sync_engine, "close", self._untrack_backend)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _listen_forever(self) -> None:
+        import psycopg
+
+        url = self.engine.url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        )
+        connected_before = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    url, autocommit=True
+                ) as conn:
+                    await conn.execute(f"LISTEN {CONFIG_CHANGED_CHANNEL}")
+                    self.logger.info("Listening for config changes")
+                    if connected_before:
+                        # we may have missed changes while we were not listening
+                        await self.cog_config_store.resync()
+                    connected_before = True
+                    async for notify in conn.notifies():
+                        if notify.pid in self._own_backend_pids:
+                            continue
+                        self.cog_config_store.invalidate(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception(
+                    "Config change listener failed, reconnecting in %ss",
+                    self.reconnect_delay,
+                )
+                await asyncio.sleep(self.reconnect_delay)
+
+    @staticmethod
+    def _backend_pid(dbapi_connection) -> Optional[int]:
+        driver_connection = getattr(dbapi_connection, "driver_connection", None)
+        info = getattr(driver_connection, "info", None)
+        return getattr(info, "backend_pid", None)
+
+    def _track_backend(self, dbapi_connection, connection_record) -> None:
+        pid = self._backend_pid(dbapi_connection)
+        if pid is not None:
+            self._own_backend_pids.add(pid)
+
+    def _untrack_backend(self, dbapi_connection, connection_record) -> None:
+        self._own_backend_pids.discard(self._backend_pid(dbapi_connection))
+
+
+def _legacy_columns(sync_conn) -> Optional[set[str]]:
+    inspector = sqlalchemy.inspect(sync_conn)
+    if not inspector.has_table(json_config_store.name):
+        return None
+    return {column["name"] for column in inspector.get_columns(json_config_store.name)}
+
+
+async def _insert_missing_configs(conn: AsyncConnection, rows: list[dict]) -> int:
+    """Inserts the rows whose key is not in cog_config_store yet"""
+    dialect_name = conn.dialect.name
+    if dialect_name in _UPSERT_INSERTS:
+        result = await conn.execute(
+            _UPSERT_INSERTS[dialect_name](cog_config_store)
+            .values(rows)
+            .on_conflict_do_nothing(
+                index_elements=[cog_config_store.c.cog, cog_config_store.c.guild_id]
+            )
+            .returning(cog_config_store.c.cog)
+        )
+        return len(result.all())
+    result = await conn.execute(
+        sqlalchemy.select(cog_config_store.c.cog, cog_config_store.c.guild_id).where(
+            sqlalchemy.tuple_(cog_config_store.c.cog, cog_config_store.c.guild_id).in_(
+                [(row["cog"], row["guild_id"]) for row in rows]
+            )
+        )
+    )
+    existing = set(result.all())
+    missing = [row for row in rows if (row["cog"], row["guild_id"]) not in existing]
+    if missing:
+        await conn.execute(cog_config_store.insert().values(missing))
+    return len(missing)
+
+
+async def _migration_completed(conn: AsyncConnection, name: str) -> bool:
+    result = await conn.execute(
+        sqlalchemy.select(schema_migrations.c.name).where(
+            schema_migrations.c.name == name
+        )
+    )
+    return result.first() is not None
+
+
+async def _record_migration(conn: AsyncConnection, name: str) -> None:
+    dialect_name = conn.dialect.name
+    if dialect_name in _UPSERT_INSERTS:
+        # another process may have finished the same migration meanwhile
+        await conn.execute(
+            _UPSERT_INSERTS[dialect_name](schema_migrations)
+            .values(name=name)
+            .on_conflict_do_nothing(index_elements=[schema_migrations.c.name])
+        )
+    elif not await _migration_completed(conn, name):
+        await conn.execute(schema_migrations.insert().values(name=name))
+
+
+async def migrate_json_config_store(
+    engine: AsyncEngine, *, batch_size: int = SCAN_BATCH_SIZE
+) -> int:
+    """
+    Copies the configs of the legacy json_config_store table into
+    cog_config_store, keeping their versions.
+
+    Rows are copied batch_size at a time in key order, each batch in its own
+    transaction, so no lock is held for long and the bot can run while a large
+    table is migrated. Configs which are in cog_config_store already are newer
+    and kept. Keys which are not config keys are skipped.
+    The migration runs once: it is recorded in schema_migrations once every
+    batch is copied, and later runs do nothing. Otherwise configs deleted from
+    cog_config_store would come back from the legacy table, which is left as
+    it is.
+    :return: The number of configs copied
+    """
+    async with engine.connect() as conn:
+        columns = await conn.run_sync(_legacy_columns)
+        if columns is None or await _migration_completed(
+            conn, JSON_CONFIG_STORE_MIGRATION
+        ):
+            return 0
+    # tables created before versions were added start at version 0
+    version = (
+        json_config_store.c.version
+        if "version" in columns
+        else sqlalchemy.literal(0, sqlalchemy.BigInteger)
+    )
+    copied = 0
+    last_key: Optional[str] = None
+    while True:
+        async with engine.begin() as conn:
+            query = (
+                sqlalchemy.select(
+                    json_config_store.c.id, json_config_store.c.data, version
+                )
+                .order_by(json_config_store.c.id)
+                .limit(batch_size)
+            )
+            if last_key is not None:
+                query = query.where(json_config_store.c.id > last_key)
+            batch = (await conn.execute(query)).all()
+            if not batch:
+                await _record_migration(conn, JSON_CONFIG_STORE_MIGRATION)
+                return copied
+            last_key = batch[-1][0]
+            rows = []
+            for key, data, row_version in batch:
+                try:
+                    guild_id, cog_name = split_config_key(key)
+                except ValueError:
+                    continue
+                rows.append(
+                    dict(
+                        guild_id=guild_id, cog=cog_name, data=data, version=row_version
+                    )
+                )
+            if rows:
+                copied += await _insert_missing_configs(conn, rows)
+
+
+async def install_config_change_trigger(conn: AsyncConnection) -> None:
+    """
+    Installs the trigger that NOTIFYs CONFIG_CHANGED_CHANNEL with the key of
+    every cog_config_store row that is inserted, updated or deleted.
+    Postgres only. Safe to run on every startup.
+    """
+    await conn.execute(
+        sqlalchemy.text(
+            f"""
+            CREATE OR REPLACE FUNCTION notify_cog_config_store_changed()
+            RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify(
+                    '{CONFIG_CHANGED_CHANNEL}',
+                    CASE
+                        WHEN TG_OP = 'DELETE'
+                        THEN CAST(OLD.guild_id AS text) || '.' || OLD.cog
+                        ELSE CAST(NEW.guild_id AS text) || '.' || NEW.cog
+                    END
+                );
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+    )
+    await conn.execute(
+        sqlalchemy.text(
+            "DROP TRIGGER IF EXISTS cog_config_store_changed ON cog_config_store"
+        )
+    )
+    await conn.execute(
+        sqlalchemy.text(
+            """
+            CREATE TRIGGER cog_config_store_changed
+            AFTER INSERT OR UPDATE OR DELETE ON cog_config_store
+            FOR EACH ROW EXECUTE FUNCTION notify_cog_config_store_changed()
+            """
+        )
+    )
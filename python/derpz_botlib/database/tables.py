@@ -2,9 +2,57 @@ import sqlalchemy
 from derpz_botlib.database.db import SqlAlchemyBase
 from sqlalchemy.dialects import postgresql
 
+cog_config_store = sqlalchemy.Table(
+    "cog_config_store",
+    SqlAlchemyBase.metadata,
+    sqlalchemy.Column("guild_id", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("cog", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column(
+        "data", sqlalchemy.JSON().with_variant(postgresql.JSONB(), "postgresql")
+    ),
+    # Bumped on every write, for compare-and-swap updates
+    sqlalchemy.Column(
+        "version", sqlalchemy.BigInteger, nullable=False, server_default="0"
+    ),
+    sqlalchemy.Column(
+        "updated_at",
+        sqlalchemy.DateTime(timezone=True),
+        nullable=False,
+        server_default=sqlalchemy.func.now(),
+    ),
+    # Every config of a cog is a range of the primary key,
+    # every config of a guild is a range of the guild_id index
+    sqlalchemy.PrimaryKeyConstraint("cog", "guild_id"),
+    sqlalchemy.Index("ix_cog_config_store_guild_id", "guild_id"),
+)
+
+# One row per data migration which ran to completion, so that it is not run again
+schema_migrations = sqlalchemy.Table(
+    "schema_migrations",
+    SqlAlchemyBase.metadata,
+    sqlalchemy.Column("name", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column(
+        "completed_at",
+        sqlalchemy.DateTime(timezone=True),
+        nullable=False,
+        server_default=sqlalchemy.func.now(),
+    ),
+)
+
+# The layout before cog_config_store, keyed by "<guild_id>.<cog>" strings.
+# It is not created anymore, only read by migrate_json_config_store, and left in
+# place so that older releases still find their data.
+legacy_metadata = sqlalchemy.MetaData()
+
 json_config_store = sqlalchemy.Table(
     "json_config_store",
-    SqlAlchemyBase.metadata,
+    legacy_metadata,
     sqlalchemy.Column("id", sqlalchemy.String, primary_key=True),
-    sqlalchemy.Column("data", postgresql.JSONB),
+    sqlalchemy.Column(
+        "data", sqlalchemy.JSON().with_variant(postgresql.JSONB(), "postgresql")
+    ),
+    # Bumped on every write, for compare-and-swap updates
+    sqlalchemy.Column(
+        "version", sqlalchemy.BigInteger, nullable=False, server_default="0"
+    ),
 )
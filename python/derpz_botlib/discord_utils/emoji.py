@@ -0,0 +1,40 @@
+from typing import Optional, Union
+
+import disnake
+
+ResolvedEmoji = Union[disnake.Emoji, disnake.PartialEmoji]
+
+
+class EmojiResolver:
+    """
+    Resolves stored custom emoji ids to emojis which can be reacted with,
+    without fetching them over REST.
+
+    The emoji comes from the gateway's emoji cache when the bot has it, or is
+    otherwise a PartialEmoji built from the id: reacting only needs the id.
+    Resolved emojis are cached per guild, until the guild's emojis change.
+    """
+
+    def __init__(self, bot: disnake.Client):
+        self.bot = bot
+        self._emojis: dict[int, dict[int, ResolvedEmoji]] = {}
+
+    def resolve(self, guild_id: int, emoji_id: int) -> ResolvedEmoji:
+        emojis = self._emojis.get(guild_id)
+        if emojis is None:
+            emojis = self._emojis[guild_id] = {}
+        emoji = emojis.get(emoji_id)
+        if emoji is None:
+            emoji = self.bot.get_emoji(emoji_id)
+            if emoji is None:
+                # the name is not part of what identifies a custom emoji
+                emoji = disnake.PartialEmoji(name="_", id=emoji_id)
+            emojis[emoji_id] = emoji
+        return emoji
+
+    def invalidate(self, guild_id: int, emoji_id: Optional[int] = None) -> None:
+        """Forgets the resolved emojis of a guild, or only one of them"""
+        if emoji_id is None:
+            self._emojis.pop(guild_id, None)
+        else:
+            self._emojis.get(guild_id, {}).pop(emoji_id, None)
@@ -0,0 +1,52 @@
+from typing import Union
+
+import disnake
+
+Reactable = Union[disnake.Message, disnake.PartialMessage]
+
+# The 400s a reaction made through a PartialMessage may get, which the fetched
+# message could avoid: an invalid form body, or an error without a JSON code.
+# Others, like Unknown Emoji (10014) or Maximum Reactions (30010), would only
+# be hit again.
+REFETCH_ERROR_CODES = frozenset({0, 50035})
+
+
+def message_by_id(
+    client: disnake.Client, channel: disnake.TextChannel, message_id: int
+) -> Reactable:
+    """
+    The message from the client's cache of the messages it saw lately, or a
+    PartialMessage made of the ids, without fetching anything
+    """
+    message = client.get_message(message_id)
+    if message is None:
+        message = channel.get_partial_message(message_id)
+    return message
+
+
+async def add_reaction_by_id(
+    client: disnake.Client,
+    channel: disnake.TextChannel,
+    message_id: int,
+    emoji: Union[disnake.Emoji, disnake.PartialEmoji, str],
+) -> Reactable:
+    """
+    Reacts to a message by its id: reacting only needs the channel and
+    message ids, so the message is not fetched first.
+    Only if Discord rejects the reaction as an invalid request (a 400 with one
+    of REFETCH_ERROR_CODES), the message is fetched and reacted to once more.
+    :return: The message which was reacted to
+    """
+    message = message_by_id(client, channel, message_id)
+    try:
+        await message.add_reaction(emoji)
+    except disnake.HTTPException as e:
+        if (
+            e.status != 400
+            or e.code not in REFETCH_ERROR_CODES
+            or isinstance(message, disnake.Message)
+        ):
+            raise
+        message = await channel.fetch_message(message_id)
+        await message.add_reaction(emoji)
+    return message
@@ -0,0 +1,85 @@
+"""
+Deferred imports of heavy dependencies.
+
+    dateparser = lazy_import("dateparser")
+
+binds a stand-in for the module, which imports it on first attribute access,
+i.e. the first time a command uses it. warm_lazy_imports() imports all of them
+in a thread, so that a bot can pay for them after it is ready instead of
+before.
+"""
+import asyncio
+import importlib
+import logging
+import threading
+import types
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule(types.ModuleType):
+    """A module which is only imported once one of its attributes is used"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self) -> types.ModuleType:
+        with self._lock:
+            if self._module is None:
+                self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return self._module
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes the stand-in does not have itself
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.is_loaded else "not loaded yet"
+        return f"<lazy module {self.__name__!r}, {state}>"
+
+
+_lazy_modules: dict[str, LazyModule] = {}
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Returns a stand-in for the module, which imports it on first use.
+    Every call with the same name returns the same stand-in.
+    """
+    module = _lazy_modules.get(name)
+    if module is None:
+        module = _lazy_modules[name] = LazyModule(name)
+    return module
+
+
+async def warm_lazy_imports(names: Optional[list[str]] = None) -> dict[str, float]:
+    """
+    Imports the lazy modules which were not used yet, one after another in a
+    thread of their own. Defaults to every lazy module.
+    Modules which fail to import are logged and skipped; using them raises.
+    :return: How long each import took, in seconds
+    """
+    loop = asyncio.get_running_loop()
+    timings = {}
+    for name in names or list(_lazy_modules):
+        module = lazy_import(name)
+        if module.is_loaded:
+            continue
+        start = loop.time()
+        try:
+            await loop.run_in_executor(None, module._load)
+        except Exception:
+            logger.exception("Failed to import %s in the background", name)
+            continue
+        timings[name] = loop.time() - start
+    return timings
@@ -0,0 +1,185 @@
+"""
+A sampling profiler of event listeners.
+
+Every listener call is counted and timed by derpz_botlib.command_metrics. On
+top of that, the profiler drives a sample of the calls step by step, to split
+their duration into the time they ran on the event loop (blocking every other
+listener meanwhile) and the time they spent awaiting I/O. Calls which were
+sampled, or took longer than slow_seconds, are kept with the guild and
+channel they were about, and the slowest ones are listed by report().
+"""
+import dataclasses
+import heapq
+import random
+import time
+from collections import deque
+from typing import Any, Coroutine, Optional
+
+import disnake
+from derpz_botlib.command_metrics import BoundCommandMetrics, CommandMetrics
+from derpz_botlib.metrics import LabelValues
+
+
+class SteppedCoroutine:
+    """
+    Awaits a coroutine, adding up how long each of its steps ran for.
+    What is left of the time it took was spent awaiting.
+    """
+
+    __slots__ = ("coro", "loop_seconds")
+
+    def __init__(self, coro: Coroutine):
+        self.coro = coro
+        self.loop_seconds = 0.0
+
+    def __await__(self):
+        coro = self.coro
+        value, error = None, None
+        while True:
+            start = time.perf_counter()
+            try:
+                if error is None:
+                    future = coro.send(value)
+                else:
+                    future = coro.throw(error)
+            except StopIteration as e:
+                self.loop_seconds += time.perf_counter() - start
+                return e.value
+            except BaseException:
+                self.loop_seconds += time.perf_counter() - start
+                raise
+            self.loop_seconds += time.perf_counter() - start
+            try:
+                value, error = (yield future), None
+            except BaseException as e:
+                # e.g. the task was cancelled while the coroutine awaited
+                value, error = None, e
+
+
+@dataclasses.dataclass
+class ListenerCall:
+    """A listener call which was sampled or slow"""
+
+    listener: str
+    event: str
+    # time.time() when the call finished
+    finished: float
+    seconds: float
+    # None when the call was not sampled, only slow
+    loop_seconds: Optional[float]
+    guild_id: Optional[int]
+    channel_id: Optional[int]
+
+
+def event_context(args: tuple) -> tuple[Optional[int], Optional[int]]:
+    """The guild and channel ids of an event, from its arguments"""
+    for arg in args:
+        if isinstance(arg, disnake.Guild):
+            return arg.id, None
+        # raw events have the ids, the others the objects
+        guild_id = getattr(arg, "guild_id", None)
+        if guild_id is None:
+            guild_id = getattr(getattr(arg, "guild", None), "id", None)
+        channel_id = getattr(arg, "channel_id", None)
+        if channel_id is None:
+            channel_id = getattr(getattr(arg, "channel", None), "id", None)
+        if guild_id is not None or channel_id is not None:
+            return guild_id, channel_id
+    return None, None
+
+
+class ListenerProfiler:
+    """
+    Samples sample_rate of the listener calls, and keeps the last
+    keep_calls sampled or slow calls.
+    """
+
+    def __init__(
+        self,
+        command_metrics: CommandMetrics,
+        sample_rate: float = 0.01,
+        slow_seconds: float = 0.25,
+        keep_calls: int = 500,
+    ):
+        self.command_metrics = command_metrics
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.recent_calls: deque[ListenerCall] = deque(maxlen=keep_calls)
+        # (sampled calls, seconds, seconds on the loop) by listener and event
+        self._sampled: dict[LabelValues, list] = {}
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(
+        self,
+        metrics: BoundCommandMetrics,
+        seconds: float,
+        loop_seconds: Optional[float],
+        args: tuple,
+    ) -> None:
+        """Records a call which was sampled (with loop_seconds) or slow"""
+        labels = metrics.latency.labelvalues
+        if loop_seconds is not None:
+            sampled = self._sampled.get(labels)
+            if sampled is None:
+                sampled = self._sampled[labels] = [0, 0.0, 0.0]
+            sampled[0] += 1
+            sampled[1] += seconds
+            sampled[2] += loop_seconds
+        guild_id, channel_id = event_context(args)
+        self.recent_calls.append(
+            ListenerCall(
+                *labels, time.time(), seconds, loop_seconds, guild_id, channel_id
+            )
+        )
+
+    def slowest_calls(self, count: int = 10, prefix: str = "") -> list[ListenerCall]:
+        return heapq.nlargest(
+            count,
+            (call for call in self.recent_calls if call.listener.startswith(prefix)),
+            key=lambda call: call.seconds,
+        )
+
+    def report(self, prefix: str = "", count: int = 10) -> str:
+        """
+        Renders, for the listeners whose name starts with prefix, their call
+        counts and latencies, how their sampled calls split into running on
+        the loop and awaiting, and their slowest recent calls
+        """
+        lines = []
+        latency = self.command_metrics.listener_latency
+        by_count = sorted(latency.items(), key=lambda item: -item[1].count)
+        for labels, histogram in by_count:
+            listener, event = labels
+            if not listener.startswith(prefix):
+                continue
+            line = (
+                f"{listener} ({event}) n={histogram.count} "
+                f"p50={histogram.quantile(0.5) * 1000:.2f}ms "
+                f"p99={histogram.quantile(0.99) * 1000:.2f}ms"
+            )
+            sampled = self._sampled.get(labels)
+            if sampled is not None:
+                calls, seconds, loop_seconds = sampled
+                line += (
+                    f" | {calls} sampled: mean {seconds / calls * 1000:.2f}ms, "
+                    f"{loop_seconds / calls * 1000:.2f}ms on the loop, "
+                    f"{(seconds - loop_seconds) / calls * 1000:.2f}ms awaiting"
+                )
+            lines.append(line)
+        slowest = self.slowest_calls(count, prefix)
+        if slowest:
+            lines.append("")
+            lines.append("Slowest recent calls:")
+        now = time.time()
+        for call in slowest:
+            line = (
+                f"{call.seconds * 1000:.1f}ms {call.listener} "
+                f"guild={call.guild_id} channel={call.channel_id} "
+                f"{now - call.finished:.0f}s ago"
+            )
+            if call.loop_seconds is not None:
+                line += f" ({call.loop_seconds * 1000:.1f}ms on the loop)"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,369 @@
+"""
+A small in-process metrics registry.
+
+Counters, gauges and histograms are kept in memory, labelled with plain strings.
+The registry can be rendered in the Prometheus text exposition format, or as a
+short human-readable summary for chat commands. serve_prometheus() serves it
+over HTTP for Prometheus to scrape.
+"""
+import bisect
+import math
+import threading
+from typing import Callable, Iterator, Optional, Union
+
+# Buckets (in seconds) suited to database and command latencies
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: LabelValues) -> str:
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, labelvalues):
+        escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """Base class of every metric. Values are kept per combination of labels"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def bind(self, **labels: str) -> "BoundMetric":
+        """
+        The metric with its labels filled in. Recording through it skips the
+        label handling, for hot paths which record the same labels over and
+        over
+        """
+        return BoundMetric(self, self._label_values(labels))
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        """Yields (sample name suffix, label values, value) for every sample"""
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labelvalues, value in self.samples():
+            labelnames = self.labelnames
+            if suffix == "_bucket":
+                labelnames = labelnames + ("le",)
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(labelnames, labelvalues)} "
+                f"{_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    """A value which only goes up"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._inc(self._label_values(labels), amount)
+
+    def _inc(self, key: LabelValues, amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self):
+        for labelvalues, value in sorted(self._values.items()):
+            yield "_total", labelvalues, value
+
+
+class Gauge(Metric):
+    """
+    A value which goes up and down.
+    A gauge made with a callback reads its value when it is collected.
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        callback: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        if callback is not None and self.labelnames:
+            raise ValueError("Gauges with a callback cannot have labels")
+        self._values: dict[LabelValues, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._inc(self._label_values(labels), amount)
+
+    def _inc(self, key: LabelValues, amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        if self._callback is not None:
+            return self._callback()
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self):
+        if self._callback is not None:
+            yield "", (), self._callback()
+            return
+        for labelvalues, value in sorted(self._values.items()):
+            yield "", labelvalues, value
+
+
+class HistogramValue:
+    """The observations of a histogram for one combination of labels"""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating within its bucket"""
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Histogram(Metric):
+    """Counts observations, e.g. latencies, into buckets"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[LabelValues, HistogramValue] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        self._observe(self._label_values(labels), value)
+
+    def _observe(self, key: LabelValues, value: float) -> None:
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = HistogramValue(self.buckets)
+            histogram.observe(value)
+
+    def get(self, **labels: str) -> Optional[HistogramValue]:
+        return self._values.get(self._label_values(labels))
+
+    def items(self) -> list[tuple[LabelValues, HistogramValue]]:
+        return sorted(self._values.items())
+
+    def samples(self):
+        for labelvalues, histogram in self.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), histogram.counts):
+                cumulative += count
+                yield "_bucket", labelvalues + (_format_value(bound),), cumulative
+            yield "_sum", labelvalues, histogram.sum
+            yield "_count", labelvalues, histogram.count
+
+
+AnyMetric = Union[Counter, Gauge, Histogram]
+
+
+class BoundMetric:
+    """A metric with its labels filled in, see Metric.bind()"""
+
+    __slots__ = ("metric", "labelvalues")
+
+    def __init__(self, metric: AnyMetric, labelvalues: LabelValues):
+        self.metric = metric
+        self.labelvalues = labelvalues
+
+    def inc(self, amount: float = 1) -> None:
+        self.metric._inc(self.labelvalues, amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.metric._inc(self.labelvalues, -amount)
+
+    def observe(self, value: float) -> None:
+        self.metric._observe(self.labelvalues, value)
+
+
+class MetricsRegistry:
+    """
+    Holds metrics by name.
+    counter(), gauge() and histogram() return the existing metric when one with
+    the same name was registered already, so they can be called from anywhere.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, AnyMetric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(
+                    f"{name} is already registered as a {metric.type_name}"
+                )
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        callback: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames, callback)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def get(self, name: str) -> Optional[AnyMetric]:
+        return self._metrics.get(name)
+
+    def unregister(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def __iter__(self) -> Iterator[AnyMetric]:
+        return iter(list(self._metrics.values()))
+
+    def render_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in sorted(self, key=lambda metric: metric.name):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self, prefix: str = "") -> str:
+        """
+        Renders the metrics whose name starts with prefix for humans.
+        Histograms are summarised by their count, mean and estimated p50/p99.
+        """
+        lines = []
+        for metric in sorted(self, key=lambda metric: metric.name):
+            if not metric.name.startswith(prefix):
+                continue
+            if isinstance(metric, Histogram):
+                for labelvalues, histogram in metric.items():
+                    labels = _format_labels(metric.labelnames, labelvalues)
+                    lines.append(
+                        f"{metric.name}{labels} n={histogram.count} "
+                        f"mean={histogram.sum / histogram.count * 1000:.2f}ms "
+                        f"p50={histogram.quantile(0.5) * 1000:.2f}ms "
+                        f"p99={histogram.quantile(0.99) * 1000:.2f}ms"
+                    )
+                continue
+            for suffix, labelvalues, value in metric.samples():
+                labels = _format_labels(metric.labelnames, labelvalues)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+async def serve_prometheus(registry: MetricsRegistry, host: str, port: int):
+    """
+    Serves the registry in the Prometheus text format on
+    http://host:port/metrics. Returns the runner; await its cleanup() to stop.
+    """
+    from aiohttp import web
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render_prometheus().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
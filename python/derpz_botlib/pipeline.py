@@ -0,0 +1,75 @@
+"""
+Bounded concurrent processing which keeps the order of related work.
+
+    pipeline = KeyedPipeline(concurrency=8)
+    async for request in requests:
+        await pipeline.submit(request.channel_id, lambda: handle(request))
+
+runs up to 8 handlers at a time, but those submitted with the same key one
+after another, in the order they were submitted. submit() waits while
+max_pending handlers are queued or running, so a burst cannot pile up
+unbounded work.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedPipeline:
+    def __init__(self, concurrency: int = 8, max_pending: Optional[int] = None):
+        self.concurrency = concurrency
+        self.max_pending = max_pending or concurrency * 4
+        self._running = asyncio.Semaphore(concurrency)
+        self._pending = asyncio.Semaphore(self.max_pending)
+        # the last task submitted with each key, which the next one waits for
+        self._last_by_key: dict[Hashable, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """How many handlers are queued or running"""
+        return len(self._tasks)
+
+    async def submit(
+        self, key: Optional[Hashable], handler: Callable[[], Awaitable]
+    ) -> asyncio.Task:
+        """
+        Schedules handler() after the handlers submitted with the same key
+        finished, or right away if key is None.
+        Exceptions of the handler are logged.
+        """
+        await self._pending.acquire()
+        previous = None if key is None else self._last_by_key.get(key)
+        task = asyncio.create_task(self._run(key, previous, handler))
+        if key is not None:
+            self._last_by_key[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(
+        self,
+        key: Optional[Hashable],
+        previous: Optional[asyncio.Task],
+        handler: Callable[[], Awaitable],
+    ) -> None:
+        try:
+            if previous is not None:
+                # without raising what it raised
+                await asyncio.wait([previous])
+            async with self._running:
+                await handler()
+        except Exception:
+            logger.exception("Handler for %s failed", key)
+        finally:
+            self._pending.release()
+            self._tasks.discard(asyncio.current_task())
+            if key is not None and self._last_by_key.get(key) is asyncio.current_task():
+                del self._last_by_key[key]
+
+    async def join(self) -> None:
+        """Waits for every handler submitted so far"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
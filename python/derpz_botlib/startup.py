@@ -0,0 +1,122 @@
+"""
+Runs the async initialisation (cog_load) of many cogs at once.
+
+disnake starts the cog_load of every cog in a task of its own as soon as the cog
+is added, without a timeout and without anyone waiting for it. run_cog_loads
+runs them instead: concurrently, each within a timeout, and only once the cogs
+it depends on finished loading. A cog lists those by name in cog_load_after.
+"""
+import asyncio
+import dataclasses
+import logging
+import time
+from typing import Collection, Optional
+
+from disnake.ext import commands
+
+# Seconds a cog_load may take, unless the cog sets cog_load_timeout
+DEFAULT_COG_LOAD_TIMEOUT = 30.0
+
+
+@dataclasses.dataclass
+class CogLoadReport:
+    """
+    How long the cog_load of each cog took, in seconds, and why the others
+    failed. Extensions which failed to import are reported by extension name.
+    """
+
+    loaded: dict[str, float] = dataclasses.field(default_factory=dict)
+    failed: dict[str, str] = dataclasses.field(default_factory=dict)
+    seconds: float = 0.0
+
+
+def overrides_cog_load(cog: commands.Cog) -> bool:
+    """Whether disnake would run a cog_load for the cog"""
+    return not hasattr(cog.cog_load.__func__, "__cog_special_method__")
+
+
+def _dependencies(cog: commands.Cog) -> tuple[str, ...]:
+    return tuple(getattr(cog, "cog_load_after", ()))
+
+
+def _unloadable(cogs: dict[str, commands.Cog], loaded: Collection[str]) -> dict:
+    """
+    The cogs which cannot be loaded, because they depend on a cog which is
+    missing or on a cycle, with the reason
+    """
+    failed = {}
+    for name, cog in cogs.items():
+        missing = [
+            dependency
+            for dependency in _dependencies(cog)
+            if dependency not in cogs and dependency not in loaded
+        ]
+        if missing:
+            failed[name] = f"missing dependencies {missing}"
+    # whatever cannot be ordered after its dependencies is on, or behind, a cycle
+    ordered = set(loaded)
+    remaining = {name for name in cogs if name not in failed}
+    progress = True
+    while remaining and progress:
+        progress = False
+        for name in list(remaining):
+            if all(dependency in ordered for dependency in _dependencies(cogs[name])):
+                ordered.add(name)
+                remaining.discard(name)
+                progress = True
+    for name in remaining:
+        failed[name] = "dependency cycle"
+    return failed
+
+
+async def run_cog_loads(
+    cogs: list[commands.Cog],
+    *,
+    loaded: Collection[str] = (),
+    timeout: float = DEFAULT_COG_LOAD_TIMEOUT,
+    logger: Optional[logging.Logger] = None,
+) -> CogLoadReport:
+    """
+    Runs the cog_load of every cog concurrently.
+    A cog_load starts once the cog_load of every cog in its cog_load_after
+    finished, and is cancelled after its timeout. Dependencies may also be
+    cogs which were loaded before, named in loaded. Cogs whose dependencies
+    failed, are missing or form a cycle are not loaded at all.
+    Failures are logged and reported, they are not raised.
+    """
+    logger = logger or logging.getLogger(__name__)
+    report = CogLoadReport()
+    start = time.perf_counter()
+    cogs_by_name = {cog.qualified_name: cog for cog in cogs}
+    report.failed.update(_unloadable(cogs_by_name, loaded))
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def load(name: str, cog: commands.Cog) -> bool:
+        if name in report.failed:
+            return False
+        for dependency in _dependencies(cog):
+            if dependency in tasks and not await tasks[dependency]:
+                report.failed[name] = f"dependency {dependency} failed"
+                return False
+        cog_timeout = getattr(cog, "cog_load_timeout", None) or timeout
+        cog_start = time.perf_counter()
+        try:
+            await asyncio.wait_for(cog.cog_load(), cog_timeout)
+        except asyncio.TimeoutError:
+            logger.error("cog_load of %s timed out after %ss", name, cog_timeout)
+            report.failed[name] = f"timed out after {cog_timeout}s"
+            return False
+        except Exception as e:
+            logger.exception("cog_load of %s failed", name, exc_info=e)
+            report.failed[name] = repr(e)
+            return False
+        report.loaded[name] = time.perf_counter() - cog_start
+        return True
+
+    # every task exists before any of them runs, so they can await each other
+    for name, cog in cogs_by_name.items():
+        tasks[name] = asyncio.create_task(load(name, cog))
+    if tasks:
+        await asyncio.gather(*tasks.values())
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,392 @@
+"""
+A work queue on top of Redis Streams consumer groups.
+
+Producers append payloads to a stream. Consumers read them through a consumer
+group and ack each one once it is done. Entries which are read but never
+acked, e.g. because the consumer died or the work failed, stay pending in the
+group and are handed out again by reclaim() once they have been idle for long
+enough. An entry which was delivered max_deliveries times without being acked
+is given up on.
+
+How entries spread over the consumers depends on the fan out:
+
+- FanOut.ONCE: all consumers share one group, so each entry goes to one of
+  them, and any of them can reclaim what a dead one left pending.
+- FanOut.BROADCAST: every consumer has a group of its own, so each entry goes
+  to all of them. A consumer which restarts under the same name picks up where
+  it left off.
+
+InMemoryWorkQueue implements the same semantics on top of InMemoryStreams, for
+tests.
+"""
+import abc
+import asyncio
+import dataclasses
+import enum
+import itertools
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+from derpz_botlib.lazy import lazy_import
+
+redis_asyncio = lazy_import("redis.asyncio")
+
+logger = logging.getLogger(__name__)
+
+# The field of the stream entries which holds the payload
+PAYLOAD_FIELD = "payload"
+
+
+class FanOut(str, enum.Enum):
+    # every consumer gets every entry
+    BROADCAST = "broadcast"
+    # every entry goes to exactly one consumer
+    ONCE = "once"
+
+
+@dataclasses.dataclass
+class WorkItem:
+    id: str
+    payload: str
+    # how many times the entry was delivered, counting this time
+    deliveries: int = 1
+
+
+class WorkQueue(abc.ABC):
+    """
+    A stream of payloads, read through a consumer group.
+    A queue without a consumer name can only publish.
+    """
+
+    def __init__(
+        self,
+        stream: str,
+        consumer: Optional[str] = None,
+        *,
+        fan_out: FanOut = FanOut.ONCE,
+        group: str = "workers",
+        max_deliveries: int = 5,
+        max_len: int = 10_000,
+    ):
+        self.stream = stream
+        self.consumer = consumer
+        self.fan_out = FanOut(fan_out)
+        self.max_deliveries = max_deliveries
+        # the stream is trimmed to about this many entries
+        self.max_len = max_len
+        if self.fan_out is FanOut.BROADCAST and consumer is not None:
+            self.group = f"{group}:{consumer}"
+        else:
+            self.group = group
+
+    def _check_consumer(self) -> str:
+        if self.consumer is None:
+            raise ValueError("A consumer name is needed to read from the queue")
+        return self.consumer
+
+    @abc.abstractmethod
+    async def publish(self, payload: str) -> str:
+        """Appends a payload to the stream and returns the id of its entry"""
+        ...
+
+    @abc.abstractmethod
+    async def read(self, count: int = 10, block_seconds: float = 1.0) -> list[WorkItem]:
+        """
+        Reads up to count entries which were not delivered to the group yet,
+        waiting up to block_seconds for the first one
+        """
+        ...
+
+    @abc.abstractmethod
+    async def ack(self, *ids: str) -> None:
+        """Marks entries as done"""
+        ...
+
+    @abc.abstractmethod
+    async def _idle_pending(
+        self, min_idle_seconds: float, count: int
+    ) -> list[tuple[str, int]]:
+        """The ids and delivery counts of pending entries idle for long enough"""
+        ...
+
+    @abc.abstractmethod
+    async def _claim(self, min_idle_seconds: float, ids: list[str]) -> list[WorkItem]:
+        """
+        Takes pending entries over, unless they were delivered again in the
+        meantime, and returns those which are still in the stream
+        """
+        ...
+
+    async def reclaim(self, min_idle_seconds: float, count: int = 10) -> list[WorkItem]:
+        """
+        Takes over up to count entries which were delivered, to any consumer
+        of the group, but not acked for min_idle_seconds.
+        Entries which were already delivered max_deliveries times are acked
+        and logged instead.
+        """
+        self._check_consumer()
+        claim, give_up = {}, []
+        for entry_id, deliveries in await self._idle_pending(min_idle_seconds, count):
+            if deliveries >= self.max_deliveries:
+                give_up.append(entry_id)
+            else:
+                claim[entry_id] = deliveries
+        if give_up:
+            logger.error(
+                "Giving up on %s from %s after %s deliveries",
+                give_up,
+                self.stream,
+                self.max_deliveries,
+            )
+            await self.ack(*give_up)
+        if not claim:
+            return []
+        items = await self._claim(min_idle_seconds, list(claim))
+        for item in items:
+            item.deliveries = claim[item.id] + 1
+        return items
+
+    async def consume(
+        self, reclaim_idle_seconds: float, count: int = 10
+    ) -> AsyncIterator[WorkItem]:
+        """
+        Yields entries as they are published, blocking on the stream in
+        between, and what is left pending for reclaim_idle_seconds, which is
+        reclaimed every reclaim_idle_seconds / 2.
+        An idle consumer wakes up once per reclaim.
+        """
+        loop = asyncio.get_running_loop()
+        next_reclaim = loop.time()
+        while True:
+            if loop.time() >= next_reclaim:
+                for item in await self.reclaim(reclaim_idle_seconds, count):
+                    yield item
+                next_reclaim = loop.time() + reclaim_idle_seconds / 2
+            block_seconds = next_reclaim - loop.time()
+            for item in await self.read(count, max(block_seconds, 0.001)):
+                yield item
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisWorkQueue(WorkQueue):
+    """
+    A WorkQueue on a Redis stream. Needs Redis 6.2 or later.
+    The client must decode responses.
+    """
+
+    def __init__(self, redis: "redis_asyncio.Redis", stream: str, *args, **kwargs):
+        super().__init__(stream, *args, **kwargs)
+        self.redis = redis
+        self._group_created = False
+
+    @classmethod
+    def from_url(cls, url: str, stream: str, *args, **kwargs) -> "RedisWorkQueue":
+        return cls(
+            redis_asyncio.from_url(url, decode_responses=True), stream, *args, **kwargs
+        )
+
+    async def _create_group(self) -> None:
+        if self._group_created:
+            return
+        try:
+            # the group only gets the entries published from now on
+            await self.redis.xgroup_create(self.stream, self.group, "$", mkstream=True)
+        except redis_asyncio.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_created = True
+
+    async def publish(self, payload: str) -> str:
+        return await self.redis.xadd(
+            self.stream, {PAYLOAD_FIELD: payload}, maxlen=self.max_len
+        )
+
+    async def read(self, count: int = 10, block_seconds: float = 1.0) -> list[WorkItem]:
+        consumer = self._check_consumer()
+        await self._create_group()
+        try:
+            response = await self.redis.xreadgroup(
+                self.group,
+                consumer,
+                {self.stream: ">"},
+                count=count,
+                block=max(int(block_seconds * 1000), 1),
+            )
+        except redis_asyncio.ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            # the stream was deleted, e.g. Redis restarted without persistence
+            self._group_created = False
+            return []
+        items = []
+        for _, entries in response or ():
+            for entry_id, fields in entries:
+                items.append(WorkItem(entry_id, fields.get(PAYLOAD_FIELD, "")))
+        return items
+
+    async def ack(self, *ids: str) -> None:
+        if ids:
+            await self.redis.xack(self.stream, self.group, *ids)
+
+    async def _idle_pending(
+        self, min_idle_seconds: float, count: int
+    ) -> list[tuple[str, int]]:
+        await self._create_group()
+        pending = await self.redis.xpending_range(
+            self.stream,
+            self.group,
+            "-",
+            "+",
+            count,
+            idle=int(min_idle_seconds * 1000),
+        )
+        return [(entry["message_id"], entry["times_delivered"]) for entry in pending]
+
+    async def _claim(self, min_idle_seconds: float, ids: list[str]) -> list[WorkItem]:
+        claimed = await self.redis.xclaim(
+            self.stream, self.group, self.consumer, int(min_idle_seconds * 1000), ids
+        )
+        return [
+            WorkItem(entry_id, fields.get(PAYLOAD_FIELD, ""))
+            # entries trimmed off the stream come back empty
+            for entry_id, fields in claimed
+            if entry_id is not None
+        ]
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+@dataclasses.dataclass
+class _PendingEntry:
+    consumer: str
+    # time.monotonic() of the last delivery
+    delivered: float
+    deliveries: int
+
+
+@dataclasses.dataclass
+class _MemoryGroup:
+    # the id of the last entry delivered to the group
+    last_delivered: int
+    pending: dict[int, _PendingEntry] = dataclasses.field(default_factory=dict)
+
+
+class _MemoryStream:
+    def __init__(self):
+        self.entries: dict[int, str] = {}
+        self.groups: dict[str, _MemoryGroup] = {}
+        self.ids = itertools.count(1)
+        self.published = asyncio.Event()
+
+
+class InMemoryStreams:
+    """
+    Streams which live in a dict, shared by the InMemoryWorkQueues of one
+    process like a Redis server is shared by the RedisWorkQueues
+    """
+
+    def __init__(self):
+        self.streams: dict[str, _MemoryStream] = {}
+
+    def stream(self, name: str) -> _MemoryStream:
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = _MemoryStream()
+        return stream
+
+
+class InMemoryWorkQueue(WorkQueue):
+    """
+    A WorkQueue on an InMemoryStreams. Nothing is persisted.
+    Entry ids look like Redis ones but are made of a counter.
+    """
+
+    def __init__(self, streams: InMemoryStreams, stream: str, *args, **kwargs):
+        super().__init__(stream, *args, **kwargs)
+        self._stream = streams.stream(stream)
+
+    @staticmethod
+    def _entry_id(number: int) -> str:
+        return f"{number}-0"
+
+    @staticmethod
+    def _entry_number(entry_id: str) -> int:
+        return int(entry_id.split("-")[0])
+
+    def _group(self) -> _MemoryGroup:
+        group = self._stream.groups.get(self.group)
+        if group is None:
+            last = max(self._stream.entries, default=0)
+            group = self._stream.groups[self.group] = _MemoryGroup(last)
+        return group
+
+    async def publish(self, payload: str) -> str:
+        stream = self._stream
+        number = next(stream.ids)
+        stream.entries[number] = payload
+        while len(stream.entries) > self.max_len:
+            del stream.entries[next(iter(stream.entries))]
+        stream.published.set()
+        stream.published = asyncio.Event()
+        return self._entry_id(number)
+
+    def _deliver(self, count: int) -> list[WorkItem]:
+        group = self._group()
+        numbers = [
+            number for number in self._stream.entries if number > group.last_delivered
+        ][:count]
+        items = []
+        for number in numbers:
+            group.last_delivered = number
+            group.pending[number] = _PendingEntry(self.consumer, time.monotonic(), 1)
+            items.append(WorkItem(self._entry_id(number), self._stream.entries[number]))
+        return items
+
+    async def read(self, count: int = 10, block_seconds: float = 1.0) -> list[WorkItem]:
+        self._check_consumer()
+        items = self._deliver(count)
+        if not items:
+            try:
+                await asyncio.wait_for(self._stream.published.wait(), block_seconds)
+            except asyncio.TimeoutError:
+                return []
+            items = self._deliver(count)
+        return items
+
+    async def ack(self, *ids: str) -> None:
+        pending = self._group().pending
+        for entry_id in ids:
+            pending.pop(self._entry_number(entry_id), None)
+
+    async def _idle_pending(
+        self, min_idle_seconds: float, count: int
+    ) -> list[tuple[str, int]]:
+        now = time.monotonic()
+        return [
+            (self._entry_id(number), entry.deliveries)
+            for number, entry in self._group().pending.items()
+            if now - entry.delivered >= min_idle_seconds
+        ][:count]
+
+    async def _claim(self, min_idle_seconds: float, ids: list[str]) -> list[WorkItem]:
+        pending = self._group().pending
+        now = time.monotonic()
+        items = []
+        for entry_id in ids:
+            number = self._entry_number(entry_id)
+            entry = pending.get(number)
+            if entry is None or now - entry.delivered < min_idle_seconds:
+                continue
+            if number not in self._stream.entries:
+                # trimmed off the stream
+                del pending[number]
+                continue
+            entry.consumer = self.consumer
+            entry.delivered = now
+            entry.deliveries += 1
+            items.append(WorkItem(entry_id, self._stream.entries[number]))
+        return items
@@ -1,18 +1,20 @@
+import asyncio
 import pkgutil
 from collections import deque
 from os import getenv
-from typing import Any
+from typing import Any, Optional
 
 import disnake
 import sqlalchemy
 from derpz_botlib.bot_classes import ConfigurableCogsBot
-from derpz_botlib.database.db import SqlAlchemyBase
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from derpz_botlib.database.db import create_engine_from_url
+from derpz_botlib.lazy import warm_lazy_imports
+from derpz_botlib.startup import CogLoadReport
 
 
 class TavernBot(ConfigurableCogsBot):
     def __init__(self, db_url: str, oauth_client_id: str):
-        engine = create_async_engine(db_url)
+        engine = create_engine_from_url(db_url)
         super().__init__(
             engine=engine,
             command_prefix=".",
@@ -22,32 +24,28 @@ class TavernBot(ConfigurableCogsBot):
         )
 
         self.client_id = oauth_client_id
+        self._warm_imports: Optional[asyncio.Task] = None
 
     async def on_ready(self):
         self.logger.info(f"We have logged in as [cyan]{self.user}[/cyan]")
         self.logger.info(f"We are in {len(self.guilds)} servers")
 
-        self.load_all_extensions()
+        # on_ready fires again after reconnects, when this is a no-op
+        await self.load_all_extensions()
         await self.change_presence(activity=disnake.Game(name="bot ready"))
+        if self._warm_imports is None:
+            # the plugins import their heavy dependencies lazily;
+            # import them now rather than in the first command using them
+            self._warm_imports = asyncio.create_task(warm_lazy_imports())
 
     async def _init_db(self):
         """Creates all the database tables"""
-
-        self.engine_logger.info("Initializing database")
-        async with self.engine.begin() as conn:
-            self.engine.echo = True
-            await conn.run_sync(SqlAlchemyBase.metadata.create_all)
-            self.engine.echo = False
-        self.engine_logger.info("Database initialized")
-        # TODO: Do not inline SQL to do this query
-        async with AsyncSession(self.engine) as sess:
-            tables = await sess.execute(
-                sqlalchemy.text(
-                    "SELECT tablename, schemaname FROM pg_catalog.pg_tables WHERE schemaname != 'pg_catalog' AND schemaname != 'information_schema';"
-                )
+        await super()._init_db()
+        async with self.engine.connect() as conn:
+            tables = await conn.run_sync(
+                lambda sync_conn: sqlalchemy.inspect(sync_conn).get_table_names()
             )
-
-            self.engine_logger.info("Tables: %s", tables.fetchall())
+        self.engine_logger.info("Tables: %s", tables)
 
     async def on_error(self, event_method: str, *args: Any, **kwargs: Any) -> None:
         # dm me on discord if there's an error
@@ -59,27 +57,43 @@ class TavernBot(ConfigurableCogsBot):
 
     def unload_all_extensions(self):
         self.logger.info("[bold yellow]Unloading cogs[/bold yellow]")
-        deque(map(self.unload_extension, self.extensions))
+        deque(map(self.unload_extension, list(self.extensions)))
 
-    def reload_all_extensions(self):
+    async def reload_all_extensions(self) -> CogLoadReport:
+        """
+        Hot reloads every loaded extension, one after another, then loads the
+        ones which are new
+        """
         self.logger.info("[bold yellow]Reloading cogs[/bold yellow]")
-        self.unload_all_extensions()
-        self.load_all_extensions()
+        report = CogLoadReport()
+        for name in list(self.extensions):
+            reloaded = await self.hot_reload_extension(name)
+            report.loaded.update(reloaded.loaded)
+            report.failed.update(reloaded.failed)
+            report.seconds += reloaded.seconds
+        loaded = await self.load_all_extensions()
+        report.loaded.update(loaded.loaded)
+        report.failed.update(loaded.failed)
+        report.seconds += loaded.seconds
+        return report
 
-    def load_all_extensions(self):
+    async def load_all_extensions(self) -> CogLoadReport:
         """
-        Load all extensions in math_tavern_bot_py.plugins
+        Load all extensions in math_tavern_bot_py.plugins which are not loaded
+        yet. Their cogs hydrate from one preloaded snapshot, and run their
+        cog_load concurrently.
         """
         self.logger.info("[bold yellow]Loading cogs[/bold yellow]")
         extension_list = list(
             map(lambda x: x.name, pkgutil.iter_modules(["math_tavern_bot_py/plugins"]))
         )
-        do_not_load = getenv("DISABLED_PLUGINS").split(",")
-        to_load = list(filter(lambda x: x not in do_not_load, extension_list))
-
-        deque(
-            map(
-                self.load_extension,
-                map(lambda x: f"math_tavern_bot_py.plugins.{x}", to_load),
-            )
-        )
+        do_not_load = getenv("DISABLED_PLUGINS", "").split(",")
+        to_load = [
+            f"math_tavern_bot_py.plugins.{x}"
+            for x in extension_list
+            if x not in do_not_load
+            and f"math_tavern_bot_py.plugins.{x}" not in self.extensions
+        ]
+        if to_load:
+            await self.preload_cog_configs()
+        return await self.load_extensions_concurrently(to_load)
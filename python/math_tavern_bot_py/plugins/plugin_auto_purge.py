@@ -33,9 +33,15 @@ class AutoPurgePlugin(DatabaseConfigurableCog[AutoPurgeConfig]):
         await super().cog_load()
         # iterate over config and register all channels
 
-        for guild, config in self.config.items():
+        for guild_id, config in self.iter_guild_configs():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
             cleanup_list = []
             for channel_id, interval in config.channel_purge_interval.items():
+                if channel_id in self._loops:
+                    # handed over by the instance this one replaced
+                    continue
                 channel = guild.get_channel(channel_id)
                 if channel is None:
                     self.logger.error(
@@ -45,22 +51,35 @@ class AutoPurgePlugin(DatabaseConfigurableCog[AutoPurgeConfig]):
                     cleanup_list.append(channel_id)
                     continue
                 self.register_channel_for_auto_purge(channel, interval)
+            if not cleanup_list:
+                continue
             # remove any invalid channels from the config
-            for ch in cleanup_list:
-                del config.channel_purge_interval[ch]
             self.logger.info(
                 "Cleaning up %s invalid channels in %s",
                 len(cleanup_list),
                 fmt_guild_include_id(guild),
             )
-            await self.save_guild_config(guild, config)
+            for ch in cleanup_list:
+                await self.delete_guild_config_dict_entry(
+                    guild, "channel_purge_interval", ch
+                )
 
     def cog_unload(self):
         """
         Cancels all the auto purge tasks
         """
         super().cog_unload()
-        deque(map(self.unregister_channel_for_auto_purge, self._loops.keys()))
+        deque(map(self.unregister_channel_for_auto_purge, list(self._loops.keys())))
+
+    def hand_over_state(self) -> dict:
+        """The purge loops keep running through a hot reload"""
+        state = super().hand_over_state()
+        state["loops"], self._loops = self._loops, {}
+        return state
+
+    def take_over_state(self, state: dict) -> None:
+        super().take_over_state(state)
+        self._loops.update(state.get("loops", {}))
 
     @commands.Cog.listener(name="on_guild_channel_delete")
     async def on_channel_delete(self, channel: disnake.abc.GuildChannel):
@@ -75,8 +94,9 @@ class AutoPurgePlugin(DatabaseConfigurableCog[AutoPurgeConfig]):
         # we go ahead and remove it from the config
         guild_config = self.get_guild_config(channel.guild)
         if channel.id in guild_config.channel_purge_interval:
-            del guild_config.channel_purge_interval[channel.id]
-            await self.save_guild_config(channel.guild, guild_config)
+            await self.delete_guild_config_dict_entry(
+                channel.guild, "channel_purge_interval", channel.id
+            )
 
     @commands.slash_command(name="autopurge")
     @commands.guild_only()
@@ -121,9 +141,9 @@ class AutoPurgePlugin(DatabaseConfigurableCog[AutoPurgeConfig]):
             description="Interval to purge messages at in seconds", gt=5
         ),
     ):
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.channel_purge_interval[channel.id] = interval
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.set_guild_config_dict_entry(
+            ctx.guild, "channel_purge_interval", channel.id, interval
+        )
         await ctx.send(
             f"Added {channel.mention} to the list of channels to "
             f"purge messages at {interval} seconds."
@@ -143,8 +163,9 @@ class AutoPurgePlugin(DatabaseConfigurableCog[AutoPurgeConfig]):
                 f"purge messages at intervals."
             )
             return
-        del guild_config.channel_purge_interval[channel.id]
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.delete_guild_config_dict_entry(
+            ctx.guild, "channel_purge_interval", channel.id
+        )
         self.unregister_channel_for_auto_purge(channel.id)
         await ctx.send(
             f"Removed {channel.mention} from the list of channels to purge messages "
@@ -169,8 +190,9 @@ class AutoPurgePlugin(DatabaseConfigurableCog[AutoPurgeConfig]):
                 f"purge messages at intervals."
             )
             return
-        guild_config.channel_purge_interval[channel.id] = interval
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.set_guild_config_dict_entry(
+            ctx.guild, "channel_purge_interval", channel.id, interval
+        )
         self.edit_purge_interval(channel, interval)
         await ctx.send(
             f"Modified the interval at which {channel.mention} is purged to "
@@ -6,13 +6,14 @@ This is useful for automatically reacting with a sully emoji to a user who
 sends a message that is cringe.
 """
 from os import getenv
-from typing import Optional, Union
+from typing import NamedTuple, Optional, Union
 
-import aioredis
 import disnake
 from derpz_botlib.bot_classes import ConfigurableCogsBot
 from derpz_botlib.cog import CogConfiguration, DatabaseConfigurableCog
+from derpz_botlib.discord_utils.emoji import EmojiResolver, ResolvedEmoji
 from derpz_botlib.utils import fmt_user
+from derpz_botlib.work_queue import RedisWorkQueue, WorkQueue
 from disnake import ApplicationCommandInteraction
 from disnake.ext import commands
 from disnake.ext.commands import CheckFailure, MissingRole
@@ -33,16 +34,50 @@ class AutoSullyRequest(BaseModel):
     emoji_id: Union[int, str]
 
 
+class SullyIndexEntry(NamedTuple):
+    users: frozenset[int]
+    emoji: Optional[ResolvedEmoji]
+
+
+# The entry of the guilds where nobody gets sullied
+NO_SULLIES = SullyIndexEntry(frozenset(), None)
+
+
 class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
     """
     Automatically sullies configured users
+
+    on_message runs for every message the bot sees, so it checks the author
+    against an index of who gets sullied with what, by guild id. A guild's
+    entry is built on its first message and dropped whenever its config or
+    emojis change.
     """
 
     def __init__(self, bot: ConfigurableCogsBot):
         super().__init__(bot, AutoSullyConfig)
-        self._sully_emoji: Optional[disnake.Emoji] = None
-        # TODO: Refactor this out of here
-        self.redis_conn = aioredis.Redis.from_url(getenv("REDIS_URL"))
+        self.emoji_resolver = EmojiResolver(bot)
+        self._sully_index: dict[int, SullyIndexEntry] = {}
+        self._sully_queue: Optional[WorkQueue] = None
+
+    @property
+    def sully_queue(self) -> WorkQueue:
+        """The queue the sully army reads its requests from"""
+        # Connected on first use, which is also when redis gets imported
+        if self._sully_queue is None:
+            self._sully_queue = RedisWorkQueue.from_url(
+                getenv("REDIS_URL"), getenv("SULLY_STREAM", "autosully")
+            )
+        return self._sully_queue
+
+    def hand_over_state(self) -> dict:
+        """Keeps the queue's redis connection through a hot reload"""
+        state = super().hand_over_state()
+        state["sully_queue"], self._sully_queue = self._sully_queue, None
+        return state
+
+    def take_over_state(self, state: dict) -> None:
+        super().take_over_state(state)
+        self._sully_queue = state.get("sully_queue")
 
     @commands.slash_command(name="autosully")
     async def cmd_auto_sully(self, ctx: disnake.ApplicationCommandInteraction):
@@ -56,9 +91,7 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
     @commands.is_owner()
     async def ban_from_massreact(self, ctx: disnake.ApplicationCommandInteraction, *,
                                  user: disnake.Member = commands.Param(description="The user to ban from using massreact")):
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.banned_from_massreact.add(user.id)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.add_to_guild_config_set(ctx.guild, "banned_from_massreact", user.id)
         await ctx.send(f"Banned {user.mention} from using massreact",
                        allowed_mentions=disnake.AllowedMentions.none())
 
@@ -67,9 +100,9 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
     @commands.is_owner()
     async def unban_from_massreact(self, ctx: disnake.ApplicationCommandInteraction, *,
                                  user: disnake.Member = commands.Param(description="The user to unban from using massreact")):
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.banned_from_massreact.discard(user.id)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.discard_from_guild_config_set(
+            ctx.guild, "banned_from_massreact", user.id
+        )
         await ctx.send(f"Unbanned {user.mention} from using massreact",
                        allowed_mentions=disnake.AllowedMentions.none())
 
@@ -92,6 +125,7 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
 
         guild_config = self.get_guild_config(ctx.guild)
         guild_config.sully_emoji = emoji.id
+        self.emoji_resolver.invalidate(ctx.guild.id)
         await self.save_guild_config(ctx.guild, guild_config)
         await ctx.send(f"Set sully emoji to {emoji}")
 
@@ -109,9 +143,9 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
         ctx: disnake.ApplicationCommandInteraction,
         role: disnake.Role = commands.Param(),
     ):
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.roles_allowed_to_setup_autosully.add(role.id)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.add_to_guild_config_set(
+            ctx.guild, "roles_allowed_to_setup_autosully", role.id
+        )
         await ctx.send(
             f"Added {role.mention} to allowed roles",
             ephemeral=True,
@@ -128,9 +162,9 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
         ctx: disnake.ApplicationCommandInteraction,
         role: disnake.Role = commands.Param(),
     ):
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.roles_allowed_to_setup_autosully.remove(role.id)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.discard_from_guild_config_set(
+            ctx.guild, "roles_allowed_to_setup_autosully", role.id
+        )
         await ctx.send(
             f"Removed {role.mention} from allowed roles",
             ephemeral=True,
@@ -178,10 +212,7 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
         ):
             await ctx.send("You do not have a required role to use this")
             raise CheckFailure()
-        guild_config = self.config.get(ctx.guild, AutoSullyConfig())
-        guild_config.sully_users.add(user.id)
-        self.config[ctx.guild] = guild_config
-        await self.bot.cog_config_store.set_cog_config(self, ctx.guild, guild_config)
+        await self.add_to_guild_config_set(ctx.guild, "sully_users", user.id)
         await ctx.send(f"Added {fmt_user(user)} to the sully list")
 
     @cmd_auto_sully.sub_command(
@@ -202,9 +233,7 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
         ):
             await ctx.send("You do not have a required role to use this")
             raise CheckFailure()
-        guild_config.sully_users.discard(user.id)
-        self.config[ctx.guild] = guild_config
-        await self.bot.cog_config_store.set_cog_config(self, ctx.guild, guild_config)
+        await self.discard_from_guild_config_set(ctx.guild, "sully_users", user.id)
         await ctx.send(f"Removed {fmt_user(user)} from the sully list")
 
     @commands.command("whoissully")
@@ -269,20 +298,54 @@ class AutoSullyPlugin(DatabaseConfigurableCog[AutoSullyConfig]):
             )
         )
 
+    def guild_config_changed(self, guild_id: int) -> None:
+        self._sully_index.pop(guild_id, None)
+
+    def _index_guild(self, guild_id: int) -> SullyIndexEntry:
+        guild_config = self.get_guild_config(guild_id)
+        if not guild_config.sully_users or guild_config.sully_emoji is None:
+            entry = NO_SULLIES
+        else:
+            entry = SullyIndexEntry(
+                frozenset(guild_config.sully_users),
+                self.emoji_resolver.resolve(guild_id, guild_config.sully_emoji),
+            )
+        self._sully_index[guild_id] = entry
+        return entry
+
     @commands.Cog.listener()
     async def on_message(self, message: disnake.Message):
-        if not message.guild:
+        guild = message.guild
+        if guild is None:
+            return
+        entry = self._sully_index.get(guild.id)
+        if entry is None:
+            entry = self._index_guild(guild.id)
+        if message.author.id not in entry.users:
             return
-        guild_config = self.get_guild_config(message.guild)
-        if message.author.id in guild_config.sully_users:
-            if guild_config.sully_emoji is not None:
-                emoji = await message.guild.fetch_emoji(guild_config.sully_emoji)
-                await message.add_reaction(emoji)
+        try:
+            await message.add_reaction(entry.emoji)
+        except disnake.HTTPException as e:
+            # e.g. the emoji was deleted, it is resolved again next time
+            self.emoji_resolver.invalidate(guild.id)
+            self._sully_index.pop(guild.id, None)
+            self.logger.warning(
+                "Failed to sully with %s in %s: %s", entry.emoji, guild, e
+            )
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(
+        self,
+        guild: disnake.Guild,
+        before: list[disnake.Emoji],
+        after: list[disnake.Emoji],
+    ):
+        self.emoji_resolver.invalidate(guild.id)
+        self._sully_index.pop(guild.id, None)
 
     async def publish_sully_request(self, req: AutoSullyRequest):
         """Requests for mass sullying from the sully army"""
-        # TODO: Hardcoded redis channel
-        await self.redis_conn.publish("autosully", req.json())
+        await self.sully_queue.publish(req.json())
 
     async def cog_slash_command_error(
         self, inter: ApplicationCommandInteraction, error: Exception
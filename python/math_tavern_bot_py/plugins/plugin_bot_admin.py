@@ -1,6 +1,8 @@
+import io
 import subprocess
+from importlib import metadata
 
-import pkg_resources
+import disnake
 from derpz_botlib.bot_classes import LoggedBot
 from derpz_botlib.cog import LoggedCog
 from disnake.ext import commands
@@ -34,7 +36,7 @@ class BotInfoPlugin(LoggedCog):
         """
         Shows information about the bot such as the version and git hash
         """
-        version = pkg_resources.get_distribution("math-tavern-bot").version
+        version = metadata.version("math-tavern-bot")
         git_hash = get_git_revision_short_hash()
         await ctx.send(f"Math Tavern Bot v**{version}**\n" f"Git: {git_hash}")
 
@@ -46,14 +48,64 @@ class BotInfoPlugin(LoggedCog):
 
     @commands.command(name="reload")
     @commands.is_owner()
-    async def reload_command(self, ctx: commands.Context):
+    async def reload_command(self, ctx: commands.Context, plugin: str = ""):
         """
-        Reloads all the extensions currently loaded.
-        Currently, disabled due to issues
+        Hot reloads a plugin, e.g. `.reload plugin_pin`, or all of them.
+        The plugins keep their configs and running tasks.
         """
-        await ctx.send("This command is currently disabled")
-        # self.bot.reload_all_extensions()
-        # await ctx.send("Reloaded cogs")
+        if not plugin:
+            report = await self.bot.reload_all_extensions()
+        else:
+            name = plugin
+            if name not in self.bot.extensions:
+                name = f"math_tavern_bot_py.plugins.{plugin}"
+            if name not in self.bot.extensions:
+                await ctx.send(f"`{plugin}` is not loaded")
+                return
+            report = await self.bot.hot_reload_extension(name)
+        message = f"Reloaded {plugin or 'all plugins'} in {report.seconds:.2f}s"
+        if report.failed:
+            message += "\nFailed: " + ", ".join(
+                f"`{name}` ({reason})" for name, reason in report.failed.items()
+            )
+        await ctx.send(message)
+
+    @commands.command(name="metrics")
+    @commands.is_owner()
+    async def metrics_command(self, ctx: commands.Context, prefix: str = ""):
+        """
+        Dumps the bot's metrics, optionally only those starting with prefix
+        e.g. `.metrics db_`
+        """
+        summary = self.bot.metrics.summary(prefix)
+        if not summary:
+            await ctx.send("No metrics recorded yet")
+            return
+        if len(summary) <= 1900:
+            await ctx.send(f"```\n{summary}\n```")
+            return
+        await ctx.send(
+            file=disnake.File(io.BytesIO(summary.encode()), filename="metrics.txt")
+        )
+
+    @commands.command(name="listeners")
+    @commands.is_owner()
+    async def listeners_command(self, ctx: commands.Context, prefix: str = ""):
+        """
+        Shows how long the event listeners take and their slowest recent calls,
+        optionally only of the listeners starting with prefix
+        e.g. `.listeners AutoSullyPlugin`
+        """
+        report = self.bot.listener_profiler.report(prefix)
+        if not report:
+            await ctx.send("No listener calls recorded yet")
+            return
+        if len(report) <= 1900:
+            await ctx.send(f"```\n{report}\n```")
+            return
+        await ctx.send(
+            file=disnake.File(io.BytesIO(report.encode()), filename="listeners.txt")
+        )
 
 
 def setup(bot: TavernBot):
@@ -25,6 +25,7 @@ from derpz_botlib.cog import DatabaseConfigurableCog
 from derpz_botlib.database.db import (SqlAlchemyBase, intpk, required_bigint,
                                       required_int, required_str,
                                       tz_aware_timestamp)
+from derpz_botlib.database.instrumentation import instrumented
 from derpz_botlib.database.storage import CogConfiguration
 from derpz_botlib.discord_utils.view import (DatePickerView,
                                              MessageAndBotAwareView)
@@ -32,7 +33,7 @@ from derpz_botlib.utils import (DiscordTimeFormat, fmt_time, parse_human_time,
                                 reply_feature_wip)
 from disnake import ApplicationCommandInteraction
 from disnake.ext import commands
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import Mapped
 
@@ -43,6 +44,8 @@ class GoalSettingPluginConfig(CogConfiguration):
 
 class Goal(SqlAlchemyBase):
     __tablename__ = "user_goals"
+    # the plugin can be hot reloaded, which defines the table again
+    __table_args__ = {"extend_existing": True}
 
     id: Mapped[intpk]
     user_id: Mapped[required_bigint]
@@ -55,6 +58,7 @@ class GoalManager:
     def __init__(self, engine: AsyncEngine):
         self.engine = engine
 
+    @instrumented
     async def create_goal(
         self, user_id: int, goal_name: str, goal_description: str, end_dt: datetime
     ):
@@ -69,6 +73,7 @@ class GoalManager:
             await session.commit()
             return goal
 
+    @instrumented
     async def get_goal(self, user_id: int, goal_name: str) -> Optional[Goal]:
         async with AsyncSession(self.engine) as session:
             query_stmt = (
@@ -79,6 +84,7 @@ class GoalManager:
             goal = await session.execute(query_stmt)
             return goal.scalar_one_or_none()
 
+    @instrumented
     async def get_goals(self, user_id: int) -> Sequence[Goal]:
         async with AsyncSession(self.engine) as session:
             query_stmt = select(Goal).where(Goal.user_id == user_id)
@@ -86,15 +92,14 @@ class GoalManager:
 
             return goals.scalars().all()
 
+    @instrumented
     async def delete_goal(self, user_id: int, goal_name: str):
         async with AsyncSession(self.engine) as session:
-            goal = (
-                session.query(Goal)
-                .filter(Goal.user_id == user_id)
-                .filter(Goal.goal_name == goal_name)
-                .first()
+            await session.execute(
+                delete(Goal)
+                .where(Goal.user_id == user_id)
+                .where(Goal.goal_name == goal_name)
             )
-            await session.delete(goal)
             await session.commit()
 
 
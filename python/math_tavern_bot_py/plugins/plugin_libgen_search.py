@@ -7,9 +7,12 @@ import disnake
 from derpz_botlib.bot_classes import LoggedBot
 from derpz_botlib.cog import LoggedCog
 from derpz_botlib.discord_utils.paginator import Menu
+from derpz_botlib.lazy import lazy_import
 from disnake import ApplicationCommandInteraction
 from disnake.ext import commands
-from libgen_api import LibgenSearch
+
+# pulls in requests and BeautifulSoup
+libgen_api = lazy_import("libgen_api")
 
 
 def extract_all_mirrors(lg_item: dict) -> list[str]:
@@ -59,7 +62,13 @@ def make_embed(lg_item: dict) -> disnake.Embed:
 class PluginLibgenSearch(LoggedCog):
     def __init__(self, bot: LoggedBot):
         super().__init__(bot)
-        self.lg_search = LibgenSearch()
+        self._lg_search = None
+
+    @property
+    def lg_search(self) -> "libgen_api.LibgenSearch":
+        if self._lg_search is None:
+            self._lg_search = libgen_api.LibgenSearch()
+        return self._lg_search
 
     @commands.slash_command(name="libgen")
     async def cmd_libgen(self, ctx: ApplicationCommandInteraction):
@@ -41,10 +41,7 @@ class PinMessagePlugin(DatabaseConfigurableCog[PinConfig]):
         ),
     ):
         """Add a role which can pin messages"""
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.roles_that_can_pin.add(role.id)
-        self.config[ctx.guild] = guild_config
-        await self.bot.cog_config_store.set_cog_config(self, ctx.guild, guild_config)
+        await self.add_to_guild_config_set(ctx.guild, "roles_that_can_pin", role.id)
         await ctx.send(
             f"+ Added {role.name} to the list of roles that can pin messages"
         )
@@ -62,13 +59,13 @@ class PinMessagePlugin(DatabaseConfigurableCog[PinConfig]):
             description="The role to remove pin permissions from"
         ),
     ):
-        guild_config = self.config.get(ctx.guild, PinConfig())
+        guild_config = self.get_guild_config(ctx.guild)
         if role.id not in guild_config.roles_that_can_pin:
             await ctx.send("That role cannot pin messages")
             return
-        guild_config.roles_that_can_pin.remove(role.id)
-        self.config[ctx.guild] = guild_config
-        await self.bot.cog_config_store.set_cog_config(self, ctx.guild, guild_config)
+        await self.discard_from_guild_config_set(
+            ctx.guild, "roles_that_can_pin", role.id
+        )
         await ctx.send(
             f"- Removed {role.name} from the list of roles that can pin messages"
         )
@@ -81,7 +78,7 @@ class PinMessagePlugin(DatabaseConfigurableCog[PinConfig]):
         Note that by default, users with the Manage Messages permission can pin.
         (Of course, they could already do this from the discord UI)
         """
-        guild_config = self.config.get(ctx.guild, PinConfig())
+        guild_config = self.get_guild_config(ctx.guild)
         pin_roles = list(
             map(
                 lambda role_id: ctx.guild.get_role(role_id),
@@ -102,7 +99,7 @@ class PinMessagePlugin(DatabaseConfigurableCog[PinConfig]):
         """
         Pins the message you are replying to.
         """
-        guild_config = self.config.get(ctx.guild, PinConfig())
+        guild_config = self.get_guild_config(ctx.guild)
         if not (
             any(role in ctx.author.roles for role in guild_config.roles_that_can_pin)
             or ctx.author.guild_permissions.manage_messages
@@ -127,7 +124,7 @@ class PinMessagePlugin(DatabaseConfigurableCog[PinConfig]):
         """
         Unpins the message you are replying to.
         """
-        guild_config = self.config.get(ctx.guild, PinConfig())
+        guild_config = self.get_guild_config(ctx.guild)
         if not (
             any(role in ctx.author.roles for role in guild_config.roles_that_can_pin)
             or ctx.author.guild_permissions.manage_messages
@@ -14,11 +14,10 @@ Usage:
 import datetime
 from typing import Optional, Sequence
 
-import dateparser
 import disnake
 from disnake import ApplicationCommandInteraction
 from disnake.ext import commands
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import Mapped
 
@@ -31,12 +30,19 @@ from derpz_botlib.database.db import (
     required_str,
     tz_aware_timestamp,
 )
+from derpz_botlib.database.instrumentation import instrumented
 from derpz_botlib.discord_utils.paginator import Menu
+from derpz_botlib.lazy import lazy_import
 from derpz_botlib.utils import fmt_time, DiscordTimeFormat
 
+# its regex and locale tables take longer to import than the rest of the bot
+dateparser = lazy_import("dateparser")
+
 
 class Reminder(SqlAlchemyBase):
     __tablename__ = "user_reminders"
+    # the plugin can be hot reloaded, which defines the table again
+    __table_args__ = {"extend_existing": True}
 
     id: Mapped[intpk]
     user_id: Mapped[required_bigint]
@@ -71,6 +77,7 @@ class ReminderManager:
     def __init__(self, engine: AsyncEngine):
         self.engine = engine
 
+    @instrumented
     async def create_reminder(
         self, user_id: int, remind_time: datetime.datetime, reminder_text: str
     ):
@@ -86,6 +93,7 @@ class ReminderManager:
             await session.commit()
             return reminder
 
+    @instrumented
     async def get_reminder_by_reminder_id(self, reminder_id: int) -> Optional[Reminder]:
         """Fetches a reminder by the reminder id, which is globally unique"""
         async with AsyncSession(self.engine) as session:
@@ -93,6 +101,7 @@ class ReminderManager:
             reminder = await session.execute(query_stmt)
             return reminder.scalar_one_or_none()
 
+    @instrumented
     async def get_reminder_by_user_reminder_id(
         self, user_id: int, user_reminder_id: int
     ) -> Optional[Reminder]:
@@ -106,12 +115,14 @@ class ReminderManager:
             reminder = await session.execute(query_stmt)
             return reminder.scalar_one_or_none()
 
+    @instrumented
     async def get_reminders(self, user_id: int) -> Sequence[Reminder]:
         async with AsyncSession(self.engine) as session:
             query_stmt = select(Reminder).where(Reminder.user_id == user_id)
             reminders = await session.execute(query_stmt)
             return reminders.scalars().all()
 
+    @instrumented
     async def count_reminders(self, user_id: int) -> int:
         async with AsyncSession(self.engine) as session:
             # Theoretically this is inefficient,
@@ -120,6 +131,7 @@ class ReminderManager:
             reminders = await session.execute(query_stmt)
             return len(reminders.scalars().all())
 
+    @instrumented
     async def get_last_user_reminder_id(self, user_id: int) -> int:
         async with AsyncSession(self.engine) as session:
             query_stmt = (
@@ -129,12 +141,13 @@ class ReminderManager:
                 .limit(1)
             )
             last_reminder_id = await session.execute(query_stmt)
-            return last_reminder_id.scalar_one_or_none()
+            # users without reminders start counting from 0
+            return last_reminder_id.scalar_one_or_none() or 0
 
+    @instrumented
     async def delete_reminder_by_reminder_id(self, reminder_id: int):
         async with AsyncSession(self.engine) as session:
-            reminder = await self.get_reminder_by_reminder_id(reminder_id)
-            await session.delete(reminder)
+            await session.execute(delete(Reminder).where(Reminder.id == reminder_id))
             await session.commit()
 
 
@@ -152,9 +165,8 @@ class ReminderPlugin(DatabasedCog):
         ctx: ApplicationCommandInteraction,
         time: str = commands.Param(
             description="Time to remind you at. Please include your timezone",
-            required=True,
         ),
-        reminder: str = commands.Param(description="Reminder message", required=True),
+        reminder: str = commands.Param(description="Reminder message"),
     ):
         # parse time with humantime
         reminder_dt = dateparser.parse(time)
@@ -177,9 +189,8 @@ class ReminderPlugin(DatabasedCog):
         ctx: ApplicationCommandInteraction,
         time: str = commands.Param(
             description="Time to remind you in. Please include your timezone",
-            required=True,
         ),
-        reminder: str = commands.Param(description="Reminder message", required=True),
+        reminder: str = commands.Param(description="Reminder message"),
     ):
         # just farm it out, since dateparser can handle this
         await self.cmd_remindme_at(ctx, time, reminder)
@@ -201,7 +212,6 @@ class ReminderPlugin(DatabasedCog):
         ctx: ApplicationCommandInteraction,
         reminder_id: int = commands.Param(
             description="Reminder ID to delete",
-            required=True,
         ),
     ):
         manager = ReminderManager(self.engine)
@@ -211,7 +221,7 @@ class ReminderPlugin(DatabasedCog):
         if not reminder:
             await ctx.send("Reminder not found!")
             return
-        await manager.delete_reminder_by_reminder_id(reminder_id)
+        await manager.delete_reminder_by_reminder_id(reminder.id)
         await ctx.send("Reminder deleted!")
 
 
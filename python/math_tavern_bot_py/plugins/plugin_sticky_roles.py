@@ -1,3 +1,4 @@
+import asyncio
 from collections import OrderedDict
 from typing import Optional, Sequence
 
@@ -7,6 +8,7 @@ from derpz_botlib.bot_classes import ConfigurableCogsBot
 from derpz_botlib.cog import DatabaseConfigurableCog
 from derpz_botlib.database.db import (SqlAlchemyBase, intpk, required_bigint,
                                       required_int, required_str)
+from derpz_botlib.database.instrumentation import instrumented
 from derpz_botlib.database.storage import CogConfiguration
 from derpz_botlib.utils import (fmt_guild_include_id, fmt_user,
                                 fmt_user_include_id)
@@ -18,17 +20,24 @@ from sqlalchemy.orm import Mapped, mapped_column
 
 class UserRoleCache(SqlAlchemyBase):
     __tablename__ = "user_role_cache"
+    # the plugin can be hot reloaded, which defines the table again
+    __table_args__ = {"extend_existing": True}
 
     id: Mapped[intpk]
     user_id: Mapped[required_bigint]
     user_name: Mapped[required_str]
     server_id: Mapped[required_bigint]
     server_name: Mapped[required_str]
+    # Arrays are Postgres only, other backends store the lists as JSON
     role_ids: Mapped[list[int]] = mapped_column(
-        sqlalchemy.dialects.postgresql.ARRAY(sqlalchemy.BigInteger)
+        sqlalchemy.JSON().with_variant(
+            sqlalchemy.dialects.postgresql.ARRAY(sqlalchemy.BigInteger), "postgresql"
+        )
     )
     role_names: Mapped[list[str]] = mapped_column(
-        sqlalchemy.dialects.postgresql.ARRAY(sqlalchemy.String)
+        sqlalchemy.JSON().with_variant(
+            sqlalchemy.dialects.postgresql.ARRAY(sqlalchemy.String), "postgresql"
+        )
     )
 
 
@@ -36,6 +45,7 @@ class UserRoleCacheManager:
     def __init__(self, engine: AsyncEngine):
         self.engine = engine
 
+    @instrumented
     async def upsert_member(self, member: disnake.Member):
         """
         Attempts to upsert a member into the role cache.
@@ -65,8 +75,8 @@ class UserRoleCacheManager:
                     user_name=fmt_user(member),
                     server_id=member.guild.id,
                     server_name=member.guild.name,
-                    role_ids=id_name_map.keys(),
-                    role_names=id_name_map.values(),
+                    role_ids=list(id_name_map.keys()),
+                    role_names=list(id_name_map.values()),
                 )
                 sess.add(urc)
             elif len(rows) == 1:
@@ -75,13 +85,14 @@ class UserRoleCacheManager:
                 id_name_map = OrderedDict({r.id: r.name for r in member.roles})
                 # remove the @everyone role
                 id_name_map.pop(member.guild.default_role.id)
-                urc.role_ids = id_name_map.keys()
-                urc.role_names = id_name_map.values()
+                urc.role_ids = list(id_name_map.keys())
+                urc.role_names = list(id_name_map.values())
 
             else:
                 raise ValueError("Multiple rows for user?")
             await sess.commit()
 
+    @instrumented
     async def get_all_cached_members(self, guild_id: int) -> Sequence[UserRoleCache]:
         async with AsyncSession(self.engine, expire_on_commit=False) as sess:
             stmt = sqlalchemy.select(UserRoleCache).where(
@@ -91,10 +102,11 @@ class UserRoleCacheManager:
             rows = result.scalars().all()
             return rows
 
+    @instrumented
     async def get_member(
         self, member_id: int, server_id: int
     ) -> Optional[UserRoleCache]:
-        with AsyncSession(self.engine) as sess:
+        async with AsyncSession(self.engine) as sess:
             stmt = (
                 sqlalchemy.select(UserRoleCache)
                 .where(UserRoleCache.user_id == member_id)
@@ -121,18 +133,30 @@ class StickyRolesPlugin(DatabaseConfigurableCog[StickyRolesConfig]):
     def __init__(self, bot: ConfigurableCogsBot):
         super().__init__(bot, StickyRolesConfig)
         self.manager = UserRoleCacheManager(self.bot.engine)
+        self._member_sync: Optional[asyncio.Task] = None
 
     async def cog_load(self):
         """
-        Checks what servers we are in for which we haven't cached the members.
-        If the server has the plugin enabled, we cache the members.
+        Creates the table, then caches the members in the background:
+        fetching every member takes far longer than the startup should wait.
         """
         await super().cog_load()
         # create the table if it doesn't exist
         async with self.bot.engine.begin() as conn:
             self.logger.info("Attempting to create table if it doesn't exist")
             await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+        self._member_sync = asyncio.create_task(self.cache_all_members())
+
+    def cog_unload(self):
+        if self._member_sync is not None:
+            self._member_sync.cancel()
+        super().cog_unload()
 
+    async def cache_all_members(self):
+        """
+        Checks what servers we are in for which we haven't cached the members.
+        If the server has the plugin enabled, we cache the members.
+        """
         for guild in self.bot.guilds:
             guild_config = self.get_guild_config(guild)
             if not guild_config.enabled:
@@ -188,10 +188,12 @@ class TierListPlugin(DatabaseConfigurableCog[TierListPluginConfiguration]):
             },
         )
         await channel.send(f"Tier list created for {user.mention}")
-        guild_config.tier_lists[channel.id] = TierListChannelDetails(
-            name=name, owners=[user.id]
+        await self.set_guild_config_dict_entry(
+            ctx.guild,
+            "tier_lists",
+            channel.id,
+            TierListChannelDetails(name=name, owners=[user.id]),
         )
-        await self.save_guild_config(ctx.guild, guild_config)
 
     @tier_list.sub_command(description="Lists all the tier lists")
     @commands.guild_only()
@@ -249,10 +251,12 @@ class TierListPlugin(DatabaseConfigurableCog[TierListPluginConfiguration]):
         if guild_config.tier_lists.get(channel.id) is not None:
             raise commands.BadArgument("Channel is already a tier list")
         await ctx.send(f"Setting up the tier list: {channel.mention}")
-        guild_config.tier_lists[channel.id] = TierListChannelDetails(
-            name=channel.name, owners=[owner.id]
+        await self.set_guild_config_dict_entry(
+            ctx.guild,
+            "tier_lists",
+            channel.id,
+            TierListChannelDetails(name=channel.name, owners=[owner.id]),
         )
-        await self.save_guild_config(ctx.guild, guild_config)
         await channel.edit(
             topic=f"Tier list for {channel.name}",
             overwrites={
@@ -286,7 +290,9 @@ class TierListPlugin(DatabaseConfigurableCog[TierListPluginConfiguration]):
             allowed_mentions=disnake.AllowedMentions.none(),
         )
         tier_list.owners.append(owner.id)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.set_guild_config_dict_entry(
+            ctx.guild, "tier_lists", channel.id, tier_list
+        )
         await channel.set_permissions(
             owner,
             overwrite=self._owner_perms,
@@ -318,7 +324,9 @@ class TierListPlugin(DatabaseConfigurableCog[TierListPluginConfiguration]):
             allowed_mentions=disnake.AllowedMentions.none(),
         )
         tier_list.owners.remove(owner.id)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.set_guild_config_dict_entry(
+            ctx.guild, "tier_lists", channel.id, tier_list
+        )
         await channel.set_permissions(
             owner,
             overwrite=None,
@@ -336,9 +344,7 @@ class TierListPlugin(DatabaseConfigurableCog[TierListPluginConfiguration]):
     ):
         # TODO: Check if it is a tier list channel we manage
         await ctx.send(f"Deleting the tier list: {channel.mention}")
-        guild_config = self.get_guild_config(ctx.guild)
-        guild_config.tier_lists.pop(channel.id, None)
-        await self.save_guild_config(ctx.guild, guild_config)
+        await self.delete_guild_config_dict_entry(ctx.guild, "tier_lists", channel.id)
 
         await channel.delete(
             reason=f"Tier list delete requested by {fmt_user(ctx.user)}"
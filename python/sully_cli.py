@@ -2,6 +2,7 @@ import argparse
 from typing import Union
 
 import redis
+from derpz_botlib.work_queue import PAYLOAD_FIELD
 from pydantic import BaseModel
 
 
@@ -21,14 +22,17 @@ if __name__ == "__main__":
         "-e", required=False, type=Union[int, str], default=1073406460840648784
     )
     argparser.add_argument("-m", type=int)
+    argparser.add_argument("--stream", default="autosully")
     redis_conn = redis.from_url("redis://localhost:6379")
     args = argparser.parse_args()
-    redis_conn.publish(
-        "autosully",
-        AutoSullyRequest(
-            guild_id=args.g,
-            channel_id=args.c,
-            message_id=args.m,
-            emoji_id=args.e,
-        ).json(),
+    redis_conn.xadd(
+        args.stream,
+        {
+            PAYLOAD_FIELD: AutoSullyRequest(
+                guild_id=args.g,
+                channel_id=args.c,
+                message_id=args.m,
+                emoji_id=args.e,
+            ).json()
+        },
     )
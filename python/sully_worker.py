@@ -1,23 +1,44 @@
 import asyncio
 import logging
 import os
-from typing import Union
+from typing import Optional, Union
 
-import aioredis
-import async_timeout
 import disnake
+from derpz_botlib.discord_utils.reactions import add_reaction_by_id
+from derpz_botlib.pipeline import KeyedPipeline
+from derpz_botlib.work_queue import FanOut, RedisWorkQueue, WorkItem
 from disnake.ext import commands
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 load_dotenv()
 
 WORKER_NUMBER = os.getenv("WORKER_NUMBER")
 DISCORD_TOKEN = os.getenv(f"WORKER_{WORKER_NUMBER}_TOKEN")
+# Pending requests idle for this long were lost by their worker and are retried
+RECLAIM_IDLE_SECONDS = float(os.getenv("SULLY_RECLAIM_IDLE_SECONDS", 30))
 
-bot = commands.InteractionBot(intents=disnake.Intents.default())
-redis = aioredis.from_url(os.getenv("REDIS_URL"))
-pubsub = redis.pubsub()
+# The last messages the worker saw are kept, and reacted to as they are; the
+# others through a PartialMessage (see add_reaction_by_id)
+bot = commands.InteractionBot(
+    intents=disnake.Intents.default(),
+    max_messages=int(os.getenv("SULLY_MESSAGE_CACHE", 1000)),
+)
+# broadcast: every worker reacts to every request, with its own token
+# once: every request is handled by one of the workers
+queue = RedisWorkQueue.from_url(
+    os.getenv("REDIS_URL"),
+    os.getenv("SULLY_STREAM", "autosully"),
+    f"worker-{WORKER_NUMBER}",
+    fan_out=FanOut(os.getenv("SULLY_FAN_OUT", FanOut.BROADCAST.value)),
+    group=os.getenv("SULLY_GROUP", "sully_army"),
+    max_deliveries=int(os.getenv("SULLY_MAX_DELIVERIES", 5)),
+)
+# Reactions to different channels are added concurrently, up to this many
+pipeline = KeyedPipeline(concurrency=int(os.getenv("SULLY_CONCURRENCY", 8)))
+# The requests in the pipeline, which are not reclaimed from ourselves
+in_flight: set[str] = set()
+reader_task: Optional[asyncio.Task] = None
 
 logging.basicConfig(level=logging.INFO)
 
@@ -29,54 +50,108 @@ class AutoSullyRequest(BaseModel):
     emoji_id: Union[int, str]
 
 
-async def reader(ps_channel: aioredis.client.PubSub):
+def parse(item: WorkItem) -> Optional[AutoSullyRequest]:
+    logging.info(f"(Reader) Message Received: {item}")
+    try:
+        return AutoSullyRequest.parse_raw(item.payload)
+    except ValidationError:
+        logging.exception(f"(Reader) Dropping malformed request {item.id}")
+        return None
+
+
+def resolve(
+    msg: AutoSullyRequest,
+) -> Optional[tuple[disnake.TextChannel, Union[disnake.Emoji, str]]]:
+    """The channel and emoji of a request, from the gateway cache"""
+    guild = bot.get_guild(msg.guild_id)
+    if guild is None:
+        logging.info(f"(Reader) Guild not found: {msg.guild_id}")
+        return None
+    channel: disnake.TextChannel = guild.get_channel(msg.channel_id)
+    if channel is None:
+        logging.info(f"(Reader) Channel not found: {msg.channel_id}")
+        return None
+    if isinstance(msg.emoji_id, str):
+        # we are working with a unicode emoji
+        return channel, msg.emoji_id
+    emoji = bot.get_emoji(msg.emoji_id)
+    if emoji is None:
+        logging.info(f"(Reader) Emoji not found: {msg.emoji_id}")
+        return None
+    return channel, emoji
+
+
+async def react(
+    item: WorkItem,
+    channel: disnake.TextChannel,
+    message_id: int,
+    emoji: Union[disnake.Emoji, str],
+) -> None:
+    """
+    Adds the reaction of a request and acks it. Requests which cannot be done,
+    like those Discord rejects as invalid, are acked too; other HTTP errors
+    leave them pending to be retried.
+    """
+    try:
+        await add_reaction_by_id(bot, channel, message_id, emoji)
+        logging.info(f"(Reader) Reaction added: {emoji}")
+    except (disnake.NotFound, disnake.Forbidden) as e:
+        logging.info(f"(Reader) Cannot react to {message_id}: {e}")
+    except disnake.HTTPException as e:
+        if e.status == 400:
+            # e.g. an unknown emoji, which a retry would not fix
+            logging.info(f"(Reader) Cannot react to {message_id}: {e}")
+        else:
+            # reclaimed after RECLAIM_IDLE_SECONDS
+            logging.exception(f"(Reader) Failed to sully, delivery {item.deliveries}")
+            return
+    finally:
+        in_flight.discard(item.id)
+    await queue.ack(item.id)
+
+
+async def dispatch(item: WorkItem) -> None:
+    """
+    Parses and resolves a request, and hands the reaction over to the
+    pipeline. Waits while the pipeline is full.
+    """
+    if item.id in in_flight:
+        # reclaimed while still waiting in our own pipeline
+        return
+    msg = parse(item)
+    target = None if msg is None else resolve(msg)
+    if target is None:
+        await queue.ack(item.id)
+        return
+    channel, emoji = target
+    in_flight.add(item.id)
+    # the reactions of a channel share a rate limit, and are added in order
+    await pipeline.submit(
+        channel.id, lambda: react(item, channel, msg.message_id, emoji)
+    )
+
+
+async def reader():
     while True:
         try:
-            async with async_timeout.timeout(1):
-                message = await ps_channel.get_message(ignore_subscribe_messages=True)
-                if message is not None:
-                    logging.info(f"(Reader) Message Received: {message}")
-                    msg = AutoSullyRequest.parse_raw(message["data"])
-                    logging.info(f"(Reader) Parsed Message: {msg}")
-                    guild = bot.get_guild(msg.guild_id)
-                    if guild is None:
-                        logging.info(f"(Reader) Guild not found: {msg.guild_id}")
-                        continue
-                    logging.info(f"(Reader) Guild found: {guild.name}")
-                    channel: disnake.TextChannel = guild.get_channel(msg.channel_id)
-                    if channel is None:
-                        logging.info(f"(Reader) Channel not found: {msg.channel_id}")
-                        continue
-                    logging.info(f"(Reader) Channel found: {channel.name}")
-                    message = await channel.fetch_message(msg.message_id)
-                    if message is None:
-                        logging.info(f"(Reader) Message not found: {msg.message_id}")
-                        continue
-                    logging.info(f"(Reader) Message found: {message.content}")
-                    # logging.info(guild.emojis)
-                    if isinstance(msg.emoji_id, str):
-                        # we are working with a unicode emoji
-                        emoji = msg.emoji_id
-                    else:
-                        emoji = bot.get_emoji(msg.emoji_id)
-                        if emoji is None:
-                            logging.info(f"(Reader) Emoji not found: {msg.emoji_id}")
-                            continue
-                    await message.add_reaction(emoji)
-                    logging.info(f"(Reader) Reaction added: {emoji}")
-                await asyncio.sleep(0.01)
-
-        except asyncio.TimeoutError:
-            pass
+            async for item in queue.consume(RECLAIM_IDLE_SECONDS):
+                await dispatch(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # e.g. redis is restarting
+            logging.exception("(Reader) Failed to read from the queue")
+            await asyncio.sleep(1)
 
 
 @bot.event
 async def on_ready():
+    global reader_task
     logging.info(f"We have logged in as {bot.user}")
     await bot.change_presence(activity=disnake.Game(name="Ready to sully"))
-    async with pubsub as p:
-        await p.subscribe("autosully")
-        await reader(pubsub)
+    # on_ready fires again after every reconnect
+    if reader_task is None:
+        reader_task = asyncio.create_task(reader())
 
 
 if __name__ == "__main__":
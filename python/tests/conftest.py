@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from derpz_botlib.database.db import SqlAlchemyBase, create_engine_from_url
+from derpz_botlib.database.storage import (
+    AsyncSqlAlchemyKvJsonStore,
+    InMemoryKvJsonStore,
+)
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    """
+    Makes engines on SQLite databases in tmp_path, named by the argument, with
+    every table created. They are disposed of after the test.
+    """
+    engines = []
+
+    def make(name: str = "kv.db"):
+        engine = create_engine_from_url(f"sqlite+aiosqlite:///{tmp_path / name}")
+
+        async def create_tables():
+            async with engine.begin() as conn:
+                await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+
+        asyncio.run(create_tables())
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def engine(make_engine):
+    return make_engine()
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, engine):
+    if request.param == "memory":
+        return InMemoryKvJsonStore()
+    return AsyncSqlAlchemyKvJsonStore(engine)
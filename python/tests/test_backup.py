@@ -0,0 +1,86 @@
+import asyncio
+import datetime
+import io
+
+import pytest
+import sqlalchemy
+from derpz_botlib.database.backup import (
+    BackupError,
+    export_tables,
+    import_tables,
+    open_backup,
+)
+from derpz_botlib.database.storage import AsyncSqlAlchemyKvJsonStore
+from derpz_botlib.database.tables import cog_config_store
+
+# the plugins register their tables on SqlAlchemyBase when imported
+from math_tavern_bot_py.plugins.plugin_remind_me import Reminder, ReminderManager
+
+TABLES = [cog_config_store, Reminder.__table__]
+REMIND_AT = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+async def seed(engine, guilds: int):
+    await AsyncSqlAlchemyKvJsonStore(engine).batch_set(
+        {f"{guild_id}.Cog": {"members": [guild_id]} for guild_id in range(guilds)}
+    )
+    await ReminderManager(engine).create_reminder(1, REMIND_AT, "backup")
+
+
+async def dump(engine) -> dict:
+    async with engine.connect() as conn:
+        return {
+            table.name: (
+                await conn.execute(
+                    sqlalchemy.select(table).order_by(*table.primary_key.columns)
+                )
+            ).all()
+            for table in TABLES
+        }
+
+
+def test_export_then_import_clones_the_tables(make_engine):
+    source = make_engine("source.db")
+    target = make_engine("target.db")
+
+    async def run():
+        await seed(source, 25)
+        # the target has rows of its own, which are replaced
+        await AsyncSqlAlchemyKvJsonStore(target).set("99.Cog", {"members": []})
+        fp = io.BytesIO()
+        exported = await export_tables(source, TABLES, fp, batch_size=10)
+        fp.seek(0)
+        imported = await import_tables(target, TABLES, fp, replace=True, batch_size=10)
+        # importing again without replace merges into the same rows
+        fp.seek(0)
+        await import_tables(target, TABLES, fp)
+        return exported, imported, await dump(source), await dump(target)
+
+    exported, imported, source_rows, target_rows = asyncio.run(run())
+    assert exported == imported == {"cog_config_store": 25, "user_reminders": 1}
+    assert target_rows == source_rows
+
+
+def test_compressed_backups(tmp_path, make_engine):
+    pytest.importorskip("zstandard")
+    source = make_engine("source.db")
+    target = make_engine("target.db")
+    path = tmp_path / "backup.ndjson.zst"
+
+    async def run():
+        await seed(source, 3)
+        with open_backup(path, "wb") as fp:
+            await export_tables(source, TABLES, fp)
+        with open_backup(path, "rb") as fp:
+            await import_tables(target, TABLES, fp)
+        return await dump(source), await dump(target)
+
+    source_rows, target_rows = asyncio.run(run())
+    assert target_rows == source_rows
+    assert not path.read_bytes().startswith(b"{")
+
+
+def test_import_rejects_other_files(make_engine):
+    engine = make_engine("target.db")
+    with pytest.raises(BackupError):
+        asyncio.run(import_tables(engine, TABLES, io.BytesIO(b'{"not": "a backup"}\n')))
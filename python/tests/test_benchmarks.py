@@ -0,0 +1,98 @@
+import json
+
+from benchmarks import (
+    bench_config_store,
+    bench_import_time,
+    bench_serialization,
+    bench_sully_index,
+    bench_sully_pipeline,
+)
+
+
+def test_config_store_benchmark_writes_json(tmp_path):
+    output = tmp_path / "results.json"
+    bench_config_store.main(
+        ["--sizes", "5", "--repeat", "2", "--samples", "3", "--output", str(output)]
+    )
+    report = json.loads(output.read_text())
+    assert report["meta"]["dialect"] == "sqlite"
+    results = {result["benchmark"]: result for result in report["results"]}
+    assert {"get", "batch_get", "set", "batch_set_insert", "cog_load"} <= set(results)
+    assert results["batch_get"]["ops"] == 5
+    assert results["get"]["ops"] == 3
+    assert len(results["cog_unload_flush"]["runs"]) == 2
+
+
+def test_serialization_benchmark_writes_json(tmp_path):
+    output = tmp_path / "results.json"
+    bench_serialization.main(
+        ["--sizes", "3", "--repeat", "1", "--budget", "3", "--output", str(output)]
+    )
+    report = json.loads(output.read_text())
+    configs = {result["config"] for result in report["results"]}
+    assert configs == {"TierListPluginConfiguration", "AutoPurgeConfig"}
+    for result in report["results"]:
+        assert set(result["seconds"]) == {
+            "encode_legacy",
+            "encode",
+            "decode_legacy",
+            "decode",
+        }
+
+
+def test_plugins_import_their_heavy_dependencies_lazily(tmp_path):
+    output = tmp_path / "results.json"
+    modules = [
+        "math_tavern_bot_py.plugins.plugin_remind_me",
+        "math_tavern_bot_py.plugins.plugin_libgen_search",
+        "math_tavern_bot_py.plugins.plugin_bot_admin",
+    ]
+    exit_code = bench_import_time.main(
+        ["--modules", ",".join(modules), "--repeat", "1", "--output", str(output)]
+    )
+    report = json.loads(output.read_text())
+    assert [result["module"] for result in report["results"]] == modules
+    for result in report["results"]:
+        assert result["eager_lazy_dependencies"] == []
+        assert result["cumulative_ms"] > 0
+    assert exit_code == 0
+
+
+def test_sully_index_benchmark_writes_json(tmp_path):
+    output = tmp_path / "results.json"
+    bench_sully_index.main(
+        [
+            "--guilds",
+            "20",
+            "--messages",
+            "200",
+            "--repeat",
+            "1",
+            "--output",
+            str(output),
+        ]
+    )
+    report = json.loads(output.read_text())
+    assert set(report["results"]) == {"dispatch", "legacy", "indexed"}
+    assert report["meta"]["messages"] == 200
+
+
+def test_sully_pipeline_benchmark_writes_json(tmp_path):
+    output = tmp_path / "results.json"
+    bench_sully_pipeline.main(
+        [
+            "--requests",
+            "20",
+            "--channels",
+            "4",
+            "--react-ms",
+            "10",
+            "--idle-seconds",
+            "0.1",
+            "--output",
+            str(output),
+        ]
+    )
+    report = json.loads(output.read_text())
+    assert report["burst"]["pipeline_seconds"] < report["burst"]["serial_seconds"]
+    assert set(report["idle"]) == {"polling", "consume"}
@@ -0,0 +1,382 @@
+import asyncio
+import dataclasses
+import logging
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy
+from derpz_botlib.cog import DatabaseConfigurableCog
+from derpz_botlib.database.storage import (
+    AsyncSqlAlchemyKvJsonStore,
+    CogConfigStore,
+    CogConfiguration,
+    merge_configs,
+    migrate_json_config_store,
+)
+
+
+def test_compare_and_set(store):
+    async def run():
+        assert await store.get_versioned("1.Cog") == (None, None)
+        assert await store.compare_and_set("1.Cog", {"a": 1}, None) == 0
+        # the key exists now
+        assert await store.compare_and_set("1.Cog", {"a": 2}, None) is None
+        assert await store.compare_and_set("1.Cog", {"a": 2}, 0) == 1
+        # a stale version loses
+        assert await store.compare_and_set("1.Cog", {"a": 3}, 0) is None
+        # every other kind of write bumps the version too
+        await store.set("1.Cog", {"a": 4})
+        await store.add_to_set("1.Cog", "members", 1)
+        return await store.get_versioned("1.Cog")
+
+    assert asyncio.run(run()) == ({"a": 4, "members": [1]}, 3)
+
+
+def test_merge_configs():
+    base = {
+        "members": [1, 2],
+        "order": [1, 2],
+        "entries": {"a": 1, "b": 2},
+        "name": "x",
+        "old": 1,
+    }
+    ours = {
+        "members": [1, 3],
+        "order": [2, 1],
+        "entries": {"a": 1, "b": 3},
+        "name": "y",
+        "old": 1,
+    }
+    theirs = {
+        "members": [1, 2, 4],
+        "order": [1, 2, 3],
+        "entries": {"b": 2, "c": 4},
+        "name": "z",
+    }
+    assert merge_configs(base, ours, theirs, {"members"}) == {
+        # both sides' additions are kept, our removal of 2 too
+        "members": [1, 3, 4],
+        "entries": {"b": 3, "c": 4},
+        # both changed a scalar or a plain list, we win
+        "order": [2, 1],
+        "name": "y",
+    }
+    assert merge_configs(None, {"a": 1}, None) == {"a": 1}
+    # ours was never stored, so they win
+    assert merge_configs(
+        None, {"members": [1], "a": 1, "b": 1}, {"members": [2], "a": 2}, {"members"}
+    ) == {"members": [1, 2], "a": 2, "b": 1}
+
+
+class Config(CogConfiguration):
+    members: set[int] = set()
+    name: str = ""
+
+
+class Tiers(CogConfiguration):
+    members: set[int] = set()
+
+
+class TieredConfig(CogConfiguration):
+    tiers: dict[str, set[int]] = {}
+    ranks: dict[str, list[int]] = {}
+    default: Tiers = Tiers()
+
+
+def test_set_fields():
+    assert Config.set_fields() == {"members"}
+    assert TieredConfig.set_fields() == {"tiers.*", "default.members"}
+
+
+def test_merge_configs_merges_nested_sets():
+    base = {"tiers": {"a": [1]}, "ranks": {"a": [1]}, "default": {"members": [1]}}
+    ours = {
+        "tiers": {"a": [1, 2]},
+        "ranks": {"a": [1, 2]},
+        "default": {"members": [1, 2]},
+    }
+    theirs = {
+        "tiers": {"a": [1, 3], "b": [4]},
+        "ranks": {"a": [1, 3]},
+        "default": {"members": [3]},
+    }
+    assert merge_configs(base, ours, theirs, TieredConfig.set_fields()) == {
+        "tiers": {"a": [1, 2, 3], "b": [4]},
+        # a plain list, we win
+        "ranks": {"a": [1, 2]},
+        "default": {"members": [2, 3]},
+    }
+
+
+class ConfigCog(DatabaseConfigurableCog[Config]):
+    def __init__(self, bot):
+        super().__init__(bot, Config)
+
+
+class TieredCog(DatabaseConfigurableCog[TieredConfig]):
+    def __init__(self, bot):
+        super().__init__(bot, TieredConfig)
+
+
+@dataclasses.dataclass(frozen=True)
+class Guild:
+    id: int
+    name: str = "guild"
+
+
+def make_cog(engine, *guilds, cog_class=ConfigCog):
+    """A cog in its own process, i.e. with its own config store"""
+    cog_config_store = CogConfigStore(
+        AsyncSqlAlchemyKvJsonStore(engine), logger=logging.getLogger("test")
+    )
+    guilds_by_id = {guild.id: guild for guild in guilds}
+    bot = SimpleNamespace(
+        logger=logging.getLogger("test"),
+        cog_config_store=cog_config_store,
+        guilds=list(guilds),
+        get_guild=guilds_by_id.get,
+        is_ready=lambda: True,
+    )
+    return cog_class(bot)
+
+
+def test_concurrent_processes_do_not_lose_updates(engine):
+    guild = Guild(1)
+    first, second = make_cog(engine, guild), make_cog(engine, guild)
+
+    async def run():
+        await first.save_guild_config(guild, Config(members={1}))
+        await first.cog_load()
+        await second.cog_load()
+        await first.save_guild_config(guild, Config(members={1, 2}))
+        # second still has the config from before first saved
+        await second.save_guild_config(guild, Config(members={1, 3}, name="b"))
+        await first.save_guild_config(
+            guild, first.get_guild_config(guild).copy(update={"name": "a"})
+        )
+        await second.reload_guild_configs()
+        return first.get_guild_config(guild), second.get_guild_config(guild)
+
+    first_config, second_config = asyncio.run(run())
+    assert first_config == Config(members={1, 2, 3}, name="a")
+    assert second_config == first_config
+
+
+def test_saving_a_new_config_keeps_what_was_stored_meanwhile(engine):
+    guild = Guild(1)
+    first, second = make_cog(engine, guild), make_cog(engine, guild)
+
+    async def run():
+        await first.cog_load()
+        config = first.get_guild_config(guild)
+        await second.save_guild_config(guild, Config(members={1}, name="b"))
+        config.members.add(2)
+        await first.save_guild_config(guild, config)
+        return first.get_guild_config(guild)
+
+    assert asyncio.run(run()) == Config(members={1, 2}, name="b")
+
+
+def test_concurrent_adds_to_nested_sets_are_merged(engine):
+    guild = Guild(1)
+    first, second = [make_cog(engine, guild, cog_class=TieredCog) for _ in range(2)]
+
+    async def run():
+        await first.save_guild_config(guild, TieredConfig(tiers={"gold": {1}}))
+        await first.cog_load()
+        await second.cog_load()
+        first.get_guild_config(guild).tiers["gold"].add(2)
+        second.get_guild_config(guild).tiers["gold"].add(3)
+        await first.save_guild_config(guild, first.get_guild_config(guild))
+        await second.save_guild_config(guild, second.get_guild_config(guild))
+        return second.get_guild_config(guild)
+
+    assert asyncio.run(run()) == TieredConfig(tiers={"gold": {1, 2, 3}})
+
+
+def test_saves_of_one_guild_are_serialized(engine):
+    guild = Guild(1)
+    cog = make_cog(engine, guild)
+    statements = []
+
+    @sqlalchemy.event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def run():
+        await asyncio.gather(
+            *(cog.save_guild_config(guild, Config(name=str(n))) for n in range(10))
+        )
+        return await cog.bot.cog_config_store.get_cog_config_versioned(1, cog)
+
+    config, version = asyncio.run(run())
+    # every save after the first knows the version, so nothing had to be merged
+    assert version == 9
+    assert config == {"members": [], "name": "9"}
+    assert sum(statement.startswith("UPDATE") for statement in statements) == 9
+
+
+def test_configs_are_parsed_on_first_access(engine):
+    guild, other_guild = Guild(1), Guild(2)
+    cog = make_cog(engine, guild, other_guild)
+
+    async def run():
+        await cog.bot.cog_config_store.batch_set_cog_config(
+            cog, {1: Config(name="a"), 2: Config(name="b")}
+        )
+        await cog.cog_load()
+        assert cog.config == {}
+        assert cog.get_guild_config(guild) == Config(name="a")
+        assert list(cog.config) == [1]
+        # a guild without a config gets a new one, which is kept but not dirty
+        assert cog.get_guild_config(3) is cog.get_guild_config(3)
+        assert cog.dirty_guild_configs() == {}
+        await cog.on_guild_remove(other_guild)
+        assert cog.get_guild_config(other_guild) == Config()
+        await cog.on_guild_join(other_guild)
+        return cog.get_guild_config(other_guild), dict(cog.iter_guild_configs())
+
+    other_config, configs = asyncio.run(run())
+    assert other_config == Config(name="b")
+    assert configs == {1: Config(name="a"), 2: Config(name="b"), 3: Config()}
+
+
+def test_partial_updates_keep_other_unsaved_changes(engine):
+    guild = Guild(1)
+    cog = make_cog(engine, guild)
+
+    async def run():
+        await cog.save_guild_config(guild, Config(members={1}, name="stored"))
+        config = cog.get_guild_config(guild)
+        # changed in memory only
+        config.name = "edited"
+        config.members.add(2)
+        await cog.add_to_guild_config_set(guild, "members", 3)
+        assert config.dirty
+        assert await cog.flush_guild_configs() == 1
+        stored, _ = await cog.bot.cog_config_store.get_cog_config_versioned(1, cog)
+        assert stored == {"members": [1, 2, 3], "name": "edited"}
+
+        # a partial update which is the only change leaves the config clean
+        await cog.add_to_guild_config_set(guild, "members", 4)
+        assert not config.dirty
+        # and the next save merges against what the partial update stored
+        config.name = "saved"
+        await cog.save_guild_config(guild, config)
+        stored, _ = await cog.bot.cog_config_store.get_cog_config_versioned(1, cog)
+        assert stored == {"members": [1, 2, 3, 4], "name": "saved"}
+
+    asyncio.run(run())
+
+
+def test_reloads_keep_unsaved_changes(engine):
+    guild = Guild(1)
+    first, second = make_cog(engine, guild), make_cog(engine, guild)
+
+    async def run():
+        await first.save_guild_config(guild, Config(members={1}, name="a"))
+        await first.cog_load()
+        await second.cog_load()
+        config = first.get_guild_config(guild)
+        # changed in memory only
+        config.members.add(2)
+        await second.save_guild_config(guild, Config(members={1, 3}, name="b"))
+        # as on a NOTIFY, and then on a LISTEN reconnect
+        first.bot.cog_config_store.invalidate(f"1.{first.qualified_name}")
+        await first.drain_pending_work()
+        assert first.get_guild_config(guild) is config
+        assert config == Config(members={1, 2, 3}, name="b")
+        assert config.dirty
+        config.name = "c"
+        first.bot.cog_config_store.invalidate_all()
+        await first.drain_pending_work()
+        assert config == Config(members={1, 2, 3}, name="c")
+        assert await first.flush_guild_configs() == 1
+        stored, _ = await first.bot.cog_config_store.get_cog_config_versioned(1, first)
+        assert stored == {"members": [1, 2, 3], "name": "c"}
+
+    asyncio.run(run())
+
+
+def test_partial_updates_change_the_stored_copy_in_place(engine):
+    guild = Guild(1)
+    cog = make_cog(engine, guild)
+    store = cog.bot.cog_config_store
+
+    async def run():
+        await store.batch_set_cog_config(cog, {1: Config(members=set(range(1000)))})
+        # what was read on load may be shared, it is copied once
+        await cog.cog_load()
+        cached = cog._stored_configs[1]
+        await cog.add_to_guild_config_set(guild, "members", 1000)
+        stored = cog._stored_configs[1]
+        assert stored is not cached and 1000 not in cached["members"]
+        members = stored["members"]
+        await cog.add_to_guild_config_set(guild, "members", 1001)
+        await cog.discard_from_guild_config_set(guild, "members", 0)
+        assert cog._stored_configs[1] is stored
+        assert stored["members"] is members
+        return members
+
+    assert asyncio.run(run()) == list(range(1, 1002))
+
+
+def test_dict_entry_updates_change_the_stored_copy(engine):
+    guild = Guild(1)
+    cog = make_cog(engine, guild, cog_class=TieredCog)
+
+    async def run():
+        await cog.cog_load()
+        await cog.set_guild_config_dict_entry(guild, "ranks", 1, [1])
+        await cog.set_guild_config_dict_entry(guild, "ranks", 2, [2])
+        await cog.delete_guild_config_dict_entry(guild, "ranks", 1)
+        stored, _ = await cog.bot.cog_config_store.get_cog_config_versioned(1, cog)
+        return cog._stored_configs[1], stored, cog.get_guild_config(guild)
+
+    copy, stored, config = asyncio.run(run())
+    assert copy == stored == {"ranks": {"2": [2]}}
+    assert not config.dirty
+
+
+@pytest.mark.parametrize("with_version", [True, False])
+def test_migration_copies_the_legacy_table(engine, with_version):
+    async def run():
+        async with engine.begin() as conn:
+            await conn.execute(
+                sqlalchemy.text(
+                    "CREATE TABLE json_config_store (id VARCHAR PRIMARY KEY, data JSON"
+                    + (", version BIGINT NOT NULL DEFAULT 0)" if with_version else ")")
+                )
+            )
+            for key in ["1.Cog", "2.Cog", "1.Other", "not a key"]:
+                await conn.execute(
+                    sqlalchemy.text(
+                        "INSERT INTO json_config_store (id, data) "
+                        "VALUES (:key, :data)"
+                    ),
+                    dict(key=key, data=f'{{"key": "{key}"}}'),
+                )
+            if with_version:
+                await conn.execute(
+                    sqlalchemy.text("UPDATE json_config_store SET version = 3")
+                )
+        store = AsyncSqlAlchemyKvJsonStore(engine)
+        # written by the new release before the migration ran
+        await store.set("2.Cog", {"key": "new"})
+        copied = await migrate_json_config_store(engine, batch_size=2)
+        configs = {key: value async for key, value in store.scan()}
+        versioned = await store.get_versioned("1.Cog")
+        # running it again is a no-op, and does not bring deleted configs back
+        await store.delete_guild(1)
+        assert await migrate_json_config_store(engine, batch_size=2) == 0
+        assert [key async for key, _ in store.scan()] == ["2.Cog"]
+        return copied, configs, versioned
+
+    copied, configs, versioned = asyncio.run(run())
+    assert copied == 2
+    assert configs == {
+        "1.Cog": {"key": "1.Cog"},
+        "1.Other": {"key": "1.Other"},
+        "2.Cog": {"key": "new"},
+    }
+    assert versioned == ({"key": "1.Cog"}, 3 if with_version else 0)
@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import disnake
+from derpz_botlib.bot_classes import ConfigurableCogsBot
+from derpz_botlib.database.db import create_engine_from_url
+from derpz_botlib.discord_utils.emoji import EmojiResolver
+from disnake.ext import commands
+from math_tavern_bot_py.plugins.plugin_autosully import (
+    AutoSullyConfig,
+    AutoSullyPlugin,
+)
+
+
+def test_emojis_are_resolved_without_fetching():
+    cached = object()
+    bot = SimpleNamespace(get_emoji={10: cached}.get)
+    resolver = EmojiResolver(bot)
+    assert resolver.resolve(1, 10) is cached
+    partial = resolver.resolve(1, 20)
+    assert isinstance(partial, disnake.PartialEmoji) and partial.id == 20
+    assert resolver.resolve(1, 20) is partial
+    resolver.invalidate(1, 20)
+    assert resolver.resolve(1, 20) is not partial
+    resolver.invalidate(1)
+    assert resolver._emojis == {}
+
+
+def test_auto_sully_reacts_with_one_call(tmp_path):
+    async def run():
+        bot = ConfigurableCogsBot(
+            command_prefix=commands.when_mentioned,
+            intents=disnake.Intents.none(),
+            engine=create_engine_from_url(f"sqlite+aiosqlite:///{tmp_path / 'db'}"),
+        )
+        plugin = AutoSullyPlugin(bot)
+        plugin.config[1] = AutoSullyConfig(sully_emoji=10, sully_users={7})
+        calls = []
+
+        async def fetch_emoji(emoji_id):
+            calls.append(("fetch_emoji", emoji_id))
+
+        async def add_reaction(emoji):
+            calls.append(("add_reaction", emoji.id))
+
+        guild = SimpleNamespace(id=1, fetch_emoji=fetch_emoji)
+        for author in (7, 7, 8):
+            message = SimpleNamespace(
+                guild=guild,
+                author=SimpleNamespace(id=author),
+                add_reaction=add_reaction,
+            )
+            await plugin.on_message(message)
+        await plugin.on_guild_emojis_update(guild, [], [])
+        await bot.close()
+        return calls, plugin.emoji_resolver._emojis
+
+    calls, resolved = asyncio.run(run())
+    assert calls == [("add_reaction", 10), ("add_reaction", 10)]
+    assert resolved == {}
+
+
+def test_sully_index_follows_config_changes(tmp_path):
+    async def run():
+        bot = ConfigurableCogsBot(
+            command_prefix=commands.when_mentioned,
+            intents=disnake.Intents.none(),
+            engine=create_engine_from_url(f"sqlite+aiosqlite:///{tmp_path / 'db'}"),
+        )
+        await bot._init_db()
+        plugin = AutoSullyPlugin(bot)
+        plugin.config[1] = AutoSullyConfig(sully_emoji=10, sully_users={7})
+        reactions = []
+
+        async def add_reaction(emoji):
+            reactions.append(emoji.id)
+
+        guild = SimpleNamespace(id=1, name="Tavern")
+
+        async def message_from(author: int):
+            await plugin.on_message(
+                SimpleNamespace(
+                    guild=guild,
+                    author=SimpleNamespace(id=author),
+                    add_reaction=add_reaction,
+                )
+            )
+
+        await message_from(8)
+        index = dict(plugin._sully_index)
+        await plugin.add_to_guild_config_set(guild, "sully_users", 8)
+        dropped = 1 not in plugin._sully_index
+        await message_from(8)
+        await message_from(9)
+        await bot.close()
+        return index, dropped, reactions
+
+    index, dropped, reactions = asyncio.run(run())
+    assert index[1].users == frozenset({7}) and index[1].emoji.id == 10
+    assert dropped
+    assert reactions == [10]
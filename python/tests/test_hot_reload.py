@@ -0,0 +1,104 @@
+import asyncio
+
+import disnake
+from derpz_botlib.bot_classes import ConfigurableCogsBot
+from derpz_botlib.database.db import create_engine_from_url
+from derpz_botlib.database.serialization import encode_config
+from disnake.ext import commands
+
+EXTENSION = """
+import asyncio
+from derpz_botlib.cog import DatabaseConfigurableCog
+from derpz_botlib.database.storage import CogConfiguration
+
+VERSION = {version}
+
+
+class Config(CogConfiguration):
+    members: set[int] = set()
+
+
+class ReloadedCog(DatabaseConfigurableCog[Config]):
+    def __init__(self, bot):
+        super().__init__(bot, Config)
+        self.ticker = None
+
+    async def cog_load(self):
+        await super().cog_load()
+        if self.ticker is None:
+            self.ticker = asyncio.create_task(asyncio.sleep(60))
+
+    def cog_unload(self):
+        super().cog_unload()
+        if self.ticker is not None:
+            self.ticker.cancel()
+
+    def hand_over_state(self):
+        state = super().hand_over_state()
+        state["ticker"], self.ticker = self.ticker, None
+        return state
+
+    def take_over_state(self, state):
+        super().take_over_state(state)
+        self.ticker = state.get("ticker")
+
+
+def setup(bot):
+    bot.add_cog(ReloadedCog(bot))
+"""
+
+
+def test_hot_reload_hands_the_state_over(tmp_path, monkeypatch):
+    module = tmp_path / "reloaded_extension.py"
+    module.write_text(EXTENSION.format(version=1))
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    async def run():
+        bot = ConfigurableCogsBot(
+            command_prefix=commands.when_mentioned,
+            intents=disnake.Intents.none(),
+            engine=create_engine_from_url(f"sqlite+aiosqlite:///{tmp_path / 'kv.db'}"),
+        )
+        await bot._init_db()
+        await bot.load_extensions_concurrently(["reloaded_extension"])
+        old = bot.get_cog("ReloadedCog")
+        ticker = old.ticker
+        old.config[1] = old._configclass(members={1})
+        old._stored_configs[2] = encode_config(old._configclass(members={2}))
+        old.get_guild_config(3)
+
+        module.write_text(EXTENSION.format(version=2))
+        report = await bot.hot_reload_extension("reloaded_extension")
+        new = bot.get_cog("ReloadedCog")
+        assert report.failed == {} and report.seconds < 1
+        assert new is not old and type(new).__module__ == "reloaded_extension"
+        assert __import__("reloaded_extension").VERSION == 2
+        assert new.took_over_state
+        # the configs were converted to the new class, and stayed (not) dirty
+        assert type(new.config[1]) is new._configclass
+        assert new.config[1].members == {1} and new.config[1].dirty
+        assert not new.config[3].dirty
+        assert new.get_guild_config(2).members == {2}
+        assert new.ticker is ticker and not ticker.done()
+        # nothing was written or scheduled to be
+        assert old.config == {} and not bot._config_flushes
+        assert not await bot.kv_store.batch_get(["1.ReloadedCog"])
+
+        # broken code: the old code is loaded again, and takes the state back
+        module.write_text("this is not python")
+        report = await bot.hot_reload_extension("reloaded_extension")
+        assert list(report.failed) == ["reloaded_extension"]
+        rolled_back = bot.get_cog("ReloadedCog")
+        assert rolled_back not in (None, new)
+        assert rolled_back.config[1].dirty and rolled_back.ticker is ticker
+
+        await bot.close()
+        flushed = bot.config_flush_report.flushed
+        stored = await bot.kv_store.batch_get(["1.ReloadedCog"])
+        await bot.engine.dispose()
+        return flushed, stored, ticker
+
+    flushed, stored, ticker = asyncio.run(run())
+    assert flushed == {"ReloadedCog": 1}
+    assert stored == {"1.ReloadedCog": {"members": [1]}}
+    assert ticker.cancelled()
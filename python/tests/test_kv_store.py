@@ -0,0 +1,419 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import psycopg
+import sqlalchemy
+from derpz_botlib.database import serialization
+from derpz_botlib.database.storage import (
+    AsyncSqlAlchemyKvJsonStore,
+    CogConfigStore,
+    CogConfiguration,
+    ConfigChangeListener,
+    InMemoryKvJsonStore,
+    TTLCache,
+)
+
+
+def record_statements(engine) -> list[str]:
+    """Records every statement executed against the engine from now on"""
+    statements = []
+
+    @sqlalchemy.event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    return statements
+
+
+def test_set_inserts_then_updates(store):
+    async def run():
+        await store.set("1.Cog", {"a": 1})
+        assert await store.get("1.Cog") == {"a": 1}
+        await store.set("1.Cog", {"a": 2})
+        assert await store.get("1.Cog") == {"a": 2}
+
+    asyncio.run(run())
+
+
+def test_batch_set_mixes_inserts_and_updates(store):
+    async def run():
+        await store.batch_set({"1.Cog": {"a": 1}, "2.Cog": {"a": 2}})
+        await store.batch_set({"2.Cog": {"a": 3}, "3.Cog": {"a": 4}})
+        return await store.batch_get(["1.Cog", "2.Cog", "3.Cog"])
+
+    assert asyncio.run(run()) == {
+        "1.Cog": {"a": 1},
+        "2.Cog": {"a": 3},
+        "3.Cog": {"a": 4},
+    }
+
+
+def test_batch_set_flushes_5000_keys_in_one_statement(engine):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    key_value_map = {f"{guild_id}.Cog": {"n": guild_id} for guild_id in range(5000)}
+
+    async def run():
+        # half of the keys already exist, so this is a mix of inserts and updates
+        await store.batch_set(dict(list(key_value_map.items())[:2500]))
+        statements = record_statements(engine)
+        await store.batch_set(key_value_map)
+        flush_statements = list(statements)
+        return flush_statements, await store.batch_get(list(key_value_map.keys()))
+
+    flush_statements, stored = asyncio.run(run())
+    assert len(flush_statements) == 1
+    assert "ON CONFLICT" in flush_statements[0]
+    assert stored == key_value_map
+
+
+class DummyConfig(CogConfiguration):
+    value: int = 0
+
+
+def test_write_behind_coalesces_writes(engine):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    cog_config_store = CogConfigStore(
+        store,
+        logger=logging.getLogger("test"),
+        write_behind=True,
+        flush_interval=60,
+    )
+    cog = SimpleNamespace(qualified_name="Cog")
+    guilds = [SimpleNamespace(id=guild_id, name="guild") for guild_id in range(10)]
+
+    async def run():
+        statements = record_statements(engine)
+        for value in range(3):
+            for guild in guilds:
+                await cog_config_store.set_cog_config(
+                    cog, guild, DummyConfig(value=value)
+                )
+        assert statements == []
+        await cog_config_store.close()
+        flush_statements = list(statements)
+        return flush_statements, await cog_config_store.get_cog_config(
+            [guild.id for guild in guilds], cog
+        )
+
+    flush_statements, stored = asyncio.run(run())
+    assert len(flush_statements) == 1
+    assert stored == {guild.id: {"value": 2} for guild in guilds}
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is now the least recently used entry
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    now[0] = 11
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_cached_reads_skip_the_store_until_invalidated(engine):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    cog_config_store = CogConfigStore(
+        store, logger=logging.getLogger("test"), cache=TTLCache(100, 60)
+    )
+    cog = SimpleNamespace(qualified_name="Cog")
+    invalidated = []
+    cog_config_store.subscribe(cog, invalidated.append)
+
+    async def run():
+        await store.set("1.Cog", {"value": 1})
+        assert await cog_config_store.get_cog_config([1, 2], cog) == {1: {"value": 1}}
+        # another process changes the row behind our back
+        await store.set("1.Cog", {"value": 2})
+        statements = record_statements(engine)
+        assert await cog_config_store.get_cog_config([1, 2], cog) == {1: {"value": 1}}
+        assert statements == []
+        cog_config_store.invalidate("1.Cog")
+        assert await cog_config_store.get_cog_config([1, 2], cog) == {1: {"value": 2}}
+
+    asyncio.run(run())
+    assert invalidated == [1]
+
+
+def test_reads_racing_a_partial_update_do_not_cache_the_old_row():
+    class SlowStore(InMemoryKvJsonStore):
+        async def batch_get(self, keys):
+            # the row is read before the update commits, and returned after
+            value = self.batch_get_sync(keys)
+            await asyncio.sleep(0.01)
+            return value
+
+    store = SlowStore()
+    cog_config_store = CogConfigStore(
+        store, logger=logging.getLogger("test"), cache=TTLCache(100, 60)
+    )
+    cog = SimpleNamespace(qualified_name="Cog")
+    guild = SimpleNamespace(id=1, name="Guild")
+
+    async def run():
+        await store.set("1.Cog", {"members": [1]})
+        read = asyncio.create_task(cog_config_store.get_cog_config([1], cog))
+        await asyncio.sleep(0)
+        await cog_config_store.add_to_cog_config_set(cog, guild, "members", 2)
+        assert await read == {1: {"members": [1]}}
+        return await cog_config_store.get_cog_config([1], cog)
+
+    assert asyncio.run(run()) == {1: {"members": [1, 2]}}
+
+
+def test_partial_updates(store):
+    async def run():
+        await store.set("1.Cog", {"other": 1})
+        await store.add_to_set("1.Cog", "members", 5)
+        await store.add_to_set("1.Cog", "members", 6)
+        await store.add_to_set("1.Cog", "members", 5)
+        await store.remove_from_set("1.Cog", "members", 6)
+        await store.set_dict_entry("1.Cog", "entries", 10, {"a": {1, 2}})
+        await store.set_dict_entry("1.Cog", "entries", 11, 1)
+        await store.delete_dict_entry("1.Cog", "entries", 11)
+        # values which do not exist yet are created
+        await store.add_to_set("2.Cog", "members", 1)
+        return await store.batch_get(["1.Cog", "2.Cog"])
+
+    assert asyncio.run(run()) == {
+        "1.Cog": {"other": 1, "members": [5], "entries": {"10": {"a": [1, 2]}}},
+        "2.Cog": {"members": [1]},
+    }
+
+
+def test_partial_updates_which_change_nothing_keep_the_version(store):
+    async def run():
+        await store.set("1.Cog", {"members": [1], "entries": {"1": 1}})
+        _, version = await store.get_versioned("1.Cog")
+        await store.remove_from_set("1.Cog", "members", 2)
+        await store.delete_dict_entry("1.Cog", "entries", 2)
+        await store.remove_from_set("2.Cog", "members", 1)
+        assert await store.get_versioned("1.Cog") == (
+            {"members": [1], "entries": {"1": 1}},
+            version,
+        )
+        assert await store.get_versioned("2.Cog") == (None, None)
+        await store.remove_from_set("1.Cog", "members", 1)
+        assert (await store.get_versioned("1.Cog"))[1] == version + 1
+
+    asyncio.run(run())
+
+
+def test_scan_yields_every_row(store):
+    async def run():
+        await store.batch_set({"1.Cog": {"a": 1}, "2.Other": {"b": 2}})
+        return {key: value async for key, value in store.scan()}
+
+    assert asyncio.run(run()) == {"1.Cog": {"a": 1}, "2.Other": {"b": 2}}
+
+
+def test_range_reads_by_guild_and_cog(store):
+    async def run():
+        await store.batch_set(
+            {"1.Cog": {"a": 1}, "1.Other": {"b": 1}, "2.Cog": {"a": 2}, "3.Other": {}}
+        )
+        by_guild = await store.get_guild(1)
+        by_cog = await store.get_cog("Cog")
+        deleted = await store.delete_guild(1)
+        return by_guild, by_cog, deleted, {key async for key, _ in store.scan()}
+
+    by_guild, by_cog, deleted, remaining = asyncio.run(run())
+    assert by_guild == {"1.Cog": {"a": 1}, "1.Other": {"b": 1}}
+    assert by_cog == {"1.Cog": {"a": 1}, "2.Cog": {"a": 2}}
+    assert sorted(deleted) == ["1.Cog", "1.Other"]
+    assert remaining == {"2.Cog", "3.Other"}
+
+
+def test_deleting_a_guild_invalidates_its_configs(engine):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    cog_config_store = CogConfigStore(
+        store, logger=logging.getLogger("test"), cache=TTLCache(100, 60)
+    )
+    cog = SimpleNamespace(qualified_name="Cog")
+    invalidated = []
+    cog_config_store.subscribe(cog, invalidated.append)
+
+    async def run():
+        await store.batch_set({"1.Cog": {"a": 1}, "1.Other": {}, "2.Cog": {"a": 2}})
+        assert await cog_config_store.get_guild_configs(1) == {
+            "Cog": {"a": 1},
+            "Other": {},
+        }
+        assert await cog_config_store.get_all_cog_configs(cog) == {
+            1: {"a": 1},
+            2: {"a": 2},
+        }
+        assert sorted(await cog_config_store.delete_guild_configs(1)) == [
+            "Cog",
+            "Other",
+        ]
+        return await cog_config_store.get_cog_config([1, 2], cog)
+
+    assert asyncio.run(run()) == {2: {"a": 2}}
+    assert invalidated == [1]
+
+
+def test_preloaded_configs_are_served_without_queries(engine):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    cog_config_store = CogConfigStore(store, logger=logging.getLogger("test"))
+    cogs = [SimpleNamespace(qualified_name=f"Cog{n}") for n in range(8)]
+
+    async def run():
+        await store.batch_set(
+            {
+                f"{guild_id}.{cog.qualified_name}": {"value": guild_id}
+                for guild_id in range(100)
+                for cog in cogs[:4]
+            }
+        )
+        statements = record_statements(engine)
+        await cog_config_store.preload(list(range(100)))
+        for cog in cogs:
+            await cog_config_store.get_cog_config(list(range(100)), cog)
+        assert len(statements) == 1
+        # written and invalidated keys are not served from the snapshot anymore
+        await store.set("1.Cog0", {"value": -1})
+        cog_config_store.invalidate("1.Cog0")
+        assert await cog_config_store.get_cog_config([1], cogs[0]) == {1: {"value": -1}}
+        # neither are guilds which were not preloaded
+        await store.set("100.Cog0", {"value": 100})
+        assert await cog_config_store.get_cog_config([100], cogs[0]) == {
+            100: {"value": 100}
+        }
+        return await cog_config_store.get_cog_config([1, 2], cogs[1])
+
+    assert asyncio.run(run()) == {1: {"value": 1}, 2: {"value": 2}}
+
+
+class DroppingConnection:
+    """A LISTEN connection which delivers no notifications until it drops"""
+
+    def __init__(self):
+        self.dropped = asyncio.Event()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, query):
+        pass
+
+    async def notifies(self):
+        await self.dropped.wait()
+        raise psycopg.OperationalError("connection dropped")
+        yield
+
+
+def test_listener_resyncs_the_snapshot_only_after_reconnecting(engine, monkeypatch):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    cog_config_store = CogConfigStore(store, logger=logging.getLogger("test"))
+    cogs = [SimpleNamespace(qualified_name=f"Cog{n}") for n in range(2)]
+    connections = []
+    connected = asyncio.Queue()
+
+    async def connect(url, autocommit):
+        connections.append(DroppingConnection())
+        connected.put_nowait(None)
+        return connections[-1]
+
+    monkeypatch.setattr(psycopg.AsyncConnection, "connect", staticmethod(connect))
+    invalidated = asyncio.Queue()
+    cog_config_store.subscribe(cogs[1], invalidated.put_nowait)
+    listener = ConfigChangeListener(
+        engine, cog_config_store, logger=logging.getLogger("test"), reconnect_delay=0
+    )
+
+    async def run():
+        await store.batch_set({"1.Cog0": {"value": 0}, "1.Cog1": {"value": 0}})
+        await cog_config_store.preload([1])
+        listener.start()
+        await connected.get()
+        await asyncio.sleep(0.01)
+        # the first connect does not drop the snapshot
+        assert invalidated.empty()
+        statements = record_statements(engine)
+        assert await cog_config_store.get_cog_config([1], cogs[0]) == {1: {"value": 0}}
+        assert statements == []
+        # written while the connection is down, without a notification
+        await store.set("1.Cog1", {"value": 1})
+        statements.clear()
+        connections[0].dropped.set()
+        assert await invalidated.get() is None
+        # preloaded again, by one query
+        assert len(statements) == 1
+        result = await cog_config_store.get_cog_config([1], cogs[1])
+        assert len(statements) == 1
+        await listener.stop()
+        return result
+
+    assert asyncio.run(run()) == {1: {"value": 1}}
+
+
+class EncodedConfig(CogConfiguration):
+    members: set[int] = set()
+    channels: dict[int, str] = {}
+
+
+def test_configs_are_encoded_once(engine, monkeypatch):
+    store = AsyncSqlAlchemyKvJsonStore(engine)
+    cog_config_store = CogConfigStore(
+        store, logger=logging.getLogger("test"), cache=TTLCache(100, 60)
+    )
+    cog = SimpleNamespace(qualified_name="Cog")
+    guild = SimpleNamespace(id=1, name="guild")
+    config = EncodedConfig(members={3, 1, 2}, channels={5: "five"})
+    encodes = []
+    encode = serialization._encode
+    monkeypatch.setattr(
+        serialization, "_encode", lambda value: encodes.append(value) or encode(value)
+    )
+
+    async def run():
+        await cog_config_store.set_cog_config(cog, guild, config)
+        cached = await cog_config_store.get_cog_config([1], cog)
+        cog_config_store.invalidate("1.Cog")
+        return cached, await cog_config_store.get_cog_config([1], cog)
+
+    cached, stored = asyncio.run(run())
+    assert len(encodes) == 1
+    assert cached == stored == {1: {"members": [1, 2, 3], "channels": {"5": "five"}}}
+    assert EncodedConfig.parse_obj(stored[1]) == config
+
+
+def test_configs_track_their_changes(engine):
+    config = EncodedConfig.parse_obj({"members": [1], "channels": {"5": "five"}})
+    # no store holds a new config yet
+    assert config.dirty
+    config.mark_clean()
+    generation = config.generation
+    config.members.add(2)
+    assert config.dirty and config.generation == generation + 1
+    config.mark_clean()
+    config.channels.pop(5)
+    assert config.dirty
+    config.mark_clean()
+    copy = config.copy(update={"members": {7}})
+    copy.mark_clean()
+    copy.channels[6] = "six"
+    # the copy has dicts of its own
+    assert copy.dirty and not config.dirty
+    assert config.channels == {}
+
+    cog_config_store = CogConfigStore(
+        AsyncSqlAlchemyKvJsonStore(engine), logger=logging.getLogger("test")
+    )
+    cog = SimpleNamespace(qualified_name="Cog")
+    statements = record_statements(engine)
+    asyncio.run(cog_config_store.batch_set_cog_config(cog, {1: config, 2: copy}))
+    # only the dirty config was written, and it is clean now
+    assert len(statements) == 1
+    assert not copy.dirty
+    assert asyncio.run(cog_config_store.get_cog_config([1, 2], cog)) == {
+        2: {"members": [7], "channels": {"6": "six"}}
+    }
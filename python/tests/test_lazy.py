@@ -0,0 +1,56 @@
+import asyncio
+import sys
+import types
+
+import pytest
+from derpz_botlib import lazy
+
+
+@pytest.fixture
+def fake_module(monkeypatch):
+    """A module which is only importable, not imported"""
+    imports = []
+
+    class Finder:
+        @staticmethod
+        def find_spec(name, path=None, target=None):
+            if name != "heavy_dependency":
+                return None
+            return importlib_util.spec_from_loader(name, Loader())
+
+    class Loader:
+        def create_module(self, spec):
+            return None
+
+        def exec_module(self, module):
+            imports.append(module.__name__)
+            module.parse = lambda text: text.upper()
+
+    import importlib.util as importlib_util
+
+    monkeypatch.setattr(sys, "meta_path", [Finder, *sys.meta_path])
+    monkeypatch.delitem(sys.modules, "heavy_dependency", raising=False)
+    monkeypatch.setattr(lazy, "_lazy_modules", {})
+    return imports
+
+
+def test_lazy_modules_are_imported_on_first_use(fake_module):
+    heavy_dependency = lazy.lazy_import("heavy_dependency")
+    assert lazy.lazy_import("heavy_dependency") is heavy_dependency
+    assert fake_module == [] and not heavy_dependency.is_loaded
+    assert heavy_dependency.parse("text") == "TEXT"
+    assert heavy_dependency.parse("again") == "AGAIN"
+    assert fake_module == ["heavy_dependency"]
+    assert isinstance(sys.modules["heavy_dependency"], types.ModuleType)
+
+
+def test_warming_imports_in_the_background(fake_module):
+    heavy_dependency = lazy.lazy_import("heavy_dependency")
+    broken = lazy.lazy_import("not_a_module_at_all")
+    timings = asyncio.run(lazy.warm_lazy_imports())
+    assert list(timings) == ["heavy_dependency"]
+    assert heavy_dependency.is_loaded and not broken.is_loaded
+    with pytest.raises(ImportError):
+        broken.anything
+    # nothing left to import
+    assert asyncio.run(lazy.warm_lazy_imports()) == {}
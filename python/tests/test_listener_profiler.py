@@ -0,0 +1,80 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import disnake
+import pytest
+from derpz_botlib.bot_classes import LoggedBot
+from derpz_botlib.listener_profiler import SteppedCoroutine
+from disnake.ext import commands
+
+
+async def busy_then_sleep(busy: float, sleep: float, result=None):
+    end = time.perf_counter() + busy
+    while time.perf_counter() < end:
+        pass
+    await asyncio.sleep(sleep)
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def test_stepped_coroutines_split_running_from_awaiting():
+    async def run():
+        stepped = SteppedCoroutine(busy_then_sleep(0.05, 0.1, "done"))
+        start = time.perf_counter()
+        assert await stepped == "done"
+        seconds = time.perf_counter() - start
+        with pytest.raises(ValueError):
+            await SteppedCoroutine(busy_then_sleep(0, 0, ValueError()))
+        task = asyncio.create_task(SteppedCoroutine(busy_then_sleep(0, 10)).__await__())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return stepped.loop_seconds, seconds
+
+    loop_seconds, seconds = asyncio.run(run())
+    assert 0.05 <= loop_seconds < 0.08
+    assert seconds >= 0.15
+
+
+class ChattyCog(commands.Cog):
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        await busy_then_sleep(0.02, 0.02)
+
+
+def test_bot_profiles_listeners(monkeypatch):
+    monkeypatch.setenv("LISTENER_PROFILE_SAMPLE_RATE", "1")
+    monkeypatch.setenv("LISTENER_SLOW_SECONDS", "10")
+
+    async def run():
+        bot = LoggedBot(
+            command_prefix=commands.when_mentioned, intents=disnake.Intents.none()
+        )
+        bot.add_cog(ChattyCog())
+        message = SimpleNamespace(
+            guild=SimpleNamespace(id=1), channel=SimpleNamespace(id=2)
+        )
+        bot.dispatch("message", message)
+        await asyncio.sleep(0.2)
+        # not sampled, but slow
+        bot.listener_profiler.sample_rate = 0
+        bot.listener_profiler.slow_seconds = 0.01
+        bot.dispatch("message", message)
+        await asyncio.sleep(0.2)
+        await bot.close()
+        return bot.listener_profiler
+
+    profiler = asyncio.run(run())
+    calls = profiler.slowest_calls(prefix="ChattyCog")
+    [sampled] = [call for call in calls if call.loop_seconds is not None]
+    [slow] = [call for call in calls if call.loop_seconds is None]
+    assert (sampled.listener, sampled.event) == ("ChattyCog.on_message", "on_message")
+    assert (sampled.guild_id, sampled.channel_id) == (1, 2)
+    assert 0.02 <= sampled.loop_seconds < sampled.seconds
+    assert slow.seconds >= 0.04
+    report = profiler.report("ChattyCog")
+    assert report.startswith("ChattyCog.on_message (on_message) n=2")
+    assert "1 sampled" in report and "guild=1 channel=2" in report
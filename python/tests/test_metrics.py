@@ -0,0 +1,246 @@
+import asyncio
+import gc
+import socket
+from types import SimpleNamespace
+
+import aiohttp
+import disnake
+import pytest
+import sqlalchemy
+from derpz_botlib.bot_classes import LoggedBot
+from derpz_botlib.command_metrics import CommandMetrics
+from derpz_botlib.database.db import create_engine_from_url
+from derpz_botlib.database.instrumentation import (
+    instrument_engine,
+    instrumented,
+    set_db_cog,
+)
+from derpz_botlib.metrics import MetricsRegistry
+from disnake.ext import commands
+from disnake.ext.commands.view import StringView
+
+
+def test_prometheus_rendering():
+    registry = MetricsRegistry()
+    registry.counter("events", "Events seen", ("kind",)).inc(kind="a")
+    registry.counter("events", "Events seen", ("kind",)).inc(2, kind='b"')
+    registry.gauge("queue", "Queue length").set(3)
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render_prometheus().splitlines() == [
+        "# HELP events Events seen",
+        "# TYPE events counter",
+        'events_total{kind="a"} 1',
+        'events_total{kind="b\\""} 2',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+        "# HELP queue Queue length",
+        "# TYPE queue gauge",
+        "queue 3",
+    ]
+
+
+def test_registry_rejects_mismatched_metrics():
+    registry = MetricsRegistry()
+    counter = registry.counter("events", "Events seen", ("kind",))
+    with pytest.raises(ValueError):
+        counter.inc(other="a")
+    with pytest.raises(ValueError):
+        registry.gauge("events", "Events seen")
+
+
+def test_histogram_quantiles():
+    histogram = MetricsRegistry().histogram("h", "h", buckets=(1, 2, 3, 4))
+    for value in (0.5, 1.5, 2.5, 3.5):
+        histogram.observe(value)
+    assert histogram.get().quantile(0.5) == 2
+    assert histogram.get().quantile(1) == 4
+
+
+class ThingManager:
+    def __init__(self, engine):
+        self.engine = engine
+
+    @instrumented
+    async def count_things(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(sqlalchemy.text("SELECT 1"))
+
+
+def test_instrumented_engine_labels_statements(tmp_path):
+    registry = MetricsRegistry()
+    engine = create_engine_from_url(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+    instrument_engine(engine, registry)
+    # instrumenting twice does not count everything twice
+    instrument_engine(engine, registry)
+    manager = ThingManager(engine)
+
+    async def command():
+        set_db_cog("ThingCog")
+        await manager.count_things()
+        await manager.count_things()
+
+    async def run():
+        await asyncio.create_task(command())
+        async with engine.connect() as conn:
+            await conn.execute(sqlalchemy.text("SELECT 1"))
+            with pytest.raises(sqlalchemy.exc.OperationalError):
+                await conn.execute(sqlalchemy.text("SELECT * FROM missing"))
+        await engine.dispose()
+        # the pool is replaced on dispose, its checkouts are still timed
+        await manager.count_things()
+        await engine.dispose()
+
+    asyncio.run(run())
+    statements = registry.get("db_statement_seconds")
+    assert statements.get(cog="ThingCog", method="ThingManager.count_things").count == 2
+    assert statements.get(cog="none", method="none").count == 1
+    assert statements.get(cog="none", method="ThingManager.count_things").count == 1
+    assert registry.get("db_statement_errors").value(cog="none", method="none")
+    assert registry.get("db_pool_checkout_seconds").get().count == 4
+    assert registry.get("db_pool_connect_seconds").get().count >= 1
+    assert registry.get("db_pool_checked_out").value() == 0
+    rendered = registry.render_prometheus().splitlines()
+    assert "db_pool_size" in "\n".join(rendered)
+    assert "# TYPE db_statement_errors counter" in rendered
+    assert 'db_statement_errors_total{cog="none",method="none"} 1' in rendered
+
+
+def test_bound_metrics_record_like_the_metric():
+    registry = MetricsRegistry()
+    counter = registry.counter("events", "Events seen", ("kind",))
+    gauge = registry.gauge("running", "Running", ("kind",))
+    histogram = registry.histogram("latency_seconds", "Latency", ("kind",))
+    counter.bind(kind="a").inc()
+    counter.inc(kind="a")
+    running = gauge.bind(kind="a")
+    running.inc()
+    running.inc()
+    running.dec()
+    histogram.bind(kind="a").observe(0.5)
+    assert counter.value(kind="a") == 2
+    assert gauge.value(kind="a") == 1
+    assert histogram.get(kind="a").count == 1
+    with pytest.raises(ValueError):
+        counter.bind(other="a")
+
+
+def test_command_metrics_bucket_guilds():
+    command_metrics = CommandMetrics(MetricsRegistry(), max_guild_buckets=2)
+    assert [command_metrics.guild_bucket(guild) for guild in (1, 2, 3, None, 1)] == [
+        "1",
+        "2",
+        "other",
+        "dm",
+        "1",
+    ]
+
+    @commands.command()
+    async def ping(ctx):
+        pass
+
+    metrics = command_metrics.command(ping, 1)
+    # bound once per command and bucket
+    assert command_metrics.command(ping, 1) is metrics
+    assert command_metrics.command(ping, 3) is command_metrics.command(ping, 4)
+    assert metrics.latency.labelvalues == ("ping", "1")
+
+
+def test_command_metrics_forget_reloaded_listeners_and_commands():
+    command_metrics = CommandMetrics(MetricsRegistry())
+
+    def make_listener():
+        # what reloading its extension does to a listener
+        async def on_thing(value):
+            pass
+
+        return on_thing
+
+    listener = make_listener()
+    metrics = command_metrics.listener(listener, "on_thing")
+    assert command_metrics.listener(listener, "on_thing") is metrics
+    reloaded = make_listener()
+    reloaded_metrics = command_metrics.listener(reloaded, "on_thing")
+    # the same series
+    assert reloaded_metrics.latency.labelvalues == metrics.latency.labelvalues
+
+    @commands.command()
+    async def ping(ctx):
+        pass
+
+    command_metrics.command(ping, 1)
+    del listener, ping
+    gc.collect()
+    assert list(command_metrics._listeners) == [reloaded]
+    assert len(command_metrics._commands) == 0
+
+
+class TimedCog(commands.Cog):
+    @commands.command()
+    async def fine(self, ctx):
+        pass
+
+    @commands.command()
+    async def broken(self, ctx):
+        raise ValueError("broken")
+
+    @commands.Cog.listener()
+    async def on_thing(self, value):
+        if value is None:
+            raise ValueError("no value")
+
+
+def test_bot_times_commands_and_listeners(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setenv("METRICS_PORT", str(port))
+
+    async def run():
+        bot = LoggedBot(
+            command_prefix=commands.when_mentioned, intents=disnake.Intents.none()
+        )
+        monkeypatch.setattr(bot, "on_error", lambda *args, **kwargs: asyncio.sleep(0))
+        bot.add_cog(TimedCog())
+        await bot.start_metrics_server()
+        for name, guild in [("fine", 5), ("broken", 5), ("fine", None)]:
+            message = SimpleNamespace(
+                guild=guild and SimpleNamespace(id=guild), content=name, _state=None
+            )
+            ctx = commands.Context(
+                message=message,
+                bot=bot,
+                view=StringView(name),
+                prefix="",
+                command=bot.get_command(name),
+                invoked_with=name,
+            )
+            await bot.invoke(ctx)
+        bot.dispatch("thing", 1)
+        bot.dispatch("thing", None)
+        await asyncio.sleep(0.1)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                scraped = await response.text()
+        await bot.close()
+        return bot.metrics, scraped
+
+    registry, scraped = asyncio.run(run())
+    latency = registry.get("command_latency_seconds")
+    assert latency.get(command="fine", guild="5").count == 1
+    assert latency.get(command="fine", guild="dm").count == 1
+    assert registry.get("command_errors").value(command="broken", guild="5") == 1
+    assert registry.get("command_errors").value(command="fine", guild="5") == 0
+    assert registry.get("commands_in_flight").value(command="broken", guild="5") == 0
+    listener = dict(listener="TimedCog.on_thing", event="on_thing")
+    assert registry.get("listener_latency_seconds").get(**listener).count == 2
+    assert registry.get("listener_errors").value(**listener) == 1
+    assert 'command_errors_total{command="broken",guild="5"} 1' in scraped
@@ -0,0 +1,33 @@
+import asyncio
+
+from derpz_botlib.pipeline import KeyedPipeline
+
+
+def test_pipeline_is_concurrent_but_ordered_per_key():
+    async def run():
+        pipeline = KeyedPipeline(concurrency=3, max_pending=4)
+        running, most_running, finished = set(), 0, []
+
+        async def handle(key, n):
+            nonlocal most_running
+            running.add((key, n))
+            most_running = max(most_running, len(running))
+            # later ones finish first unless they are kept in order
+            await asyncio.sleep(0.01 * (5 - n))
+            running.discard((key, n))
+            finished.append((key, n))
+            if (key, n) == ("a", 1):
+                raise RuntimeError("logged, and the next one still runs")
+
+        for n in range(5):
+            for key in ("a", "b", "c", "d"):
+                await pipeline.submit(key, lambda key=key, n=n: handle(key, n))
+                assert pipeline.pending <= 4
+        await pipeline.join()
+
+        assert most_running == 3
+        for key in ("a", "b", "c", "d"):
+            assert [n for k, n in finished if k == key] == list(range(5))
+        assert pipeline._last_by_key == {}
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+import asyncio
+from types import SimpleNamespace
+
+import disnake
+import pytest
+from derpz_botlib.discord_utils.reactions import add_reaction_by_id
+
+
+def test_reactions_do_not_fetch_unless_rejected():
+    async def run():
+        calls = []
+
+        class Message:
+            def __init__(self, kind, status=None, code=0):
+                self.kind, self.status, self.code = kind, status, code
+
+            async def add_reaction(self, emoji):
+                calls.append((self.kind, emoji))
+                if self.status is not None:
+                    response = SimpleNamespace(status=self.status, reason="")
+                    raise disnake.HTTPException(
+                        response, dict(code=self.code, message="rejected")
+                    )
+
+        async def fetch_message(message_id):
+            calls.append(("fetch", message_id))
+            return Message("fetched")
+
+        status, code = None, 0
+        channel = SimpleNamespace(
+            get_partial_message=lambda message_id: Message("partial", status, code),
+            fetch_message=fetch_message,
+        )
+        client = SimpleNamespace(get_message={}.get)
+        await add_reaction_by_id(client, channel, 1, "x")
+        assert calls == [("partial", "x")]
+
+        calls.clear()
+        status = 400
+        message = await add_reaction_by_id(client, channel, 1, "x")
+        assert message.kind == "fetched"
+        assert calls == [("partial", "x"), ("fetch", 1), ("fetched", "x")]
+
+        # a refetch cannot make an unknown emoji known
+        calls.clear()
+        code = 10014
+        with pytest.raises(disnake.HTTPException) as raised:
+            await add_reaction_by_id(client, channel, 1, "x")
+        assert raised.value.code == 10014
+        assert calls == [("partial", "x")]
+
+        calls.clear()
+        status, code = 404, 10008
+        with pytest.raises(disnake.HTTPException):
+            await add_reaction_by_id(client, channel, 1, "x")
+        assert calls == [("partial", "x")]
+
+    asyncio.run(run())
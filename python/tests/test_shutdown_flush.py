@@ -0,0 +1,163 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import disnake
+import pytest
+from derpz_botlib.bot_classes import ConfigurableCogsBot
+from derpz_botlib.cog import DatabaseConfigurableCog
+from derpz_botlib.database.db import create_engine_from_url
+from derpz_botlib.database.serialization import encode_config
+from derpz_botlib.database.storage import CogConfiguration
+from disnake.ext import commands
+
+
+class Config(CogConfiguration):
+    members: set[int] = set()
+
+
+class FirstCog(DatabaseConfigurableCog[Config]):
+    def __init__(self, bot):
+        super().__init__(bot, Config)
+
+
+class SecondCog(DatabaseConfigurableCog[Config]):
+    def __init__(self, bot):
+        super().__init__(bot, Config)
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    return f"sqlite+aiosqlite:///{tmp_path / 'kv.db'}"
+
+
+async def make_bot(db_url: str) -> ConfigurableCogsBot:
+    bot = ConfigurableCogsBot(
+        command_prefix=commands.when_mentioned,
+        intents=disnake.Intents.none(),
+        engine=create_engine_from_url(db_url),
+    )
+    await bot._init_db()
+    return bot
+
+
+async def stored_configs(bot: ConfigurableCogsBot) -> dict:
+    return await bot.kv_store.batch_get(
+        ["1.FirstCog", "2.FirstCog", "3.FirstCog", "4.FirstCog", "1.SecondCog"]
+    )
+
+
+def test_close_flushes_dirty_configs(db_url):
+    async def run():
+        bot = await make_bot(db_url)
+        first, second = FirstCog(bot), SecondCog(bot)
+        bot.add_cog(first)
+        bot.add_cog(second)
+        await asyncio.sleep(0)
+        first.config[1] = Config(members={1})
+        first._stored_configs[2] = encode_config(Config(members={2}))
+        first._stored_configs[4] = encode_config(Config(members={4}))
+        # guild 2 is as it was loaded, and guild 3 was never changed from the
+        # default, so neither is written
+        first.get_guild_config(2)
+        first.get_guild_config(3)
+        first.get_guild_config(4).members.add(5)
+        second.config[1] = Config(members={3})
+        await bot.close()
+        assert await stored_configs(bot) == {
+            "1.FirstCog": {"members": [1]},
+            "4.FirstCog": {"members": [4, 5]},
+            "1.SecondCog": {"members": [3]},
+        }
+        await bot.engine.dispose()
+        return bot.config_flush_report
+
+    report = asyncio.run(run())
+    assert report.flushed == {"FirstCog": 2, "SecondCog": 1}
+    assert report.dropped == {}
+
+
+def test_close_drops_flushes_past_the_deadline(db_url):
+    async def run():
+        bot = await make_bot(db_url)
+        bot.config_shutdown_timeout = 0.1
+        first, second = FirstCog(bot), SecondCog(bot)
+        bot.add_cog(first)
+        bot.add_cog(second)
+        await asyncio.sleep(0)
+        first.config = {1: Config(members={1})}
+        second.config = {1: Config(members={3})}
+
+        async def hang(dirty):
+            await asyncio.sleep(60)
+
+        second.flush_guild_configs = hang
+        start = time.perf_counter()
+        await bot.close()
+        assert time.perf_counter() - start < 5
+        assert await stored_configs(bot) == {"1.FirstCog": {"members": [1]}}
+        await bot.engine.dispose()
+        return bot.config_flush_report
+
+    report = asyncio.run(run())
+    assert report.flushed == {"FirstCog": 1}
+    assert report.dropped == {"SecondCog": 1}
+
+
+def test_write_behind_queue_is_closed_after_the_cogs_flushed(db_url, monkeypatch):
+    monkeypatch.setenv("CONFIG_WRITE_BEHIND", "1")
+
+    async def run():
+        bot = await make_bot(db_url)
+        first = FirstCog(bot)
+        bot.add_cog(first)
+        await asyncio.sleep(0)
+        await first.save_guild_config(
+            SimpleNamespace(id=1, name="guild"), Config(members={1})
+        )
+        first.config[2] = Config(members={2})
+        events = []
+        flush_guild_configs = first.flush_guild_configs
+        close = bot.cog_config_store.close
+
+        async def slow_flush(dirty):
+            await asyncio.sleep(0.05)
+            events.append("flushed")
+            return await flush_guild_configs(dirty)
+
+        async def record_close():
+            events.append("closed")
+            await close()
+
+        first.flush_guild_configs = slow_flush
+        bot.cog_config_store.close = record_close
+        await bot.close()
+        assert events == ["flushed", "closed"]
+        assert await stored_configs(bot) == {
+            "1.FirstCog": {"members": [1]},
+            "2.FirstCog": {"members": [2]},
+        }
+        await bot.engine.dispose()
+        return bot.config_flush_report
+
+    report = asyncio.run(run())
+    assert report.flushed == {"FirstCog": 1, "write-behind queue": 1}
+    assert report.dropped == {}
+
+
+def test_unloading_a_cog_schedules_a_flush(db_url):
+    async def run():
+        bot = await make_bot(db_url)
+        first = FirstCog(bot)
+        bot.add_cog(first)
+        await asyncio.sleep(0)
+        first.config = {1: Config(members={1})}
+        bot.remove_cog("FirstCog")
+        # the flush runs in the background; close() waits for it
+        await bot.close()
+        assert await stored_configs(bot) == {"1.FirstCog": {"members": [1]}}
+        await bot.engine.dispose()
+        return bot.config_flush_report
+
+    report = asyncio.run(run())
+    assert report.flushed == {"FirstCog": 1}
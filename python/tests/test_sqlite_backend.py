@@ -0,0 +1,77 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import sqlalchemy
+from derpz_botlib.database.db import create_engine_from_url
+
+# the plugins register their tables on SqlAlchemyBase when imported
+from math_tavern_bot_py.plugins.plugin_goal_setting import GoalManager
+from math_tavern_bot_py.plugins.plugin_remind_me import ReminderManager
+from math_tavern_bot_py.plugins.plugin_sticky_roles import UserRoleCacheManager
+
+
+def test_file_databases_use_wal(tmp_path):
+    engine = create_engine_from_url(f"sqlite:///{tmp_path / 'bot.db'}")
+
+    async def journal_mode():
+        async with engine.connect() as conn:
+            result = await conn.execute(sqlalchemy.text("PRAGMA journal_mode"))
+            mode = result.scalar_one()
+        await engine.dispose()
+        return mode
+
+    assert asyncio.run(journal_mode()) == "wal"
+
+
+def test_reminder_manager(engine):
+    manager = ReminderManager(engine)
+    remind_at = datetime.datetime(2030, 1, 1, 12, 0)
+
+    async def run():
+        first = await manager.create_reminder(1, remind_at, "first")
+        second = await manager.create_reminder(1, remind_at, "second")
+        assert (first.user_reminder_id, second.user_reminder_id) == (1, 2)
+        assert await manager.count_reminders(1) == 2
+        await manager.delete_reminder_by_reminder_id(first.id)
+        reminders = await manager.get_reminders(1)
+        assert [reminder.reminder for reminder in reminders] == ["second"]
+
+    asyncio.run(run())
+
+
+def test_goal_manager(engine):
+    manager = GoalManager(engine)
+    end_dt = datetime.datetime(2030, 1, 1, 12, 0)
+
+    async def run():
+        await manager.create_goal(1, "read", "read a book", end_dt)
+        assert (await manager.get_goal(1, "read")).goal_description == "read a book"
+        await manager.delete_goal(1, "read")
+        assert await manager.get_goals(1) == []
+
+    asyncio.run(run())
+
+
+def test_user_role_cache_manager(engine):
+    manager = UserRoleCacheManager(engine)
+    everyone = SimpleNamespace(id=1, name="@everyone")
+    guild = SimpleNamespace(id=10, name="guild", default_role=everyone)
+    member = SimpleNamespace(
+        id=100,
+        name="user",
+        discriminator=0,
+        bot=False,
+        guild=guild,
+        roles=[everyone, SimpleNamespace(id=2, name="role")],
+    )
+
+    async def run():
+        await manager.upsert_member(member)
+        member.roles.append(SimpleNamespace(id=3, name="other role"))
+        await manager.upsert_member(member)
+        return await manager.get_member(member.id, guild.id)
+
+    cached = asyncio.run(run())
+    assert cached.role_ids == [2, 3]
+    assert cached.role_names == ["role", "other role"]
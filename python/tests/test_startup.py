@@ -0,0 +1,122 @@
+import asyncio
+import sys
+import time
+
+import disnake
+from derpz_botlib.bot_classes import LoggedBot
+from derpz_botlib.startup import run_cog_loads
+from disnake.ext import commands
+
+EXTENSION = """
+import asyncio
+from disnake.ext import commands
+
+loads = []
+# how many cog_loads were running at once, at most
+running = most_running = 0
+
+
+async def slow_load(name):
+    global running, most_running
+    running += 1
+    most_running = max(most_running, running)
+    await asyncio.sleep(0.5)
+    running -= 1
+    loads.append(name)
+
+
+class SlowCog(commands.Cog):
+    async def cog_load(self):
+        await slow_load("SlowCog")
+
+
+class OtherSlowCog(commands.Cog):
+    async def cog_load(self):
+        await slow_load("OtherSlowCog")
+
+
+def setup(bot):
+    bot.add_cog(SlowCog())
+    bot.add_cog(OtherSlowCog())
+"""
+
+
+def make_cog(name: str, events: list, *, after=(), delay=0.0, timeout=None, error=None):
+    async def cog_load(self):
+        events.append(f"start {name}")
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        events.append(f"end {name}")
+
+    cog_class = type(
+        name,
+        (commands.Cog,),
+        dict(cog_load=cog_load, cog_load_after=after, cog_load_timeout=timeout),
+    )
+    return cog_class()
+
+
+def test_cog_loads_run_concurrently_after_their_dependencies():
+    events = []
+    cogs = [
+        make_cog("Config", events, delay=0.1),
+        make_cog("Purge", events, after=("Config",)),
+        make_cog("Pin", events, delay=0.1),
+        make_cog("Slow", events, delay=5, timeout=0.1),
+        make_cog("Broken", events, error=ValueError("broken")),
+        make_cog("AfterBroken", events, after=("Broken",)),
+        make_cog("Missing", events, after=("Disabled",)),
+        make_cog("Loaded", events, after=("Admin",)),
+        make_cog("Egg", events, after=("Chicken",)),
+        make_cog("Chicken", events, after=("Egg",)),
+    ]
+    start = time.perf_counter()
+    report = asyncio.run(run_cog_loads(cogs, loaded=["Admin"], timeout=10))
+    assert time.perf_counter() - start < 1
+    assert set(report.loaded) == {"Config", "Purge", "Pin", "Loaded"}
+    assert set(report.failed) == {
+        "Slow",
+        "Broken",
+        "AfterBroken",
+        "Missing",
+        "Egg",
+        "Chicken",
+    }
+    assert report.failed["AfterBroken"] == "dependency Broken failed"
+    # Config and Pin ran at the same time, Purge only after Config
+    assert events.index("start Pin") < events.index("end Config")
+    assert events.index("end Config") < events.index("start Purge")
+    assert "start Egg" not in events and "start AfterBroken" not in events
+
+
+def test_extensions_are_loaded_once(tmp_path, monkeypatch):
+    (tmp_path / "startup_extension.py").write_text(EXTENSION)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    async def run():
+        bot = LoggedBot(
+            command_prefix=commands.when_mentioned, intents=disnake.Intents.none()
+        )
+        names = ["startup_extension", "missing_extension"]
+        # like on_ready firing again while the first one is still loading
+        first, second = await asyncio.gather(
+            bot.load_extensions_concurrently(names),
+            bot.load_extensions_concurrently(names),
+        )
+        assert bot.cogs_ready.is_set()
+        # and after a reconnect
+        third = await bot.load_extensions_concurrently(names)
+        extension = sys.modules["startup_extension"]
+        await bot.close()
+        return first, second, third, extension.most_running, extension.loads
+
+    first, second, third, most_running, loads = asyncio.run(run())
+    assert first is second
+    assert set(first.loaded) == {"SlowCog", "OtherSlowCog"}
+    assert list(first.failed) == ["missing_extension"]
+    # the cog_loads overlapped rather than running one after another
+    assert most_running == 2
+    assert third.loaded == {}
+    # every cog_load ran once, and not in a task of disnake's
+    assert sorted(loads) == ["OtherSlowCog", "SlowCog"]
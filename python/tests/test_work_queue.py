@@ -0,0 +1,91 @@
+import asyncio
+
+from derpz_botlib.work_queue import FanOut, InMemoryStreams, InMemoryWorkQueue
+
+
+def payloads(items):
+    return [item.payload for item in items]
+
+
+def test_fan_out():
+    async def run():
+        streams = InMemoryStreams()
+        publisher = InMemoryWorkQueue(streams, "sully")
+        once = [
+            InMemoryWorkQueue(streams, "sully", f"worker-{n}", fan_out=FanOut.ONCE)
+            for n in range(2)
+        ]
+        broadcast = [
+            InMemoryWorkQueue(streams, "sully", f"worker-{n}", fan_out=FanOut.BROADCAST)
+            for n in range(2)
+        ]
+        # groups only get what is published once they exist
+        for queue in once + broadcast:
+            assert await queue.read(block_seconds=0.01) == []
+        for payload in "abc":
+            await publisher.publish(payload)
+
+        assert payloads(await once[0].read(count=2)) == ["a", "b"]
+        assert payloads(await once[1].read()) == ["c"]
+        for queue in broadcast:
+            assert payloads(await queue.read()) == ["a", "b", "c"]
+
+        # a reader waits for the next entry
+        read = asyncio.create_task(once[0].read(block_seconds=1))
+        await asyncio.sleep(0)
+        await publisher.publish("d")
+        assert payloads(await read) == ["d"]
+
+    asyncio.run(run())
+
+
+def test_unacked_entries_are_reclaimed_until_given_up_on():
+    async def run():
+        streams = InMemoryStreams()
+        dead, alive = [
+            InMemoryWorkQueue(streams, "sully", name, max_deliveries=3)
+            for name in ("dead", "alive")
+        ]
+        await dead.read(block_seconds=0.01)
+        await dead.publish("done")
+        await dead.publish("lost")
+        done, lost = await dead.read()
+        await dead.ack(done.id)
+
+        assert await alive.reclaim(min_idle_seconds=60) == []
+        reclaimed = await alive.reclaim(min_idle_seconds=0)
+        assert [(item.id, item.payload, item.deliveries) for item in reclaimed] == [
+            (lost.id, "lost", 2)
+        ]
+        assert (await alive.reclaim(min_idle_seconds=0))[0].deliveries == 3
+        # the third delivery was the last one
+        assert await alive.reclaim(min_idle_seconds=0) == []
+        assert streams.stream("sully").groups["workers"].pending == {}
+
+    asyncio.run(run())
+
+
+def test_consume_yields_published_and_reclaimed_entries():
+    async def run():
+        streams = InMemoryStreams()
+        dead = InMemoryWorkQueue(streams, "sully", "dead")
+        alive = InMemoryWorkQueue(streams, "sully", "alive")
+        await dead.read(block_seconds=0.01)
+        await dead.publish("lost")
+        await dead.read()
+
+        consumed = []
+
+        async def consume():
+            async for item in alive.consume(reclaim_idle_seconds=0.05):
+                consumed.append(item.payload)
+                await alive.ack(item.id)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        await alive.publish("new")
+        await asyncio.sleep(0.1)
+        task.cancel()
+        assert consumed == ["new", "lost"]
+
+    asyncio.run(run())